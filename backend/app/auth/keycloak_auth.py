@@ -1,7 +1,14 @@
 from keycloak import KeycloakOpenID
 from fastapi import HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordBearer
+from jose import jwt, JWTError
+from collections import OrderedDict
+from typing import Any, Dict, Optional
 import os
+import time
+import asyncio
+import hashlib
+from ..services.metrics import metrics
 
 keycloak_openid = KeycloakOpenID(
     server_url=os.getenv("KEYCLOAK_URL"),
@@ -12,17 +19,178 @@ keycloak_openid = KeycloakOpenID(
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# 当前用户即令牌中的声明
+User = Dict[str, Any]
+
+
+class TokenInactiveError(Exception):
+    """令牌已失效或被吊销"""
+
+
+class TokenVerifier:
+    """令牌校验：用缓存的JWKS公钥离线验证签名，可选短TTL缓存的在线introspection"""
+
+    def __init__(self, client: KeycloakOpenID):
+        self.client = client
+        # offline: 只离线验签；introspect: 验签后再做在线introspection（结果短暂缓存），用于需要及时感知吊销的场景
+        self.mode = os.getenv("KEYCLOAK_VERIFY_MODE", "offline").lower()
+        self.algorithms = os.getenv("KEYCLOAK_ALGORITHMS", "RS256").split(",")
+        self.audience = os.getenv("KEYCLOAK_AUDIENCE") or None
+        self.jwks_refresh_interval = float(os.getenv("KEYCLOAK_JWKS_REFRESH_INTERVAL", "3600"))
+        self.jwks_min_refresh_interval = 30.0
+        self.introspect_ttl = float(os.getenv("KEYCLOAK_INTROSPECT_CACHE_TTL", "30"))
+        self.introspect_cache_size = int(os.getenv("KEYCLOAK_INTROSPECT_CACHE_SIZE", "10000"))
+        self._keys: Dict[str, Dict[str, Any]] = {}
+        self._keys_fetched_at = 0.0
+        self._introspect_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock: Optional[asyncio.Lock] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._last_latency_sample = 0.0
+        self._stats = {
+            "offline_verifications": 0,
+            "offline_seconds": 0.0,
+            "introspections": 0,
+            "introspection_seconds": 0.0,
+            "introspection_cache_hits": 0,
+            "jwks_refreshes": 0,
+        }
+
+    async def start(self):
+        """预取JWKS并启动后台定时刷新"""
+        try:
+            await self.refresh_keys()
+        except Exception as e:
+            print(f"获取Keycloak公钥失败: {str(e)}")
+        self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.jwks_refresh_interval)
+            try:
+                await self.refresh_keys()
+            except Exception as e:
+                print(f"刷新Keycloak公钥失败: {str(e)}")
+
+    async def refresh_keys(self, force: bool = False):
+        """从Keycloak拉取JWKS；force用于未知kid的情况，有最小刷新间隔防止被滥用"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            age = time.monotonic() - self._keys_fetched_at
+            if force and age < self.jwks_min_refresh_interval:
+                return
+            loop = asyncio.get_running_loop()
+            jwks = await loop.run_in_executor(None, self.client.certs)
+            self._keys = {
+                key["kid"]: key for key in jwks.get("keys", [])
+                if key.get("use", "sig") == "sig"
+            }
+            self._keys_fetched_at = time.monotonic()
+            self._stats["jwks_refreshes"] += 1
+
+    async def verify(self, token: str) -> Dict[str, Any]:
+        """校验令牌并返回其声明"""
+        claims = await self._verify_offline(token)
+        if self.mode == "introspect":
+            await self._introspect_cached(token, claims)
+        elif time.monotonic() - self._last_latency_sample > self.jwks_refresh_interval:
+            # 离线模式下偶尔在后台做一次introspection，用于估算节省的延迟
+            self._last_latency_sample = time.monotonic()
+            asyncio.ensure_future(self._sample_introspection(token))
+        return claims
+
+    async def _sample_introspection(self, token: str):
+        try:
+            await self._introspect(token)
+        except Exception:
+            pass
+
+    async def _verify_offline(self, token: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        header = jwt.get_unverified_header(token)
+        kid = header.get("kid")
+        if kid not in self._keys:
+            await self.refresh_keys(force=True)
+            if kid not in self._keys:
+                raise JWTError("未知的签名密钥")
+
+        claims = jwt.decode(
+            token,
+            self._keys[kid],
+            algorithms=self.algorithms,
+            audience=self.audience,
+            options={"verify_aud": self.audience is not None}
+        )
+        # 与introspection返回的结构保持一致
+        claims["active"] = True
+        self._stats["offline_verifications"] += 1
+        self._stats["offline_seconds"] += time.perf_counter() - started
+        return claims
+
+    async def _introspect_cached(self, token: str, claims: Dict[str, Any]):
+        """在线检查令牌是否已被吊销，结果在短TTL内缓存"""
+        cache_key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        now = time.monotonic()
+        cached = self._introspect_cache.get(cache_key)
+        if cached is not None and cached[0] > now:
+            self._stats["introspection_cache_hits"] += 1
+            active = cached[1]
+        else:
+            active = (await self._introspect(token)).get("active", False)
+            # 缓存时间不超过令牌自身的剩余有效期
+            ttl = min(self.introspect_ttl, max(0.0, claims.get("exp", 0) - time.time()))
+            self._introspect_cache[cache_key] = (now + ttl, active)
+            self._introspect_cache.move_to_end(cache_key)
+            while len(self._introspect_cache) > self.introspect_cache_size:
+                self._introspect_cache.popitem(last=False)
+        if not active:
+            raise TokenInactiveError()
+
+    async def _introspect(self, token: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        token_info = await loop.run_in_executor(None, self.client.introspect, token)
+        self._stats["introspections"] += 1
+        self._stats["introspection_seconds"] += time.perf_counter() - started
+        return token_info
+
+    def stats(self) -> Dict[str, Any]:
+        """返回校验统计，以及相对每次请求都在线introspection所节省的延迟估算"""
+        verifications = self._stats["offline_verifications"]
+        introspections = self._stats["introspections"]
+        offline_ms = self._stats["offline_seconds"] / verifications * 1000 if verifications else 0.0
+        introspection_ms = self._stats["introspection_seconds"] / introspections * 1000 if introspections else 0.0
+        network_avoided = verifications - (introspections if self.mode == "introspect" else 0)
+        return {
+            **self._stats,
+            "mode": self.mode,
+            "avg_offline_ms": offline_ms,
+            "avg_introspection_ms": introspection_ms,
+            "saved_ms_per_request": max(0.0, introspection_ms - offline_ms) * network_avoided / verifications
+            if verifications else 0.0,
+            "saved_seconds_total": max(0.0, introspection_ms - offline_ms) * network_avoided / 1000,
+        }
+
+
+token_verifier = TokenVerifier(keycloak_openid)
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         # 验证token
-        token_info = keycloak_openid.introspect(token)
-        if not token_info.get("active", False):
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token已失效",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        return token_info
+        with metrics.timer("auth"):
+            return await token_verifier.verify(token)
+    except TokenInactiveError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token已失效",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
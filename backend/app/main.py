@@ -1,16 +1,29 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import os
+import asyncio
 import uuid
-import json
-from typing import Optional
+from typing import List, Optional
 from .services.ai_service import AIService
-from .auth.keycloak_auth import get_current_user, User
+from .services.ingestion_queue import IngestionQueue
+from .services.http_client import http_client
+from .services.sse import sse_encoder
+from .services.provider_scheduler import PRIORITIES, AdmissionRejected
+from .services.reranker import RERANK_METHODS
+from .services.document_processor import RETRIEVAL_MODES
+from .services.embedding_backend import preload_embedding_backend
+from .services.metrics import RequestMetricsMiddleware, metrics
+from .auth.keycloak_auth import get_current_user, token_verifier, User
 
 app = FastAPI()
 ai_service = AIService()
 
+# 用 gunicorn --preload 启动时在主进程中加载编码模型，工作进程共享同一份模型权重
+if os.getenv("EMBEDDING_PRELOAD", "false").lower() == "true":
+    preload_embedding_backend()
+ingestion_queue = IngestionQueue(ai_service)
+
 # 配置CORS
 app.add_middleware(
     CORSMiddleware,
@@ -20,27 +33,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求ID与请求耗时统计，METRICS_ENABLED=false时不挂载
+if metrics.enabled:
+    app.add_middleware(RequestMetricsMiddleware, metrics=metrics)
+
+@app.on_event("startup")
+async def startup():
+    await token_verifier.start()
+    await ingestion_queue.start()
+    # 编码模型和向量库在后台初始化，不阻塞启动；可通过 /api/ready 查询是否就绪
+    ai_service.start_warm_up()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await token_verifier.stop()
+    await ingestion_queue.stop()
+    await http_client.close()
+    ai_service.shutdown()
+
+@app.get("/api/ready")
+async def ready():
+    """就绪检查：编码模型与向量库初始化完成前返回503"""
+    readiness = ai_service.readiness()
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=readiness)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus格式的各阶段耗时指标"""
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="未启用指标")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/api/models")
 async def get_models(current_user: User = Depends(get_current_user)):
     """获取可用的AI模型列表"""
     return await ai_service.model_manager.get_models()
 
-async def stream_response(generator):
-    """生成SSE响应"""
-    try:
-        async for chunk in generator:
-            if chunk:
-                # 确保chunk是字符串
-                if not isinstance(chunk, str):
-                    chunk = str(chunk)
-                # 发送SSE格式的数据
-                yield f"data: {json.dumps({'content': chunk})}\n\n"
-        # 发送结束标记
-        yield "data: [DONE]\n\n"
-    except Exception as e:
-        # 发送错误信息
-        yield f"data: {json.dumps({'error': str(e)})}\n\n"
-        yield "data: [DONE]\n\n"
+@app.get("/api/stats")
+async def get_stats(current_user: User = Depends(get_current_user)):
+    """获取检索与推理队列的运行统计"""
+    return {
+        **ai_service.stats(),
+        "ingestion": ingestion_queue.stats(),
+        "http_pools": http_client.stats(),
+        "sse": sse_encoder.stats(),
+        "auth": token_verifier.stats()
+    }
 
 @app.post("/api/search/stream")
 async def search_stream(
@@ -49,19 +87,52 @@ async def search_stream(
     model_name: str,
     document_id: Optional[str] = None,
     use_rag: bool = True,
+    document_ids: Optional[List[str]] = Query(None),
+    all_documents: bool = False,
+    k: int = Query(3, ge=1, le=50),
+    rerank: Optional[str] = None,
+    retrieval_mode: Optional[str] = None,
+    priority: str = "interactive",
     current_user: User = Depends(get_current_user)
 ):
-    """执行流式搜索查询"""
+    """执行流式搜索查询
+
+    可通过document_ids指定多个文档，或用all_documents在当前用户的全部文档中检索；
+    retrieval_mode为vector、lexical或hybrid（默认取RETRIEVAL_MODE）；
+    priority为interactive或background，模型提供商繁忙时返回429/503并带Retry-After。
+    """
+    if rerank is not None and rerank not in RERANK_METHODS:
+        raise HTTPException(status_code=400, detail=f"不支持的重排方式: {rerank}")
+    if retrieval_mode is not None and retrieval_mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的检索方式: {retrieval_mode}")
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"不支持的优先级: {priority}")
+    # 预计排队时间超出上限时立即拒绝，不再开始流式响应
+    try:
+        ai_service.scheduler.check(model, model_name, PRIORITIES[priority])
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)}
+        )
     try:
+        if all_documents:
+            document_ids = ingestion_queue.list_documents(current_user.get("sub"))
+        elif document_ids is None and document_id:
+            document_ids = [document_id]
         generator = ai_service.process_query_stream(
             query=query,
             model_provider=model,
             model_name=model_name,
-            document_id=document_id,
-            use_rag=use_rag
+            use_rag=use_rag,
+            document_ids=document_ids or [],
+            k=k,
+            rerank=rerank,
+            retrieval_mode=retrieval_mode,
+            user_id=current_user.get("sub"),
+            priority=PRIORITIES[priority]
         )
         return StreamingResponse(
-            stream_response(generator),
+            sse_encoder.stream(generator),
             media_type="text/event-stream"
         )
     except Exception as e:
@@ -86,42 +157,90 @@ async def process_document(
         
         # 保存文件
         with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        # 处理文档
-        result = ai_service.process_document(file_path, document_id)
+            while content := await file.read(1024 * 1024):
+                buffer.write(content)
         
-        # 如果指定了模型，使用AI分析文档
-        analysis = ""
-        if model and model_name:
-            async def get_analysis():
-                async for chunk in ai_service.process_query_stream(
-                    query="请总结这篇文档的主要内容",
-                    model_provider=model,
-                    model_name=model_name,
-                    document_id=document_id,
-                    use_rag=True
-                ):
-                    analysis += chunk
-                return analysis
-
-            analysis = await get_analysis()
+        # 提交后台处理，解析、向量化和摘要由工作协程完成
+        ingestion_queue.enqueue(
+            document_id,
+            file_path,
+            user_id=current_user.get("sub"),
+            model=model,
+            model_name=model_name
+        )
         
         return {
             "document_id": document_id,
-            "message": result,
-            "analysis": analysis
+            "status": "queued",
+            "message": "文档已加入处理队列"
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/documents/{document_id}/status")
+async def get_document_status(
+    document_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """查询文档处理进度"""
+    status = ingestion_queue.get_status(document_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="文档不存在")
+    return status
+
+@app.put("/api/documents/{document_id}")
+async def update_document(
+    document_id: str,
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """上传文档的新版本，只重新处理有变化的文本块"""
+    status = ingestion_queue.get_status(document_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="文档不存在")
+    if status["status"] not in ("completed", "failed"):
+        raise HTTPException(status_code=409, detail="文档正在处理中，请稍后再试")
+    file_extension = os.path.splitext(file.filename)[1]
+    file_path = f"documents/{document_id}{file_extension}"
+    # 新版本先写入临时文件，提交任务成功后再替换，提交失败时原文件保持不变
+    temp_path = f"documents/{document_id}.{uuid.uuid4().hex}.upload"
+    try:
+        os.makedirs("documents", exist_ok=True)
+        with open(temp_path, "wb") as buffer:
+            while content := await file.read(1024 * 1024):
+                buffer.write(content)
+
+        if not ingestion_queue.enqueue_update(document_id, file_path):
+            raise HTTPException(status_code=409, detail="文档正在处理中，请稍后再试")
+        # 替换文档文件（新版本的格式可能不同）；提交后到这里之间没有await，工作协程不会先读到文件
+        os.replace(temp_path, file_path)
+        for ext in ['.pdf', '.docx', '.txt']:
+            old_path = f"documents/{document_id}{ext}"
+            if old_path != file_path and os.path.exists(old_path):
+                os.remove(old_path)
+
+        return {
+            "document_id": document_id,
+            "status": "queued",
+            "message": "文档新版本已加入处理队列"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
 @app.delete("/api/documents/{document_id}")
 async def delete_document(
     document_id: str,
     current_user: User = Depends(get_current_user)
 ):
-    """删除文档"""
+    """删除文档；文档正在入库时返回409"""
+    # 先删除任务记录：排队中的任务随之取消，处理中的任务不能删除，否则工作进程会继续写入向量
+    if not ingestion_queue.remove(document_id):
+        raise HTTPException(status_code=409, detail="文档正在处理中，请稍后再试")
     try:
         # 删除文档文件
         for ext in ['.pdf', '.docx', '.txt']:
@@ -130,7 +249,9 @@ async def delete_document(
                 os.remove(file_path)
         
         # 删除向量存储中的文档数据
-        ai_service.delete_document(document_id)
+        await ai_service.ensure_ready()
+        # 向量、词法索引与缓存的删除会阻塞，放到线程池中执行，与入库路径一致
+        await asyncio.get_running_loop().run_in_executor(None, ai_service.delete_document, document_id)
         
         return {"message": "文档删除成功"}
     except Exception as e:
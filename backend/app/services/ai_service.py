@@ -1,16 +1,75 @@
-from typing import List, Optional, AsyncGenerator
+from typing import Callable, List, Optional, AsyncGenerator
 import os
-import json
-import aiohttp
+import time
+import asyncio
+import threading
+from .http_client import http_client
+from .sse import iter_lines, iter_sse_data, loads
 from .model_manager import ModelManager
 from .document_processor import DocumentProcessor
+from .response_cache import ResponseCache
+from .provider_scheduler import INTERACTIVE, ProviderScheduler
+from .provider_router import ProviderRouter
+from .metrics import metrics
 
 class AIService:
     def __init__(self):
         self.model_manager = ModelManager()
-        self.document_processor = DocumentProcessor()
+        # 文档处理器（编码模型、向量库连接）在首次使用或后台预热时才创建，进程启动后可以立即响应请求
+        self._document_processor: Optional[DocumentProcessor] = None
+        self._init_lock = threading.Lock()
+        self._warm_up_task: Optional[asyncio.Task] = None
+        self._warm_up = {"state": "cold", "seconds": None, "error": None}
+        self.response_cache = ResponseCache()
+        self.scheduler = ProviderScheduler()
+        self.router = ProviderRouter()
         self.deepseek_api_key = os.getenv("DEEPSEEK_API_KEY")
         self.groq_api_key = os.getenv("GROQ_API_KEY")
+        self.deepseek_api_base = os.getenv("DEEPSEEK_API_BASE", "https://api.deepseek.com/v1")
+        self.groq_api_base = os.getenv("GROQ_API_BASE", "https://api.groq.com/openai/v1")
+        self.ollama_host = os.getenv("OLLAMA_HOST", "http://ollama:11434")
+
+    @property
+    def document_processor(self) -> DocumentProcessor:
+        """返回文档处理器，首次访问时创建；在事件循环中应先await ensure_ready()，避免阻塞"""
+        if self._document_processor is None:
+            with self._init_lock:
+                if self._document_processor is None:
+                    self._document_processor = DocumentProcessor()
+        return self._document_processor
+
+    def start_warm_up(self) -> asyncio.Task:
+        """在后台开始预热（上次预热失败时重试），返回预热任务"""
+        if self._warm_up_task is None or self._warm_up["state"] == "failed":
+            self._warm_up_task = asyncio.ensure_future(self._run_warm_up())
+        return self._warm_up_task
+
+    async def _run_warm_up(self):
+        """在线程池中创建文档处理器，用一次编码预热模型，同时构建词法检索的倒排表、加载tiktoken分词器"""
+        self._warm_up.update(state="warming", error=None)
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            processor = await loop.run_in_executor(None, lambda: self.document_processor)
+            await asyncio.gather(
+                processor.batch_encoder.encode("warm up"),
+                loop.run_in_executor(None, processor.lexical_index.load),
+                loop.run_in_executor(None, processor.context_builder.load)
+            )
+            self._warm_up.update(state="ready", seconds=time.perf_counter() - started)
+        except Exception as e:
+            print(f"服务预热失败: {str(e)}")
+            self._warm_up.update(state="failed", seconds=time.perf_counter() - started, error=str(e))
+
+    async def ensure_ready(self):
+        """等待预热完成；预热失败时抛出异常"""
+        await asyncio.shield(self.start_warm_up())
+        if self._warm_up["state"] != "ready":
+            raise RuntimeError(f"服务初始化失败: {self._warm_up['error']}")
+
+    def readiness(self) -> dict:
+        """返回预热状态"""
+        return {"ready": self._warm_up["state"] == "ready", **self._warm_up}
 
     async def process_query_stream(
         self,
@@ -18,128 +77,242 @@ class AIService:
         model_provider: str,
         model_name: str,
         document_id: Optional[str] = None,
-        use_rag: bool = True
+        use_rag: bool = True,
+        consistency_level: Optional[str] = None,
+        document_ids: Optional[List[str]] = None,
+        k: int = 3,
+        rerank: Optional[str] = None,
+        retrieval_mode: Optional[str] = None,
+        user_id: Optional[str] = None,
+        priority: int = INTERACTIVE
     ) -> AsyncGenerator[str, None]:
-        """处理查询，支持RAG和流式输出"""
-        # 如果启用RAG且指定了文档ID，获取相关上下文
-        context = ""
-        if use_rag and document_id:
-            similar_texts = self.document_processor.search_similar(query, k=3, document_id=document_id)
-            if similar_texts:
-                context = "\n\n".join(similar_texts)
-
-        # 构建提示词
-        if context:
-            prompt = f"""基于以下上下文回答问题。如果上下文中没有相关信息，请说明无法从文档中找到相关信息。
-
-上下文：
-{context}
-
-问题：{query}"""
+        """处理查询，支持RAG和流式输出
+
+        document_ids指定多个文档时在这些文档中联合检索，document_id为单文档的简写。
+        对模型提供商的请求经调度器排队，user_id用于同优先级内按用户公平出队。
+        """
+        if document_ids is None:
+            document_ids = [document_id] if document_id else []
+        if not use_rag:
+            document_ids = []
+        # 不检索文档时用不到编码模型，无需等待预热
+        if document_ids:
+            await self.ensure_ready()
+
+        # 相同检索范围、模型下的相同（或语义相近的）问题直接回放缓存的回答；不检索文档的回答不缓存
+        variant = f"k={k};rerank={rerank or ''};mode={retrieval_mode or ''}" if document_ids else ""
+        query_embedding = None
+        # 生成回答期间文档入库完成或被更新时，这个回答基于旧数据，不再写入缓存
+        generation = self.response_cache.current_generation()
+        if document_ids and self.response_cache.semantic_enabled:
+            with metrics.timer("query_embedding"):
+                query_embedding = await self.document_processor.batch_encoder.encode(query)
+        cached = self.response_cache.get(
+            document_ids, model_provider, model_name, query, query_embedding, variant
+        )
+        if cached is not None:
+            for chunk in cached:
+                yield chunk
+            return
+
+        # 如果启用RAG且指定了文档，获取相关上下文
+        hits = []
+        if document_ids:
+            with metrics.timer("retrieval"):
+                hits = await self.document_processor.asearch_hits(
+                    query, k=k, document_ids=document_ids,
+                    consistency_level=consistency_level, rerank=rerank, mode=retrieval_mode
+                )
+
+        # 构建提示词：上下文按模型的token预算截取，去掉相邻文本块的重叠部分；
+        # 计算token数和重叠部分是纯Python的CPU计算，放到线程池中执行，不阻塞其他请求的流式输出
+        if self._document_processor is not None:
+            with metrics.timer("prompt_build"):
+                prompt, _ = await self.document_processor.executor.run(
+                    "search", self.document_processor.context_builder.build_prompt,
+                    query, hits, model_provider, model_name
+                )
         else:
             prompt = query
 
-        # 根据不同的模型提供商处理请求
+        # 只有完整输出的回答才写入缓存
+        chunks = []
+        # 按路由配置调用模型（hedged模式下可能对冲或切换到等价模型）
+        stream = self.router.stream(
+            model_provider, model_name,
+            lambda provider, model: self._scheduled_stream(provider, prompt, model, user_id, priority)
+        )
+        started = time.perf_counter()
+        ttft = None
+        async for chunk in stream:
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            chunks.append(chunk)
+            yield chunk
+        metrics.observe_stream(model_provider, model_name, ttft, time.perf_counter() - started, len(chunks))
+        self.response_cache.put(
+            document_ids, model_provider, model_name, query, chunks, query_embedding, variant, generation
+        )
+
+    async def _scheduled_stream(
+        self,
+        model_provider: str,
+        prompt: str,
+        model_name: str,
+        user_id: Optional[str],
+        priority: int
+    ) -> AsyncGenerator[str, None]:
+        """在调度器分配的名额内调用模型提供商，输出结束后释放名额"""
+        async with self.scheduler.slot(model_provider, model_name, user_id, priority):
+            stream = self._call_provider_stream(model_provider, prompt, model_name)
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                # 调用方提前关闭（如对冲落败、客户端断开）时立即关闭上游响应，不留给垃圾回收在后台收尾
+                await stream.aclose()
+
+    def _call_provider_stream(
+        self,
+        model_provider: str,
+        prompt: str,
+        model_name: str
+    ) -> AsyncGenerator[str, None]:
+        """根据不同的模型提供商返回对应的流式调用"""
         if model_provider == "deepseek":
-            async for chunk in self._call_deepseek_stream(prompt, model_name):
-                yield chunk
+            return self._call_deepseek_stream(prompt, model_name)
         elif model_provider == "groq":
-            async for chunk in self._call_groq_stream(prompt, model_name):
-                yield chunk
+            return self._call_groq_stream(prompt, model_name)
         elif model_provider == "ollama":
-            async for chunk in self._call_ollama_stream(prompt, model_name):
-                yield chunk
+            return self._call_ollama_stream(prompt, model_name)
         else:
             raise ValueError(f"不支持的模型提供商: {model_provider}")
 
-    async def _call_deepseek_stream(self, prompt: str, model_name: str) -> AsyncGenerator[str, None]:
+    def _call_deepseek_stream(self, prompt: str, model_name: str) -> AsyncGenerator[str, None]:
         """调用DeepSeek API（流式）"""
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://api.deepseek.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.deepseek_api_key}",
-                    "Content-Type": "application/json",
-                    "Accept": "text/event-stream"
-                },
-                json={
-                    "model": model_name,
-                    "messages": [{"role": "user", "content": prompt}],
-                    "stream": True
-                }
-            ) as response:
-                if response.status != 200:
-                    raise Exception(f"DeepSeek API调用失败: {await response.text()}")
-                
-                async for line in response.content:
-                    line = line.decode('utf-8').strip()
-                    if line.startswith('data: '):
-                        if line == 'data: [DONE]':
-                            break
-                        try:
-                            data = json.loads(line[6:])
-                            if content := data.get('choices', [{}])[0].get('delta', {}).get('content'):
-                                yield content
-                        except json.JSONDecodeError:
-                            continue
-
-    async def _call_groq_stream(self, prompt: str, model_name: str) -> AsyncGenerator[str, None]:
+        return self._call_openai_compatible_stream(
+            "DeepSeek", self.deepseek_api_base, self.deepseek_api_key, prompt, model_name
+        )
+
+    def _call_groq_stream(self, prompt: str, model_name: str) -> AsyncGenerator[str, None]:
         """调用GROQ API（流式）"""
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://api.groq.com/openai/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.groq_api_key}",
-                    "Content-Type": "application/json",
-                    "Accept": "text/event-stream"
-                },
-                json={
-                    "model": model_name,
-                    "messages": [{"role": "user", "content": prompt}],
-                    "stream": True
-                }
-            ) as response:
-                if response.status != 200:
-                    raise Exception(f"GROQ API调用失败: {await response.text()}")
-                
-                async for line in response.content:
-                    line = line.decode('utf-8').strip()
-                    if line.startswith('data: '):
-                        if line == 'data: [DONE]':
-                            break
-                        try:
-                            data = json.loads(line[6:])
-                            if content := data.get('choices', [{}])[0].get('delta', {}).get('content'):
-                                yield content
-                        except json.JSONDecodeError:
-                            continue
+        return self._call_openai_compatible_stream(
+            "GROQ", self.groq_api_base, self.groq_api_key, prompt, model_name
+        )
+
+    async def _call_openai_compatible_stream(
+        self,
+        name: str,
+        api_base: str,
+        api_key: Optional[str],
+        prompt: str,
+        model_name: str
+    ) -> AsyncGenerator[str, None]:
+        """调用OpenAI兼容的chat/completions流式接口，直接在字节上解析SSE行"""
+        url = f"{api_base}/chat/completions"
+        async with http_client.session(url).post(
+            url,
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+                "Accept": "text/event-stream"
+            },
+            json={
+                "model": model_name,
+                "messages": [{"role": "user", "content": prompt}],
+                "stream": True
+            }
+        ) as response:
+            if response.status != 200:
+                raise Exception(f"{name} API调用失败: {await response.text()}")
+
+            async for payload in iter_sse_data(response.content):
+                # 不含content的增量（如角色、结束原因）不需要解析
+                if b'"content"' not in payload:
+                    continue
+                try:
+                    data = loads(payload)
+                except ValueError:
+                    continue
+                if content := (data.get('choices') or [{}])[0].get('delta', {}).get('content'):
+                    yield content
 
     async def _call_ollama_stream(self, prompt: str, model_name: str) -> AsyncGenerator[str, None]:
         """调用Ollama API（流式）"""
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "http://ollama:11434/api/generate",
-                json={
-                    "model": model_name,
-                    "prompt": prompt,
-                    "stream": True
-                }
-            ) as response:
-                if response.status != 200:
-                    raise Exception(f"Ollama API调用失败: {await response.text()}")
-                
-                async for line in response.content:
-                    try:
-                        data = json.loads(line)
-                        if "response" in data:
-                            yield data["response"]
-                    except json.JSONDecodeError:
-                        continue
-
-    def process_document(self, file_path: str, document_id: str) -> str:
-        """处理文档"""
-        return self.document_processor.process_document(file_path, document_id)
+        url = f"{self.ollama_host}/api/generate"
+        async with http_client.session(url).post(
+            url,
+            json={
+                "model": model_name,
+                "prompt": prompt,
+                "stream": True
+            }
+        ) as response:
+            if response.status != 200:
+                raise Exception(f"Ollama API调用失败: {await response.text()}")
+
+            async for line in iter_lines(response.content):
+                if not line.strip():
+                    continue
+                try:
+                    data = loads(line)
+                except ValueError:
+                    continue
+                if "response" in data:
+                    yield data["response"]
+
+    def process_document(
+        self,
+        file_path: str,
+        document_id: str,
+        progress: Optional[Callable[[str, int], None]] = None
+    ) -> str:
+        """处理文档；入库完成后清除入库期间缓存的该文档的回答"""
+        message = self.document_processor.process_document(file_path, document_id, progress)
+        self.response_cache.invalidate_document(document_id)
+        return message
+
+    def update_document(
+        self,
+        file_path: str,
+        document_id: str,
+        progress: Optional[Callable[[str, int], None]] = None
+    ) -> str:
+        """增量更新文档，并清除与该文档相关的缓存回答"""
+        message = self.document_processor.update_document(file_path, document_id, progress)
+        self.response_cache.invalidate_document(document_id)
+        return message
 
     def delete_document(self, document_id: str):
         """删除文档"""
         self.document_processor.delete_document(document_id)
+        self.response_cache.invalidate_document(document_id)
+
+    def stats(self) -> dict:
+        """返回内部组件的运行统计"""
+        if self._document_processor is None:
+            return {
+                "warm_up": self.readiness(),
+                "scheduler": self.scheduler.stats(),
+                "router": self.router.stats(),
+                "response_cache": self.response_cache.stats()
+            }
+        return {
+            "warm_up": self.readiness(),
+            "scheduler": self.scheduler.stats(),
+            "router": self.router.stats(),
+            "inference": self.document_processor.executor.stats(),
+            "batch_encoder": self.document_processor.batch_encoder.stats(),
+            "embedding_backend": self.document_processor.vector_store.encoder.stats(),
+            "embedding_cache": self.document_processor.vector_store.cache.stats(),
+            "vector_backend": self.document_processor.vector_store.backend.stats(),
+            "lexical_index": self.document_processor.lexical_index.stats(),
+            "reranker": self.document_processor.reranker.stats(),
+            "context_builder": self.document_processor.context_builder.stats(),
+            "response_cache": self.response_cache.stats()
+        }
+
+    def shutdown(self):
+        """关闭服务，刷入未完成的写入"""
+        if self._document_processor is not None:
+            self._document_processor.shutdown()
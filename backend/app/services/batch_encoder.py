@@ -0,0 +1,88 @@
+import os
+import asyncio
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import numpy as np
+from .inference_executor import InferenceExecutor
+
+
+class BatchEncoder:
+    """查询微批编码器：合并时间窗口内到达的查询，用一次批量前向计算完成编码"""
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        executor: InferenceExecutor,
+        max_batch_size: Optional[int] = None,
+        window_ms: Optional[float] = None
+    ):
+        self.encode_fn = encode_fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size or int(os.getenv("ENCODE_BATCH_MAX_SIZE", "32"))
+        if window_ms is None:
+            window_ms = float(os.getenv("ENCODE_BATCH_WINDOW_MS", "5"))
+        self.window = window_ms / 1000
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._stats = {"requests": 0, "batches": 0, "encoded": 0, "max_batch": 0}
+
+    async def encode(self, text: str) -> np.ndarray:
+        """编码单条查询，返回该查询的向量"""
+        self._stats["requests"] += 1
+        if self.max_batch_size <= 1 or self.window <= 0:
+            return (await self._encode_batch([text]))[0]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        """取出当前批次并提交编码"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        """执行批量编码并把结果分发给各调用方"""
+        # 同一批次内相同的查询只编码一次
+        unique_texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            embeddings = await self._encode_batch(unique_texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(unique_texts, embeddings))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+    async def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        self._stats["batches"] += 1
+        self._stats["encoded"] += len(texts)
+        self._stats["max_batch"] = max(self._stats["max_batch"], len(texts))
+        return await self.executor.run("encode", self.encode_fn, texts)
+
+    def stats(self) -> Dict[str, float]:
+        """返回批处理统计"""
+        batches = self._stats["batches"]
+        return {
+            **self._stats,
+            "pending": len(self._pending),
+            "avg_batch": self._stats["encoded"] / batches if batches else 0.0,
+            "window_ms": self.window * 1000,
+            "max_batch_size": self.max_batch_size,
+        }
@@ -0,0 +1,102 @@
+import os
+import time
+import threading
+from typing import Any, Dict, Optional
+from pymilvus import Collection
+from .metrics import metrics
+
+
+class CollectionManager:
+    """集合生命周期管理：集合只加载一次，写入按时间或数据量策略合并刷盘"""
+
+    def __init__(self, collection: Collection):
+        self.collection = collection
+        self.flush_interval = float(os.getenv("MILVUS_FLUSH_INTERVAL", "10"))
+        self.flush_max_rows = int(os.getenv("MILVUS_FLUSH_MAX_ROWS", "10000"))
+        # Milvus一致性级别：Strong / Session / Bounded / Eventually
+        self.consistency_level = os.getenv("MILVUS_CONSISTENCY_LEVEL", "Bounded")
+        self._loaded = False
+        self._pending_rows = 0
+        self._pending_writes = 0
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stats = {"loads": 0, "load_checks": 0, "flushes": 0, "writes": 0}
+
+    def ensure_loaded(self):
+        """确保集合已加载到内存，已加载时不再调用load()"""
+        self._stats["load_checks"] += 1
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                with metrics.timer("milvus_load"):
+                    self.collection.load()
+                self._loaded = True
+                self._stats["loads"] += 1
+
+    def mark_unloaded(self):
+        """集合被释放或重建索引后调用，下次检索时重新加载"""
+        with self._lock:
+            self._loaded = False
+
+    def insert(self, entities: Any):
+        """插入数据，刷盘由策略决定"""
+        result = self.collection.insert(entities)
+        self._record_write(len(result.primary_keys))
+        return result
+
+    def delete(self, expr: str):
+        """按表达式删除数据，刷盘由策略决定"""
+        result = self.collection.delete(expr)
+        self._record_write(result.delete_count)
+        return result
+
+    def search(self, consistency_level: Optional[str] = None, **kwargs):
+        """在已加载的集合上检索，可为需要读己之写的请求指定更强的一致性级别"""
+        self.ensure_loaded()
+        return self.collection.search(
+            consistency_level=consistency_level or self.consistency_level,
+            **kwargs
+        )
+
+    def _record_write(self, rows: int):
+        """记录写入，达到行数阈值时立即刷盘，否则等待定时刷盘"""
+        with self._lock:
+            self._stats["writes"] += 1
+            self._pending_writes += 1
+            self._pending_rows += rows
+            should_flush = self._pending_rows >= self.flush_max_rows
+            if not should_flush and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """将待刷盘的写入一次性刷入持久化存储"""
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._pending_writes:
+                    return
+                self._pending_rows = 0
+                self._pending_writes = 0
+            started = time.perf_counter()
+            self.collection.flush()
+            self._stats["flushes"] += 1
+            self._stats["last_flush_ms"] = (time.perf_counter() - started) * 1000
+
+    def stats(self) -> Dict[str, Any]:
+        """返回加载与刷盘统计，包括相对每次操作都load/flush所节省的次数"""
+        return {
+            **self._stats,
+            "loads_avoided": self._stats["load_checks"] - self._stats["loads"],
+            "flushes_avoided": self._stats["writes"] - self._stats["flushes"],
+            "pending_rows": self._pending_rows,
+            "loaded": self._loaded,
+            "consistency_level": self.consistency_level,
+        }
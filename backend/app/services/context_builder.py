@@ -0,0 +1,219 @@
+import os
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+PROMPT_TEMPLATE = """基于以下上下文回答问题。如果上下文中没有相关信息，请说明无法从文档中找到相关信息。
+
+上下文：
+{context}
+
+问题：{query}"""
+
+CHUNK_SEPARATOR = "\n\n"
+
+
+class ContextBuilder:
+    """按模型的token预算组装RAG上下文：按相关性顺序填充，去掉相邻文本块的重叠部分"""
+
+    def __init__(self, max_overlap: int = 1024):
+        self.encoding_name = os.getenv("TIKTOKEN_ENCODING", "cl100k_base")
+        # 整个提示词（模板+上下文+问题）的默认token预算
+        self.default_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+        # 按模型覆盖预算，键为 "provider/model" 或 "model"，如 {"groq/llama3-8b-8192": 6000}
+        self.model_budgets: Dict[str, int] = json.loads(os.getenv("MODEL_CONTEXT_BUDGETS", "{}"))
+        # 预算不足以放下整块时，剩余预算至少这么多才截断放入
+        self.min_chunk_tokens = int(os.getenv("CONTEXT_MIN_CHUNK_TOKENS", "64"))
+        self.max_overlap = max_overlap
+        self.min_overlap = 16
+        self._encoding = None
+        self._encoding_failed = False
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "prompt_tokens": 0,
+            "context_tokens": 0,
+            "chunks_used": 0,
+            "chunks_dropped": 0,
+            "chunks_truncated": 0,
+            "overlap_tokens_trimmed": 0,
+            "tokens_saved": 0,
+        }
+
+    def load(self):
+        """预先加载分词器（首次加载可能需要下载编码文件），在服务预热时调用"""
+        self._get_encoding()
+
+    def _get_encoding(self):
+        """首次使用时加载分词器；tiktoken不可用时按字节数估算"""
+        if self._encoding is None and not self._encoding_failed:
+            with self._lock:
+                if self._encoding is None and not self._encoding_failed:
+                    try:
+                        if tiktoken is None:
+                            raise RuntimeError("未安装tiktoken")
+                        self._encoding = tiktoken.get_encoding(self.encoding_name)
+                    except Exception as e:
+                        print(f"加载tiktoken分词器失败，改用估算的token数: {str(e)}")
+                        self._encoding_failed = True
+        return self._encoding
+
+    def count(self, text: str) -> int:
+        """统计文本的token数"""
+        encoding = self._get_encoding()
+        if encoding is None:
+            return (len(text.encode("utf-8")) + 3) // 4
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def count_many(self, texts: List[str]) -> List[int]:
+        """批量统计token数，入库时调用并随文本块保存"""
+        encoding = self._get_encoding()
+        if encoding is None:
+            return [self.count(text) for text in texts]
+        return [len(tokens) for tokens in encoding.encode_batch(texts, disallowed_special=())]
+
+    def token_offsets(self, text: str) -> np.ndarray:
+        """返回每个token在文本中的起始字符位置，用于分块时按token数定位边界"""
+        if not text:
+            return np.empty(0, dtype=np.int64)
+        data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+        # 每个字节所属字符的下标（UTF-8后续字节形如10xxxxxx）
+        char_index = np.cumsum((data & 0xC0) != 0x80) - 1
+        encoding = self._get_encoding()
+        if encoding is None:
+            # 估算模式下每4个UTF-8字节算一个token
+            byte_offsets = np.arange(0, len(data), 4)
+        else:
+            tokens = encoding.encode(text, disallowed_special=())
+            sizes = [len(token) for token in encoding.decode_tokens_bytes(tokens)]
+            byte_offsets = np.cumsum([0] + sizes[:-1])
+        return char_index[byte_offsets]
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """截断到指定token数"""
+        encoding = self._get_encoding()
+        if encoding is None:
+            return text.encode("utf-8")[:max_tokens * 4].decode("utf-8", errors="ignore")
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+    def budget_for(self, model_provider: str, model_name: str) -> int:
+        """返回模型的提示词token预算"""
+        return self.model_budgets.get(
+            f"{model_provider}/{model_name}", self.model_budgets.get(model_name, self.default_budget)
+        )
+
+    def build_prompt(
+        self,
+        query: str,
+        hits: List[Dict[str, Any]],
+        model_provider: str,
+        model_name: str
+    ) -> Tuple[str, Dict[str, int]]:
+        """生成提示词，返回提示词及其token统计；hits需按相关性从高到低排列"""
+        if not hits:
+            prompt_tokens = self.count(query)
+            self._record(prompt_tokens, 0, {})
+            return query, {"prompt_tokens": prompt_tokens, "context_tokens": 0, "chunks": 0}
+
+        overhead = self.count(PROMPT_TEMPLATE.format(context="", query=query))
+        context, usage = self.select(hits, self.budget_for(model_provider, model_name) - overhead)
+        if not context:
+            prompt_tokens = self.count(query)
+            self._record(prompt_tokens, 0, usage)
+            return query, {"prompt_tokens": prompt_tokens, "context_tokens": 0, "chunks": 0}
+
+        prompt = PROMPT_TEMPLATE.format(context=context, query=query)
+        prompt_tokens = overhead + usage["context_tokens"]
+        self._record(prompt_tokens, usage["context_tokens"], usage)
+        return prompt, {"prompt_tokens": prompt_tokens, "context_tokens": usage["context_tokens"], "chunks": usage["chunks_used"]}
+
+    def select(self, hits: List[Dict[str, Any]], budget: int) -> Tuple[str, Dict[str, int]]:
+        """按相关性顺序在预算内选取文本块"""
+        separator_tokens = self.count(CHUNK_SEPARATOR)
+        usage = {key: 0 for key in ("context_tokens", "chunks_used", "chunks_dropped",
+                                    "chunks_truncated", "overlap_tokens_trimmed", "tokens_saved")}
+        selected: List[Dict[str, Any]] = []
+        remaining = budget
+        for hit in hits:
+            content = hit["content"]
+            # 入库时缓存了token数的文本块不需要重新分词
+            tokens = hit.get("token_count") or self.count(content)
+            trimmed = self._trim_overlap(hit.get("document_id"), content, selected)
+            if len(trimmed) != len(content):
+                trimmed_tokens = self.count(trimmed) if trimmed else 0
+                usage["overlap_tokens_trimmed"] += tokens - trimmed_tokens
+                usage["tokens_saved"] += tokens - trimmed_tokens
+                content, tokens = trimmed, trimmed_tokens
+            if not content.strip():
+                continue
+
+            cost = tokens + (separator_tokens if selected else 0)
+            if cost > remaining:
+                available = remaining - (separator_tokens if selected else 0)
+                if available >= self.min_chunk_tokens:
+                    content = self._truncate(content, available)
+                    usage["tokens_saved"] += tokens - available
+                    usage["chunks_truncated"] += 1
+                    selected.append({**hit, "content": content})
+                    remaining = 0
+                else:
+                    usage["tokens_saved"] += tokens
+                    usage["chunks_dropped"] += 1
+                continue
+            selected.append({**hit, "content": content})
+            remaining -= cost
+
+        usage["chunks_used"] = len(selected)
+        usage["context_tokens"] = budget - remaining if selected else 0
+        return CHUNK_SEPARATOR.join(hit["content"] for hit in selected), usage
+
+    def _trim_overlap(self, document_id: Optional[str], content: str, selected: List[Dict[str, Any]]) -> str:
+        """去掉与已选中的同文档文本块重叠的开头或结尾（分块时相邻块有重叠）"""
+        for other in selected:
+            if other.get("document_id") != document_id:
+                continue
+            overlap = self._overlap(other["content"], content)
+            if overlap:
+                content = content[overlap:]
+            overlap = self._overlap(content, other["content"])
+            if overlap:
+                content = content[:-overlap]
+        return content
+
+    def _overlap(self, left: str, right: str) -> int:
+        """left的结尾与right的开头重合的最大长度（不小于min_overlap）"""
+        limit = min(self.max_overlap, len(left), len(right))
+        if limit < self.min_overlap:
+            return 0
+        # 前缀函数：在 right前缀 + 分隔符 + left后缀 上求最长的前后缀相等长度
+        text = right[:limit] + "\0" + left[-limit:]
+        prefix = [0] * len(text)
+        for i in range(1, len(text)):
+            j = prefix[i - 1]
+            while j and text[i] != text[j]:
+                j = prefix[j - 1]
+            if text[i] == text[j]:
+                j += 1
+            prefix[i] = j
+        return prefix[-1] if prefix[-1] >= self.min_overlap else 0
+
+    def _record(self, prompt_tokens: int, context_tokens: int, usage: Dict[str, int]):
+        self._stats["requests"] += 1
+        self._stats["prompt_tokens"] += prompt_tokens
+        self._stats["context_tokens"] += context_tokens
+        for key in ("chunks_used", "chunks_dropped", "chunks_truncated", "overlap_tokens_trimmed", "tokens_saved"):
+            self._stats[key] += usage.get(key, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self._stats["requests"]
+        return {
+            **self._stats,
+            "encoding": "estimate" if self._encoding_failed else self.encoding_name,
+            "avg_prompt_tokens": self._stats["prompt_tokens"] / requests if requests else 0.0,
+        }
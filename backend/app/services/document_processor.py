@@ -1,104 +1,380 @@
 import os
-from typing import List, Optional
+import time
+import queue
+import hashlib
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
 import PyPDF2
 import docx2txt
 from .vector_store import VectorStore
+from .inference_executor import InferenceExecutor
+from .batch_encoder import BatchEncoder
+from .reranker import Reranker, fuse_hits, merge_hits
+from .lexical_index import LexicalIndex
+from .context_builder import ContextBuilder
+from .text_chunker import TextChunker
+from .metrics import metrics
+
+
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+
+
+def chunk_hash(text: str) -> str:
+    """文本块内容哈希，用于增量更新时比对新旧版本"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _extract_pdf_pages(file_path: str, start: int, end: int) -> List[str]:
+    """在子进程中提取PDF指定页范围的文本"""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [(pdf_reader.pages[i].extract_text() or "") for i in range(start, end)]
+
 
 class DocumentProcessor:
     def __init__(self):
         self.vector_store = VectorStore()
-        self.chunk_size = 1000
-        self.chunk_overlap = 200
+        self.executor = InferenceExecutor()
+        self.batch_encoder = BatchEncoder(self.vector_store.encode, self.executor)
+        self.reranker = Reranker(self.executor)
+        self.lexical_index = LexicalIndex()
+        # vector: 只用向量检索；lexical: 只用BM25；hybrid: 两者并发检索后按RRF融合
+        self.retrieval_mode = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+        self.rrf_k = int(os.getenv("RRF_K", "60"))
+        self.context_builder = ContextBuilder()
+        self.chunker = TextChunker(self.context_builder)
+        # 流式入库参数
+        self.parse_workers = int(os.getenv("INGEST_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.pages_per_task = int(os.getenv("INGEST_PAGES_PER_TASK", "16"))
+        self.embed_batch_size = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "64"))
+        self.max_pending_batches = int(os.getenv("INGEST_MAX_PENDING_BATCHES", "2"))
+        self.text_block_size = 64 * 1024
+        self._parse_pool: Optional[ProcessPoolExecutor] = None
 
-    def process_document(self, file_path: str, document_id: str) -> str:
+    def process_document(
+        self,
+        file_path: str,
+        document_id: str,
+        progress: Optional[Callable[[str, int], None]] = None
+    ) -> str:
         """处理文档并存储到向量数据库"""
-        # 读取文档内容
-        content = self._read_document(file_path)
-        if not content:
+        progress = progress or (lambda field, count: None)
+
+        # 读取、分块、编码、插入以流水线方式进行，内存占用与文档大小无关
+        timings = {"parse": 0.0}
+        chunks = self.chunker.split_stream(self._count_pages(self._iter_document(file_path), progress, timings))
+        try:
+            total = self._store_chunks(chunks, document_id, progress, timings)
+        except Exception:
+            # 读取或写入中途失败：清理已写入的部分，不留下不完整的文档
+            self.delete_document(document_id)
+            raise
+        if not total:
             return "文档内容为空"
 
-        # 分块
-        chunks = self._split_text(content)
-        
-        # 存储到向量数据库
-        self.vector_store.add_texts(chunks, document_id)
-        
-        return f"成功处理文档，共{len(chunks)}个文本块"
+        return f"成功处理文档，共{total}个文本块"
+
+    def update_document(
+        self,
+        file_path: str,
+        document_id: str,
+        progress: Optional[Callable[[str, int], None]] = None
+    ) -> str:
+        """用新版本更新文档：只编码插入新增的文本块，只删除新版本中已不存在的文本块"""
+        backend = self.vector_store.backend
+        if not backend.supports_chunk_hashes:
+            # 旧的Milvus集合没有chunk_hash字段，只能整篇重建
+            self.delete_document(document_id)
+            return self.process_document(file_path, document_id, progress)
+
+        progress = progress or (lambda field, count: None)
+        existing = backend.chunk_hashes(document_id)
+        current = set()
+        reused = 0
+
+        def fresh_chunks(chunks: Iterable[str]) -> Iterator[str]:
+            nonlocal reused
+            for chunk in chunks:
+                digest = chunk_hash(chunk)
+                if digest in existing or digest in current:
+                    # 新版本中重复的文本块只保留一份
+                    reused += digest in existing and digest not in current
+                else:
+                    yield chunk
+                current.add(digest)
+
+        # 先插入新增的文本块再删除过期的，更新过程中文档始终可检索
+        timings = {"parse": 0.0}
+        chunks = self.chunker.split_stream(self._count_pages(self._iter_document(file_path), progress, timings))
+        try:
+            added = self._store_chunks(fresh_chunks(chunks), document_id, progress, timings)
+        except Exception:
+            # 新版本没有完整读完或写入失败：撤销已插入的新文本块，保留旧版本的全部文本块
+            inserted = list(current - existing)
+            if inserted:
+                backend.delete_chunks(document_id, inserted)
+                self.lexical_index.delete_chunks(document_id, inserted)
+            raise
+        # 只有完整读完新版本后才能确定哪些旧文本块已过期
+        if not current:
+            return "文档内容为空"
+        stale = list(existing - current)
+        if stale:
+            backend.delete_chunks(document_id, stale)
+            self.lexical_index.delete_chunks(document_id, stale)
+
+        return f"成功更新文档：新增{added}个文本块，删除{len(stale)}个，复用{reused}个"
+
+    @staticmethod
+    def _count_pages(
+        pages: Iterable[str],
+        progress: Callable[[str, int], None],
+        timings: Dict[str, float]
+    ) -> Iterator[str]:
+        """统计已解析的页数与解析耗时"""
+        pages = iter(pages)
+        while True:
+            started = time.perf_counter()
+            page = next(pages, None)
+            timings["parse"] += time.perf_counter() - started
+            if page is None:
+                return
+            progress("pages_parsed", 1)
+            yield page
+
+    def _store_chunks(
+        self,
+        chunks: Iterable[str],
+        document_id: str,
+        progress: Callable[[str, int], None],
+        timings: Dict[str, float]
+    ) -> int:
+        """按固定批大小编码文本块，并通过有界队列交给插入线程；各阶段累计耗时记入入库指标"""
+        insert_queue: "queue.Queue" = queue.Queue(maxsize=self.max_pending_batches)
+        errors: List[Exception] = []
+        timings.update(chunk=0.0, embed=0.0, insert=0.0)
+        started = time.perf_counter()
+
+        def inserter():
+            while True:
+                item = insert_queue.get()
+                if item is None:
+                    return
+                if errors:
+                    continue
+                try:
+                    insert_started = time.perf_counter()
+                    # token数在插入线程中统计，与下一批的编码并行
+                    token_counts = self.context_builder.count_many(item[0])
+                    hashes = [chunk_hash(text) for text in item[0]]
+                    self.vector_store.add_embeddings(item[0], item[1], document_id, token_counts, hashes)
+                    self.lexical_index.add(document_id, item[0], hashes, token_counts)
+                    timings["insert"] += time.perf_counter() - insert_started
+                    progress("chunks_inserted", len(item[0]))
+                except Exception as e:
+                    errors.append(e)
+
+        thread = threading.Thread(target=inserter, name=f"insert-{document_id}", daemon=True)
+        thread.start()
+        total = 0
+        batches = self._batched(chunks, self.embed_batch_size)
+        try:
+            while True:
+                # 从分块迭代器取一批的耗时包含解析，分块耗时需减去解析部分
+                pulled = time.perf_counter()
+                batch = next(batches, None)
+                timings["chunk"] += time.perf_counter() - pulled
+                if batch is None or errors:
+                    break
+                embed_started = time.perf_counter()
+                embeddings = self.vector_store.encode(batch)
+                timings["embed"] += time.perf_counter() - embed_started
+                progress("chunks_embedded", len(batch))
+                # 插入跟不上时在这里阻塞，形成背压
+                insert_queue.put((batch, embeddings))
+                total += len(batch)
+        finally:
+            insert_queue.put(None)
+            thread.join()
+
+        if errors:
+            raise errors[0]
+        timings["chunk"] = max(0.0, timings["chunk"] - timings["parse"])
+        timings["total"] = time.perf_counter() - started
+        metrics.observe_ingest(timings)
+        return total
+
+    @staticmethod
+    def _batched(items: Iterable[str], size: int) -> Iterator[List[str]]:
+        """将迭代器按固定大小分批"""
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
-    def _read_document(self, file_path: str) -> Optional[str]:
-        """读取不同格式的文档"""
+    def _iter_document(self, file_path: str) -> Iterator[str]:
+        """按页或按块流式读取不同格式的文档"""
         file_extension = os.path.splitext(file_path)[1].lower()
-        
+
         try:
             if file_extension == '.pdf':
-                return self._read_pdf(file_path)
+                yield from self._iter_pdf(file_path)
             elif file_extension == '.docx':
-                return self._read_docx(file_path)
+                yield from self._iter_blocks(self._read_docx(file_path))
             elif file_extension == '.txt':
-                return self._read_txt(file_path)
+                yield from self._iter_txt(file_path)
             else:
                 raise ValueError(f"不支持的文件格式: {file_extension}")
         except Exception as e:
-            print(f"读取文档失败: {str(e)}")
-            return None
+            # 中途读取失败时不能把已读出的部分当作完整文档入库，由调用方将任务标记为失败
+            raise RuntimeError(f"读取文档失败: {str(e)}") from e
 
-    def _read_pdf(self, file_path: str) -> str:
-        """读取PDF文件"""
-        text = ""
+    def _iter_pdf(self, file_path: str) -> Iterator[str]:
+        """逐页读取PDF文件，页范围在进程池中并行提取"""
         with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text
+            page_count = len(PyPDF2.PdfReader(file).pages)
+
+        if self.parse_workers <= 1 or page_count <= self.pages_per_task:
+            for page in _extract_pdf_pages(file_path, 0, page_count):
+                yield page + "\n"
+            return
+
+        if self._parse_pool is None:
+            self._parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+
+        # 同时在途的页范围数量有上限，避免提取速度远超下游消费
+        pending = deque()
+        for start in range(0, page_count, self.pages_per_task):
+            end = min(start + self.pages_per_task, page_count)
+            pending.append(self._parse_pool.submit(_extract_pdf_pages, file_path, start, end))
+            if len(pending) >= self.parse_workers * 2:
+                for page in pending.popleft().result():
+                    yield page + "\n"
+        while pending:
+            for page in pending.popleft().result():
+                yield page + "\n"
 
     def _read_docx(self, file_path: str) -> str:
         """读取DOCX文件"""
         return docx2txt.process(file_path)
 
-    def _read_txt(self, file_path: str) -> str:
-        """读取TXT文件"""
+    def _iter_txt(self, file_path: str) -> Iterator[str]:
+        """按块读取TXT文件"""
         with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read()
-
-    def _split_text(self, text: str) -> List[str]:
-        """将文本分割成块"""
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            # 找到块的结束位置
-            end = start + self.chunk_size
-            
-            # 如果不是文本的末尾，尝试在句子边界分割
-            if end < len(text):
-                # 在最后一个句号、问号或感叹号处分割
-                last_period = max(
-                    text.rfind('.', start, end),
-                    text.rfind('?', start, end),
-                    text.rfind('!', start, end)
-                )
-                if last_period != -1:
-                    end = last_period + 1
-            
-            # 添加文本块
-            chunk = text[start:end].strip()
-            if chunk:  # 只添加非空块
-                chunks.append(chunk)
-            
-            # 移动到下一个起始位置，考虑重叠
-            start = end - self.chunk_overlap
-        
-        return chunks
-
-    def search_similar(
+            while True:
+                block = file.read(self.text_block_size)
+                if not block:
+                    return
+                yield block
+
+    def _iter_blocks(self, text: str) -> Iterator[str]:
+        """将整段文本切成固定大小的块，供流式分块使用"""
+        for start in range(0, len(text), self.text_block_size):
+            yield text[start:start + self.text_block_size]
+
+    async def asearch_hits(
         self,
         query: str,
         k: int = 5,
-        document_id: Optional[str] = None
-    ) -> List[str]:
-        """搜索相似文本块"""
-        return self.vector_store.similarity_search(query, k, document_id)
+        document_ids: Optional[List[str]] = None,
+        consistency_level: Optional[str] = None,
+        rerank: Optional[str] = None,
+        mode: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """在多个文档（None表示全部文档）中检索，合并去重后可选重排，返回前k个结果
+
+        mode为vector、lexical或hybrid，hybrid时向量检索与BM25检索并发进行，结果按RRF融合。
+        """
+        mode = mode or self.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"不支持的检索方式: {mode}")
+        if document_ids is not None and not document_ids:
+            return []
+
+        # 多文档、混合检索或需要重排时多取候选，给去重、融合和重排留出余量
+        fetch_k = k
+        if rerank:
+            fetch_k = k * self.reranker.oversample
+        elif mode == "hybrid" or document_ids is None or len(document_ids) > 1:
+            fetch_k = k * 2
+
+        lexical = None
+        if mode != "vector":
+            lexical = asyncio.ensure_future(metrics.measure("lexical_search", self.executor.run(
+                "search", self.lexical_index.search, query, fetch_k, document_ids
+            )))
+        try:
+            query_embedding = None
+            if mode != "lexical" or rerank == "mmr":
+                with metrics.timer("query_embedding"):
+                    query_embedding = await self.batch_encoder.encode(query)
+            vector_hits = []
+            if mode != "lexical":
+                with metrics.timer("vector_search"):
+                    vector_hits = await self._vector_hits(
+                        query_embedding, fetch_k, document_ids, consistency_level, rerank == "mmr"
+                    )
+            lexical_hits = await lexical if lexical is not None else []
+        finally:
+            if lexical is not None and not lexical.done():
+                lexical.cancel()
+
+        if mode == "vector":
+            hits = vector_hits
+        elif mode == "lexical":
+            hits = lexical_hits
+        else:
+            hits = fuse_hits([vector_hits, lexical_hits], self.rrf_k)
+        if rerank == "mmr":
+            # 只由BM25检索到的文本块没有向量，补充编码（优先命中向量缓存）
+            missing = [hit for hit in hits if hit.get("embedding") is None]
+            if missing:
+                embeddings = await self.executor.run(
+                    "encode", self.vector_store.encode, [hit["content"] for hit in missing]
+                )
+                for hit, embedding in zip(missing, embeddings):
+                    hit["embedding"] = embedding
+        with metrics.timer("rerank"):
+            return await self.reranker.rerank(query, query_embedding, hits, k, rerank)
+
+    async def _vector_hits(
+        self,
+        query_embedding,
+        k: int,
+        document_ids: Optional[List[str]],
+        consistency_level: Optional[str],
+        with_embeddings: bool
+    ) -> List[Dict[str, Any]]:
+        """向量检索；后端限制了单次过滤的文档数量时，分组并发检索后合并"""
+        limit = self.vector_store.backend.max_filter_documents
+        if document_ids is None or not limit or len(document_ids) <= limit:
+            groups = [document_ids]
+        else:
+            groups = [document_ids[i:i + limit] for i in range(0, len(document_ids), limit)]
+        results = await asyncio.gather(*(
+            self.executor.run(
+                "search", self.vector_store.search_hits,
+                query_embedding, k, group, consistency_level, with_embeddings
+            )
+            for group in groups
+        ))
+        return merge_hits([hit for result in results for hit in result])[:k]
 
     def delete_document(self, document_id: str):
-        """删除文档相关的所有向量"""
+        """删除文档相关的所有向量与倒排索引"""
         self.vector_store.delete_by_document_id(document_id)
+        self.lexical_index.delete_document(document_id)
+
+    def shutdown(self):
+        """刷入未完成的写入并关闭线程池与进程池"""
+        self.vector_store.flush()
+        self.executor.shutdown()
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown(wait=False)
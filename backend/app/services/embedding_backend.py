@@ -0,0 +1,226 @@
+import os
+import time
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Tuple
+import numpy as np
+
+EMBEDDING_BACKENDS = ("torch", "int8", "onnx", "onnx_int8")
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# 进程内共享的编码后端，按（模型名，后端）缓存
+_shared: Dict[Tuple[str, str], "EmbeddingBackend"] = {}
+_shared_lock = threading.Lock()
+
+
+class EmbeddingBackend(ABC):
+    """文本向量编码后端：同一个SentenceTransformer模型的不同推理实现"""
+
+    name = ""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        # 推理线程数，0表示使用推理库的默认值（通常为全部物理核）
+        self.num_threads = int(os.getenv("EMBEDDING_NUM_THREADS", "0"))
+        self.batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+        self.dim = 0
+        self._stats = {"texts": 0, "batches": 0, "seconds": 0.0}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def cache_name(self) -> str:
+        """向量缓存使用的模型名：量化或换推理引擎后向量会有细微差异，不与原模型共用缓存"""
+        return self.model_name if self.name == "torch" else f"{self.model_name}@{self.name}"
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """批量编码，返回float32矩阵"""
+        started = time.perf_counter()
+        embeddings = np.asarray(self._encode(texts), dtype=np.float32)
+        with self._stats_lock:
+            self._stats["texts"] += len(texts)
+            self._stats["batches"] += 1
+            self._stats["seconds"] += time.perf_counter() - started
+        return embeddings
+
+    @abstractmethod
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """由各后端实现的编码"""
+
+    def stats(self) -> Dict[str, Any]:
+        seconds = self._stats["seconds"]
+        return {
+            **self._stats,
+            "backend": self.name,
+            "num_threads": self.num_threads,
+            "texts_per_second": self._stats["texts"] / seconds if seconds else 0.0,
+        }
+
+
+class TorchEmbeddingBackend(EmbeddingBackend):
+    """PyTorch fp32推理（原有实现）"""
+
+    name = "torch"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=self.batch_size)
+
+
+class Int8EmbeddingBackend(TorchEmbeddingBackend):
+    """PyTorch动态int8量化：线性层权重量化为int8，激活在推理时按批量化"""
+
+    name = "int8"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        import torch
+        self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxEmbeddingBackend(EmbeddingBackend):
+    """ONNX Runtime推理：首次使用时把模型的Transformer部分导出为ONNX并缓存，池化与归一化用numpy完成"""
+
+    name = "onnx"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        import onnxruntime
+        from sentence_transformers import SentenceTransformer
+        self.directory = os.getenv("EMBEDDING_ONNX_DIR", "cache/onnx")
+        model = SentenceTransformer(model_name, device="cpu")
+        self.dim = model.get_sentence_embedding_dimension()
+        self.tokenizer = model.tokenizer
+        self.max_length = model.max_seq_length
+        pooling = model[1]
+        if pooling.pooling_mode_mean_tokens:
+            self.pooling = "mean"
+        elif pooling.pooling_mode_cls_token:
+            self.pooling = "cls"
+        elif pooling.pooling_mode_max_tokens:
+            self.pooling = "max"
+        else:
+            raise ValueError(f"ONNX后端不支持模型 {model_name} 的池化方式")
+        self.normalize = any(type(module).__name__ == "Normalize" for module in model)
+
+        path = self._model_path(model)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = self.num_threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+
+    def _export_path(self) -> str:
+        return os.path.join(self.directory, self.model_name.replace("/", "__") + ".onnx")
+
+    def _model_path(self, model) -> str:
+        """返回ONNX模型文件，不存在时导出"""
+        path = self._export_path()
+        if os.path.exists(path):
+            return path
+        import torch
+        os.makedirs(self.directory, exist_ok=True)
+        transformer = model[0].auto_model.eval()
+        sample = dict(self.tokenizer(["导出样例 export sample"], return_tensors="pt"))
+        names = list(sample)
+        axes = {name: {0: "batch", 1: "sequence"} for name in names}
+        axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+        # 先写临时文件再改名，避免多个进程同时导出时读到不完整的文件
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                transformer, (sample,), temporary,
+                input_names=names, output_names=["last_hidden_state"],
+                dynamic_axes=axes, opset_version=14
+            )
+        os.replace(temporary, path)
+        return path
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        # 按长度排序后分批，减少同一批内的填充
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            inputs = self.tokenizer(
+                [texts[i] for i in batch], padding=True, truncation=True,
+                max_length=self.max_length, return_tensors="np"
+            )
+            feed = {name: value.astype(np.int64) for name, value in inputs.items() if name in self.input_names}
+            hidden = self.session.run(["last_hidden_state"], feed)[0]
+            embeddings[batch] = self._pool(hidden, inputs["attention_mask"])
+        return embeddings
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """与SentenceTransformer的Pooling/Normalize模块一致的池化"""
+        mask = attention_mask[..., None].astype(np.float32)
+        if self.pooling == "mean":
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        elif self.pooling == "cls":
+            pooled = hidden[:, 0]
+        else:
+            pooled = np.where(mask > 0, hidden, -1e9).max(axis=1)
+        if self.normalize:
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled
+
+
+class OnnxInt8EmbeddingBackend(OnnxEmbeddingBackend):
+    """ONNX Runtime动态int8量化模型，由导出的fp32模型量化得到"""
+
+    name = "onnx_int8"
+
+    def _model_path(self, model) -> str:
+        path = self._export_path()[:-len(".onnx")] + ".int8.onnx"
+        if os.path.exists(path):
+            return path
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        source = super()._model_path(model)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        quantize_dynamic(source, temporary, weight_type=QuantType.QInt8)
+        os.replace(temporary, path)
+        return path
+
+
+def create_embedding_backend(model_name: str, backend: str = "") -> EmbeddingBackend:
+    """根据 EMBEDDING_BACKEND 环境变量创建文本编码后端"""
+    backend = (backend or os.getenv("EMBEDDING_BACKEND", "torch")).lower()
+    if backend == "torch":
+        return TorchEmbeddingBackend(model_name)
+    if backend == "int8":
+        return Int8EmbeddingBackend(model_name)
+    if backend == "onnx":
+        return OnnxEmbeddingBackend(model_name)
+    if backend == "onnx_int8":
+        return OnnxInt8EmbeddingBackend(model_name)
+    raise ValueError(f"不支持的文本编码后端: {backend}")
+
+
+def get_embedding_backend(model_name: str, backend: str = "") -> EmbeddingBackend:
+    """返回进程内共享的编码后端，同一模型只加载一次"""
+    backend = (backend or os.getenv("EMBEDDING_BACKEND", "torch")).lower()
+    with _shared_lock:
+        if (model_name, backend) not in _shared:
+            _shared[(model_name, backend)] = create_embedding_backend(model_name, backend)
+        return _shared[(model_name, backend)]
+
+
+def preload_embedding_backend():
+    """在gunicorn --preload的主进程中预先加载编码模型，fork出的工作进程以写时复制方式共享模型权重
+
+    ONNX Runtime的会话不能跨fork使用，onnx后端只预先导出模型文件，会话在各工作进程中创建。
+    """
+    model_name = os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+    backend = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+    if backend.startswith("onnx"):
+        create_embedding_backend(model_name, backend)
+    else:
+        get_embedding_backend(model_name, backend)
@@ -0,0 +1,135 @@
+import os
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+
+
+class EmbeddingCache:
+    """向量缓存：按（模型名，文本哈希）寻址，内存LRU + SQLite磁盘两级
+
+    磁盘层超过上限时淘汰最早写入的条目；磁盘读写使用单独的锁，不阻塞内存层的命中。
+    """
+
+    _SQLITE_BATCH = 500
+
+    def __init__(
+        self,
+        model_name: str,
+        path: Optional[str] = None,
+        max_memory_items: Optional[int] = None
+    ):
+        self.model_name = model_name
+        self.path = path if path is not None else os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite3")
+        self.max_memory_items = max_memory_items or int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "10000"))
+        # 磁盘层最多保留的条目数，0表示不限
+        self.max_items = int(os.getenv("EMBEDDING_CACHE_MAX_ITEMS", "200000"))
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._db = self._open_db() if self.path else None
+
+    def _open_db(self) -> sqlite3.Connection:
+        """打开磁盘缓存数据库"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+        )
+        return db
+
+    def key(self, text: str) -> str:
+        """计算缓存键"""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """批量查询缓存，未命中的位置返回None"""
+        keys = [self.key(text) for text in texts]
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+        disk_lookup: Dict[str, List[int]] = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector
+                    self._stats["memory_hits"] += 1
+                else:
+                    disk_lookup.setdefault(key, []).append(i)
+
+        found: Dict[str, np.ndarray] = {}
+        if disk_lookup and self._db is not None:
+            lookup_keys = list(disk_lookup)
+            with self._db_lock:
+                for start in range(0, len(lookup_keys), self._SQLITE_BATCH):
+                    batch = lookup_keys[start:start + self._SQLITE_BATCH]
+                    for key, blob in self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                        batch
+                    ):
+                        found[key] = np.frombuffer(blob, dtype=np.float32)
+
+        with self._lock:
+            for key, vector in found.items():
+                self._remember(key, vector)
+                for i in disk_lookup.pop(key):
+                    results[i] = vector
+                    self._stats["disk_hits"] += 1
+            self._stats["misses"] += sum(len(positions) for positions in disk_lookup.values())
+        return results
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        """批量写入缓存"""
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                vector = np.ascontiguousarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.shape[0], vector.tobytes()))
+            self._stats["writes"] += len(rows)
+        if self._db is None or not rows:
+            return
+        with self._db_lock:
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, dim, vector) VALUES (?, ?, ?)",
+                    rows
+                )
+                if self.max_items > 0:
+                    # 重新写入的条目获得新的rowid，按rowid淘汰即淘汰最早写入的条目
+                    evicted = self._db.execute(
+                        "DELETE FROM embeddings WHERE rowid <= (SELECT MAX(rowid) FROM embeddings) - ?",
+                        (self.max_items,)
+                    ).rowcount
+                else:
+                    evicted = 0
+        if evicted:
+            with self._lock:
+                self._stats["evictions"] += evicted
+
+    def _remember(self, key: str, vector: np.ndarray):
+        """写入内存LRU层，超出容量时淘汰最久未使用的条目"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        """返回命中率统计"""
+        hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+        lookups = hits + self._stats["misses"]
+        return {
+            **self._stats,
+            "memory_items": len(self._memory),
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
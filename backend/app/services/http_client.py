@@ -0,0 +1,57 @@
+import os
+from typing import Dict
+from urllib.parse import urlsplit
+import aiohttp
+
+
+class ProviderHTTPClient:
+    """应用级HTTP客户端：按主机维护连接池，复用keep-alive连接和DNS缓存"""
+
+    def __init__(self):
+        self.limit = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+        self.limit_per_host = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "32"))
+        self.keepalive_timeout = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+        self.dns_cache_ttl = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+        # 流式响应可能持续很久，不设总超时，只限制连接和两次读取之间的间隔
+        self.timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", "10")),
+            sock_read=float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+        )
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    def session(self, url: str) -> aiohttp.ClientSession:
+        """获取目标主机的共享会话，首次访问时创建"""
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        session = self._sessions.get(origin)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl
+            )
+            session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self._sessions[origin] = session
+        return session
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """返回各主机连接池的使用情况"""
+        result = {}
+        for origin, session in self._sessions.items():
+            connector = session.connector
+            result[origin] = {
+                "acquired": len(getattr(connector, "_acquired", ())),
+                "idle": sum(len(conns) for conns in getattr(connector, "_conns", {}).values()),
+            }
+        return result
+
+    async def close(self):
+        """关闭所有会话及其连接"""
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            await session.close()
+
+
+http_client = ProviderHTTPClient()
@@ -0,0 +1,92 @@
+import os
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class InferenceExecutor:
+    """推理执行器：在独立的有界线程池中运行编码与向量检索，避免阻塞事件循环"""
+
+    def __init__(self):
+        self._limits = {
+            "encode": int(os.getenv("ENCODE_MAX_CONCURRENCY", "2")),
+            "search": int(os.getenv("SEARCH_MAX_CONCURRENCY", "8")),
+        }
+        # 编码是CPU密集型（torch计算时会释放GIL），检索是网络IO，两者分开排队互不影响
+        self._pools = {
+            "encode": ThreadPoolExecutor(
+                max_workers=int(os.getenv("ENCODE_WORKERS", str(self._limits["encode"]))),
+                thread_name_prefix="encode"
+            ),
+            "search": ThreadPoolExecutor(
+                max_workers=int(os.getenv("SEARCH_WORKERS", str(self._limits["search"]))),
+                thread_name_prefix="search"
+            ),
+        }
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._stats = {
+            kind: {
+                "queued": 0,
+                "active": 0,
+                "completed": 0,
+                "failed": 0,
+                "max_queued": 0,
+                "wait_seconds": 0.0,
+            }
+            for kind in self._pools
+        }
+
+    def _get_semaphore(self, kind: str) -> asyncio.Semaphore:
+        """延迟创建信号量，确保绑定到运行中的事件循环"""
+        if kind not in self._semaphores:
+            self._semaphores[kind] = asyncio.Semaphore(self._limits[kind])
+        return self._semaphores[kind]
+
+    async def run(self, kind: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """在指定类型的线程池中执行阻塞函数"""
+        stats = self._stats[kind]
+        semaphore = self._get_semaphore(kind)
+        enqueued_at = time.perf_counter()
+
+        stats["queued"] += 1
+        stats["max_queued"] = max(stats["max_queued"], stats["queued"])
+        try:
+            await semaphore.acquire()
+        finally:
+            stats["queued"] -= 1
+
+        stats["active"] += 1
+        stats["wait_seconds"] += time.perf_counter() - enqueued_at
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                self._pools[kind],
+                functools.partial(func, *args, **kwargs)
+            )
+        except Exception:
+            stats["failed"] += 1
+            raise
+        finally:
+            stats["active"] -= 1
+            semaphore.release()
+        stats["completed"] += 1
+        return result
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """返回各线程池的队列深度与等待时间统计"""
+        result = {}
+        for kind, stats in self._stats.items():
+            started = stats["completed"] + stats["failed"] + stats["active"]
+            result[kind] = {
+                **stats,
+                "limit": self._limits[kind],
+                "avg_wait_ms": stats["wait_seconds"] / started * 1000 if started else 0.0,
+            }
+        return result
+
+    def shutdown(self):
+        """关闭线程池"""
+        for pool in self._pools.values():
+            pool.shutdown(wait=False)
@@ -0,0 +1,396 @@
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional
+from .provider_scheduler import BACKGROUND
+
+# 任务状态
+QUEUED = "queued"
+PROCESSING = "processing"
+COMPLETED = "completed"
+FAILED = "failed"
+
+PROGRESS_FIELDS = ("pages_parsed", "chunks_embedded", "chunks_inserted")
+
+# 任务类型：首次入库 / 用新版本增量更新
+INGEST = "ingest"
+UPDATE = "update"
+
+
+class IngestionQueue:
+    """文档入库任务队列：任务持久化在本地SQLite中，由后台工作协程并发处理
+
+    入库完成后任务即标记为完成，摘要在单独的任务中生成，不占用入库工作协程；
+    生成期间持有租约，进程退出后由其他进程接手。
+    """
+
+    def __init__(self, ai_service, path: Optional[str] = None, workers: Optional[int] = None):
+        self.ai_service = ai_service
+        self.path = path or os.getenv("INGEST_QUEUE_PATH", "documents/jobs.sqlite3")
+        self.worker_count = workers or int(os.getenv("INGEST_WORKERS", "2"))
+        self.summary_query = "请总结这篇文档的主要内容"
+        # 处理中的任务由持有租约的进程负责，租约过期（进程退出）后才由其他进程接手
+        self.lease_seconds = float(os.getenv("INGEST_LEASE_SECONDS", "60"))
+        self.owner = ""
+        self._progress_interval = 1.0
+        self._lock = threading.Lock()
+        self._db = self._open_db()
+        self._pid = os.getpid()
+        self._pending: set = set()
+        self._recover_task: Optional[asyncio.Task] = None
+        self._summaries: Dict[str, asyncio.Task] = {}
+        self._progress: Dict[str, Dict[str, int]] = {}
+        self._last_persist: Dict[str, float] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    def _open_db(self) -> sqlite3.Connection:
+        """打开任务数据库"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "document_id TEXT PRIMARY KEY, "
+            "file_path TEXT NOT NULL, "
+            "user_id TEXT, "
+            "model TEXT, "
+            "model_name TEXT, "
+            "status TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "pages_parsed INTEGER NOT NULL DEFAULT 0, "
+            "chunks_embedded INTEGER NOT NULL DEFAULT 0, "
+            "chunks_inserted INTEGER NOT NULL DEFAULT 0, "
+            "message TEXT, "
+            "analysis TEXT, "
+            "error TEXT, "
+            "created_at REAL NOT NULL, "
+            "updated_at REAL NOT NULL, "
+            f"kind TEXT NOT NULL DEFAULT '{INGEST}')"
+        )
+        columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+        if "kind" not in columns:
+            db.execute(f"ALTER TABLE jobs ADD COLUMN kind TEXT NOT NULL DEFAULT '{INGEST}'")
+        for column, definition in (("owner", "TEXT"), ("lease_until", "REAL"), ("summary_error", "TEXT")):
+            if column not in columns:
+                db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_user_id ON jobs (user_id, status)")
+        return db
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            with self._db:
+                return self._db.execute(sql, params).fetchall()
+
+    async def start(self):
+        """启动工作协程，并定期恢复无人处理的任务（排队过久或租约已过期）"""
+        if os.getpid() != self._pid:
+            # 用 --preload 启动时队列在主进程中创建，fork后的工作进程不能共用SQLite连接
+            self._db = self._open_db()
+            self._pid = os.getpid()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = asyncio.Queue()
+        self._pending = set()
+        self._recover(queued_before=time.time())
+        self._workers = [
+            asyncio.ensure_future(self._worker()) for _ in range(self.worker_count)
+        ]
+        self._recover_task = asyncio.ensure_future(self._recover_loop())
+
+    async def stop(self):
+        """停止工作协程，未完成的任务在租约过期后由其他进程或下次启动时继续"""
+        if self._recover_task is not None:
+            self._recover_task.cancel()
+            self._recover_task = None
+        tasks = self._workers + list(self._summaries.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._summaries = {}
+
+    def _recover(self, queued_before: float):
+        """把租约已过期的处理中任务，以及在queued_before之前提交仍未被领取的任务加入本进程的队列"""
+        now = time.time()
+        for row in self._execute(
+            "SELECT document_id FROM jobs WHERE (status = ? AND (lease_until IS NULL OR lease_until < ?)) "
+            "OR (status = ? AND updated_at < ?) ORDER BY created_at",
+            (PROCESSING, now, QUEUED, queued_before)
+        ):
+            self._put(row["document_id"])
+        # 摘要生成中的进程退出后租约过期，由本进程接手
+        for row in self._execute(
+            "SELECT document_id FROM jobs WHERE status = ? AND analysis IS NULL AND summary_error IS NULL "
+            "AND lease_until IS NOT NULL AND lease_until < ?",
+            (COMPLETED, now)
+        ):
+            if self._claim_summary(row["document_id"]):
+                self._start_summary(row["document_id"])
+
+    async def _recover_loop(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 2)
+            try:
+                # 其他进程提交的任务留给它自己处理，只接手排队超过一个租约周期的
+                self._recover(queued_before=time.time() - self.lease_seconds)
+            except Exception as e:
+                print(f"恢复入库任务失败: {str(e)}")
+
+    def _put(self, document_id: str):
+        if document_id not in self._pending:
+            self._pending.add(document_id)
+            self._queue.put_nowait(document_id)
+
+    def enqueue(
+        self,
+        document_id: str,
+        file_path: str,
+        user_id: Optional[str] = None,
+        model: Optional[str] = None,
+        model_name: Optional[str] = None
+    ):
+        """提交入库任务"""
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (document_id, file_path, user_id, model, model_name, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (document_id, file_path, user_id, model, model_name, QUEUED, now, now)
+        )
+        self._put(document_id)
+
+    def enqueue_update(self, document_id: str, file_path: str) -> bool:
+        """提交增量更新任务，文档不存在或仍在处理中时返回False"""
+        with self._lock:
+            with self._db:
+                cursor = self._db.execute(
+                    f"UPDATE jobs SET file_path = ?, kind = ?, status = ?, error = NULL, summary_error = NULL, "
+                    "owner = NULL, lease_until = NULL, updated_at = ?, "
+                    f"{', '.join(f'{field} = 0' for field in PROGRESS_FIELDS)} "
+                    "WHERE document_id = ? AND status IN (?, ?)",
+                    (file_path, UPDATE, QUEUED, time.time(), document_id, COMPLETED, FAILED)
+                )
+        if not cursor.rowcount:
+            return False
+        self._put(document_id)
+        return True
+
+    def get_status(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """查询任务状态与进度"""
+        rows = self._execute("SELECT * FROM jobs WHERE document_id = ?", (document_id,))
+        if not rows:
+            return None
+        job = dict(rows[0])
+        with self._lock:
+            job.update(self._progress.get(document_id, {}))
+        return {
+            "document_id": job["document_id"],
+            "status": job["status"],
+            "kind": job["kind"],
+            **{field: job[field] for field in PROGRESS_FIELDS},
+            "message": job["message"],
+            "analysis": job["analysis"],
+            "error": job["error"],
+            "summary_error": job["summary_error"],
+            # 文档已可检索，摘要仍在生成
+            "summary_pending": job["status"] == COMPLETED and bool(job["model"] and job["model_name"])
+            and job["analysis"] is None and job["summary_error"] is None,
+        }
+
+    def list_documents(self, user_id: str) -> List[str]:
+        """返回用户已完成入库的全部文档ID"""
+        rows = self._execute(
+            "SELECT document_id FROM jobs WHERE user_id = ? AND status = ? ORDER BY created_at",
+            (user_id, COMPLETED)
+        )
+        return [row["document_id"] for row in rows]
+
+    def remove(self, document_id: str) -> bool:
+        """删除任务记录；任务正在处理中时不删除并返回False，本进程中仍在生成的摘要随之取消"""
+        summary = self._summaries.pop(document_id, None)
+        if summary is not None:
+            summary.cancel()
+        with self._lock:
+            with self._db:
+                cursor = self._db.execute(
+                    "DELETE FROM jobs WHERE document_id = ? AND status != ?", (document_id, PROCESSING)
+                )
+                if cursor.rowcount:
+                    return True
+                return not self._db.execute(
+                    "SELECT 1 FROM jobs WHERE document_id = ?", (document_id,)
+                ).fetchall()
+
+    def stats(self) -> Dict[str, int]:
+        """返回各状态的任务数量"""
+        counts = {status: 0 for status in (QUEUED, PROCESSING, COMPLETED, FAILED)}
+        for row in self._execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row["status"]] = row["n"]
+        return {**counts, "workers": self.worker_count}
+
+    async def _worker(self):
+        while True:
+            document_id = await self._queue.get()
+            self._pending.discard(document_id)
+            try:
+                await self._run_job(document_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._update(document_id, status=FAILED, error=str(e))
+            finally:
+                with self._lock:
+                    self._progress.pop(document_id, None)
+                    self._last_persist.pop(document_id, None)
+                self._queue.task_done()
+
+    def _claim(self, job: sqlite3.Row) -> bool:
+        """原子地领取任务：排队中的任务，或租约已过期的处理中任务；已被其他进程领取时返回False"""
+        now = time.time()
+        with self._lock:
+            with self._db:
+                cursor = self._db.execute(
+                    f"UPDATE jobs SET status = ?, owner = ?, lease_until = ?, attempts = attempts + 1, "
+                    f"updated_at = ?, {', '.join(f'{field} = 0' for field in PROGRESS_FIELDS)} "
+                    "WHERE document_id = ? AND status = ? AND (status = ? OR lease_until IS NULL OR lease_until < ?)",
+                    (
+                        PROCESSING, self.owner, now + self.lease_seconds, now,
+                        job["document_id"], job["status"], QUEUED, now
+                    )
+                )
+        return cursor.rowcount == 1
+
+    async def _renew_lease(self, document_id: str):
+        """处理期间定期续租"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            self._execute(
+                "UPDATE jobs SET lease_until = ? WHERE document_id = ? AND owner = ?",
+                (time.time() + self.lease_seconds, document_id, self.owner)
+            )
+
+    async def _run_job(self, document_id: str):
+        rows = self._execute("SELECT * FROM jobs WHERE document_id = ?", (document_id,))
+        if not rows or rows[0]["status"] not in (QUEUED, PROCESSING):
+            return
+        job = rows[0]
+        if not self._claim(job):
+            return
+
+        loop = asyncio.get_running_loop()
+        renew = asyncio.ensure_future(self._renew_lease(document_id))
+        try:
+            # 之前的处理者中途退出时可能已经写入了部分数据，重新处理前先清理；增量更新重新比对即可恢复，不需要清理
+            if job["status"] == PROCESSING and job["kind"] != UPDATE:
+                await loop.run_in_executor(None, self.ai_service.delete_document, document_id)
+
+            with self._lock:
+                self._progress[document_id] = {field: 0 for field in PROGRESS_FIELDS}
+
+            def progress(field: str, count: int):
+                self._on_progress(document_id, field, count)
+
+            process = self.ai_service.update_document if job["kind"] == UPDATE else self.ai_service.process_document
+            message = await loop.run_in_executor(None, process, job["file_path"], document_id, progress)
+        finally:
+            renew.cancel()
+
+        # 入库完成后文档即可检索；指定了模型时在单独的任务中生成摘要，摘要失败不影响任务状态
+        summarize = bool(job["model"] and job["model_name"])
+        with self._lock:
+            counters = dict(self._progress.get(document_id, {}))
+        self._update(
+            document_id, status=COMPLETED, message=message, analysis=None, summary_error=None,
+            lease_until=time.time() + self.lease_seconds if summarize else None, **counters
+        )
+        if summarize:
+            self._start_summary(document_id)
+
+    def _claim_summary(self, document_id: str) -> bool:
+        """领取租约已过期的摘要生成"""
+        now = time.time()
+        with self._lock:
+            with self._db:
+                cursor = self._db.execute(
+                    "UPDATE jobs SET owner = ?, lease_until = ?, updated_at = ? "
+                    "WHERE document_id = ? AND status = ? AND analysis IS NULL AND summary_error IS NULL "
+                    "AND lease_until IS NOT NULL AND lease_until < ?",
+                    (self.owner, now + self.lease_seconds, now, document_id, COMPLETED, now)
+                )
+        return cursor.rowcount == 1
+
+    def _start_summary(self, document_id: str):
+        # 文档更新后重新生成摘要，取消仍在为旧版本生成的摘要
+        previous = self._summaries.get(document_id)
+        if previous is not None:
+            previous.cancel()
+        task = self._summaries[document_id] = asyncio.ensure_future(self._summarize(document_id))
+        task.add_done_callback(
+            lambda done: self._summaries.pop(document_id, None) if self._summaries.get(document_id) is done else None
+        )
+
+    async def _summarize(self, document_id: str):
+        """使用AI分析文档，结果写回任务记录"""
+        rows = self._execute("SELECT * FROM jobs WHERE document_id = ?", (document_id,))
+        if not rows:
+            return
+        job = rows[0]
+        renew = asyncio.ensure_future(self._renew_lease(document_id))
+        analysis = ""
+        try:
+            async for chunk in self.ai_service.process_query_stream(
+                query=self.summary_query,
+                model_provider=job["model"],
+                model_name=job["model_name"],
+                document_id=document_id,
+                use_rag=True,
+                # 刚写入的数据尚未刷盘，摘要检索需要读己之写
+                consistency_level="Strong",
+                user_id=job["user_id"],
+                # 摘要不需要即时返回，让位于交互式检索
+                priority=BACKGROUND
+            ):
+                analysis += chunk
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._finish_summary(document_id, None, str(e))
+            return
+        finally:
+            renew.cancel()
+        self._finish_summary(document_id, analysis, None)
+
+    def _finish_summary(self, document_id: str, analysis: Optional[str], error: Optional[str]):
+        # 期间文档被删除、更新或摘要被其他进程接手时不写入
+        self._execute(
+            "UPDATE jobs SET analysis = ?, summary_error = ?, lease_until = NULL, updated_at = ? "
+            "WHERE document_id = ? AND status = ? AND owner = ?",
+            (analysis, error, time.time(), document_id, COMPLETED, self.owner)
+        )
+
+    def _on_progress(self, document_id: str, field: str, count: int):
+        """记录进度，按固定间隔持久化"""
+        now = time.monotonic()
+        with self._lock:
+            counters = self._progress.setdefault(document_id, {f: 0 for f in PROGRESS_FIELDS})
+            counters[field] += count
+            if now - self._last_persist.get(document_id, 0) < self._progress_interval:
+                return
+            self._last_persist[document_id] = now
+            counters = dict(counters)
+        self._update(document_id, **counters)
+
+    def _update(self, document_id: str, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        # 只更新本进程领取的任务或尚未被领取的任务，租约被接手后原处理者的写入不再生效
+        self._execute(
+            f"UPDATE jobs SET {assignments} WHERE document_id = ? AND (owner IS NULL OR owner = ?)",
+            (*fields.values(), document_id, self.owner)
+        )
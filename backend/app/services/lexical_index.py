@@ -0,0 +1,401 @@
+import os
+import re
+import math
+import time
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional
+import numpy as np
+
+# 英文/数字词（保留型号、版本号等带连接符的整体），以及中日韩文字连续片段
+_TOKEN_PATTERN = re.compile(
+    r"[a-z0-9]+(?:[._\-/][a-z0-9]+)*"
+    r"|[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]+"
+)
+_SEPARATORS = re.compile(r"[._\-/]")
+
+
+def tokenize(text: str) -> Iterator[str]:
+    """词法切分：英文按词，带连接符的标识符同时保留整体和各部分，中日韩文字按二元组"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    for match in _TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        if token[0] >= "぀":
+            if len(token) == 1:
+                yield token
+            for i in range(len(token) - 1):
+                yield token[i:i + 2]
+        else:
+            yield token
+            if _SEPARATORS.search(token):
+                yield from (part for part in _SEPARATORS.split(token) if part)
+
+
+class LexicalIndex:
+    """本地BM25倒排索引：文本块持久化在SQLite中，倒排表在预热时于内存中重建，用紧凑数组存储
+
+    SQLite中的代数（generation）在每次写入和删除时递增，删除的文本块ID按代数记入墓碑表。
+    多个进程共用同一数据库时，检索前发现代数变化就按自增ID补上新文本块，按墓碑表标记删除的文本块。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("LEXICAL_INDEX_PATH", "lexical_index/chunks.sqlite3")
+        self.k1 = float(os.getenv("BM25_K1", "1.2"))
+        self.b = float(os.getenv("BM25_B", "0.75"))
+        # 已删除的文本块超过这个比例时在后台线程中清理倒排项
+        self.compact_ratio = 0.25
+        # 后台清理时每次持锁处理的词数，避免长时间阻塞检索
+        self.compact_batch = 2000
+        # 墓碑保留的代数范围，落后更多的进程重建倒排表
+        self.tombstone_generations = 10000
+        self._lock = threading.RLock()
+        self._db = self._open_db()
+        self._loaded = False
+        self._compacting = False
+        self._stats = {"searches": 0, "search_seconds": 0.0, "rebuilds": 0, "syncs": 0, "compactions": 0}
+        self._reset()
+
+    def _open_db(self) -> sqlite3.Connection:
+        """打开文本块数据库"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            # 自增ID不复用，内存中已失效的倒排项不会错配到新文本块
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, document_id TEXT NOT NULL, chunk_hash TEXT NOT NULL, "
+            "content TEXT NOT NULL, token_count INTEGER NOT NULL DEFAULT 0)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS chunks_document_id ON chunks (document_id)")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS tombstones (chunk_id INTEGER PRIMARY KEY, generation INTEGER NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS tombstones_generation ON tombstones (generation)")
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        with db:
+            db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+            # 墓碑表中只保留代数大于这个值的删除记录
+            db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('pruned', 0)")
+        return db
+
+    def _read_generation(self) -> int:
+        return self._db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def _bury(self, ids: List[int]):
+        """在当前事务中删除文本块，把ID按新代数记入墓碑表，并清理超出保留范围的墓碑"""
+        generation = self._read_generation()
+        self._db.executemany(
+            "INSERT OR REPLACE INTO tombstones (chunk_id, generation) VALUES (?, ?)",
+            [(chunk_id, generation) for chunk_id in ids]
+        )
+        self._db.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+        pruned = generation - self.tombstone_generations
+        if pruned > 0:
+            self._db.execute("DELETE FROM tombstones WHERE generation <= ?", (pruned,))
+            self._db.execute("UPDATE meta SET value = MAX(value, ?) WHERE key = 'pruned'", (pruned,))
+
+    def _bump_generation(self) -> bool:
+        """在当前事务中递增代数；返回内存中的倒排表在这次修改之前是否是最新的"""
+        current = self._loaded and self._read_generation() == self._generation
+        self._db.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+        if current:
+            self._generation += 1
+        return current
+
+    def _reset(self):
+        # 倒排表：词 -> 文本块ID数组（uint32）与词频数组（uint16）
+        self._postings: Dict[str, array] = {}
+        self._frequencies: Dict[str, array] = {}
+        # 按文本块ID索引的长度、所属文档序号与是否有效，容量按倍数增长
+        self._lengths = np.zeros(0, dtype=np.uint32)
+        self._documents = np.zeros(0, dtype=np.uint32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._document_index: Dict[str, int] = {}
+        self._document_chunks: Dict[str, List[int]] = {}
+        self._alive_count = 0
+        self._indexed_count = 0
+        self._total_length = 0
+        self._posting_count = 0
+        # 内存中已索引的最大文本块ID，以及倒排表对应的SQLite代数
+        self._max_id = 0
+        self._generation = -1
+
+    def add(
+        self,
+        document_id: str,
+        texts: List[str],
+        chunk_hashes: List[str],
+        token_counts: Optional[List[int]] = None
+    ):
+        """写入文本块；倒排表已加载且是最新时同步更新，否则留到下次检索前同步"""
+        token_counts = token_counts or [0] * len(texts)
+        with self._lock:
+            with self._db:
+                ids = [
+                    self._db.execute(
+                        "INSERT INTO chunks (document_id, chunk_hash, content, token_count) VALUES (?, ?, ?, ?)",
+                        (document_id, chunk_hash, text, token_count)
+                    ).lastrowid
+                    for text, chunk_hash, token_count in zip(texts, chunk_hashes, token_counts)
+                ]
+                current = self._bump_generation()
+            if current:
+                for chunk_id, text in zip(ids, texts):
+                    self._index_chunk(chunk_id, document_id, text)
+
+    def _index_chunk(self, chunk_id: int, document_id: str, text: str):
+        """把一个文本块加入内存倒排表"""
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+        if chunk_id >= len(self._lengths):
+            capacity = max(chunk_id + 1, len(self._lengths) * 2, 1024)
+            self._lengths = np.resize(self._lengths, capacity)
+            self._documents = np.resize(self._documents, capacity)
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:len(self._alive)] = self._alive
+            self._alive = alive
+        document = self._document_index.setdefault(document_id, len(self._document_index))
+        self._document_chunks.setdefault(document_id, []).append(chunk_id)
+        self._lengths[chunk_id] = length
+        self._documents[chunk_id] = document
+        self._alive[chunk_id] = True
+        self._alive_count += 1
+        self._indexed_count += 1
+        self._max_id = max(self._max_id, chunk_id)
+        self._total_length += length
+        for term, frequency in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = array("I")
+                self._frequencies[term] = array("H")
+            postings.append(chunk_id)
+            self._frequencies[term].append(min(frequency, 65535))
+        self._posting_count += len(terms)
+
+    def load(self):
+        """从SQLite构建倒排表，在服务预热时调用，避免首个检索请求承担构建耗时"""
+        with self._lock:
+            self._ensure_loaded()
+
+    def _ensure_loaded(self):
+        """倒排表未加载时从SQLite构建；已加载时同步其他进程的修改"""
+        if self._loaded and self._sync():
+            return
+        self._reset()
+        # 先读代数再读数据，期间的并发修改会在下次同步时补上
+        generation = self._read_generation()
+        for chunk_id, document_id, content in self._db.execute(
+            "SELECT id, document_id, content FROM chunks ORDER BY id"
+        ):
+            self._index_chunk(chunk_id, document_id, content)
+        self._generation = generation
+        self._loaded = True
+        self._stats["rebuilds"] += 1
+
+    def _sync(self) -> bool:
+        """代数变化时增量同步：索引ID大于已索引最大ID的新文本块，按墓碑表标记这之后删除的文本块失效
+
+        需要的墓碑已被清理时返回False，由调用方重建倒排表。
+        """
+        generation = self._read_generation()
+        if generation == self._generation:
+            return True
+        pruned = self._db.execute("SELECT value FROM meta WHERE key = 'pruned'").fetchone()[0]
+        if pruned > self._generation:
+            return False
+        removed = [
+            row[0] for row in self._db.execute(
+                "SELECT chunk_id FROM tombstones WHERE generation > ?", (self._generation,)
+            )
+        ]
+        if removed:
+            self._forget(removed)
+        for chunk_id, document_id, content in self._db.execute(
+            "SELECT id, document_id, content FROM chunks WHERE id > ? ORDER BY id", (self._max_id,)
+        ):
+            self._index_chunk(chunk_id, document_id, content)
+        self._generation = generation
+        self._stats["syncs"] += 1
+        return True
+
+    def delete_document(self, document_id: str):
+        """删除文档的所有文本块"""
+        with self._lock:
+            with self._db:
+                current = self._bump_generation()
+                self._bury([
+                    row[0] for row in self._db.execute("SELECT id FROM chunks WHERE document_id = ?", (document_id,))
+                ])
+            if current:
+                self._forget(self._document_chunks.pop(document_id, []))
+
+    def delete_chunks(self, document_id: str, chunk_hashes: List[str]):
+        """删除文档中指定哈希的文本块"""
+        stale = set(chunk_hashes)
+        with self._lock:
+            ids = [
+                chunk_id for chunk_id, chunk_hash in self._db.execute(
+                    "SELECT id, chunk_hash FROM chunks WHERE document_id = ?", (document_id,)
+                )
+                if chunk_hash in stale
+            ]
+            if not ids:
+                return
+            with self._db:
+                current = self._bump_generation()
+                self._bury(ids)
+            if current:
+                removed = set(ids)
+                chunks = self._document_chunks.get(document_id, [])
+                self._document_chunks[document_id] = [chunk_id for chunk_id in chunks if chunk_id not in removed]
+                self._forget(ids)
+
+    def _forget(self, ids: List[int]):
+        """在内存中标记文本块失效；失效的倒排项超过比例时在后台线程中清理
+
+        有效标记写时复制，锁外计分的检索仍使用取快照时的数组。
+        """
+        ids = [chunk_id for chunk_id in ids if chunk_id < len(self._alive) and self._alive[chunk_id]]
+        if ids:
+            alive = self._alive.copy()
+            alive[ids] = False
+            self._alive = alive
+            self._alive_count -= len(ids)
+            self._total_length -= int(self._lengths[ids].sum())
+        if not self._compacting and self._indexed_count - self._alive_count > self._indexed_count * self.compact_ratio:
+            self._compacting = True
+            threading.Thread(target=self._compact, daemon=True).start()
+
+    def _compact(self):
+        """从倒排表中移除失效文本块的倒排项；按批持锁，检索可以在批次之间进行
+
+        文本块ID不复用、失效后不会恢复，所以各批次可以各自按当时的有效标记过滤。
+        """
+        try:
+            with self._lock:
+                dead = self._indexed_count - self._alive_count
+                terms = list(self._postings)
+            removed = 0
+            for start in range(0, len(terms), self.compact_batch):
+                with self._lock:
+                    alive = self._alive
+                    for term in terms[start:start + self.compact_batch]:
+                        postings = self._postings.get(term)
+                        if postings is None:
+                            continue
+                        ids = np.array(postings, dtype=np.uint32)
+                        keep = alive[ids]
+                        if keep.all():
+                            continue
+                        removed += len(ids) - int(keep.sum())
+                        if not keep.any():
+                            del self._postings[term], self._frequencies[term]
+                            continue
+                        frequencies = np.array(self._frequencies[term], dtype=np.uint16)
+                        self._postings[term] = array("I", ids[keep].tobytes())
+                        self._frequencies[term] = array("H", frequencies[keep].tobytes())
+            with self._lock:
+                for document_id, chunks in list(self._document_chunks.items()):
+                    chunks = [chunk_id for chunk_id in chunks if self._alive[chunk_id]]
+                    if chunks:
+                        self._document_chunks[document_id] = chunks
+                    else:
+                        del self._document_chunks[document_id]
+                self._indexed_count -= dead
+                self._posting_count -= removed
+                self._stats["compactions"] += 1
+        except Exception as e:
+            print(f"清理词法索引失败: {str(e)}")
+        finally:
+            self._compacting = False
+
+    def search(self, query: str, k: int = 5, document_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """BM25检索，返回包含content、document_id、chunk_hash和score的结果"""
+        started = time.perf_counter()
+        terms = set(tokenize(query))
+        # 持锁只复制查询词的倒排项并取快照：已索引文本块的长度和所属文档不再改变，有效标记写时复制
+        with self._lock:
+            self._ensure_loaded()
+            if not terms or not self._alive_count:
+                return []
+            alive, lengths, documents = self._alive, self._lengths, self._documents
+            allowed = None
+            if document_ids is not None:
+                allowed = np.array(
+                    [self._document_index[d] for d in document_ids if d in self._document_index], dtype=np.uint32
+                )
+                if not len(allowed):
+                    return []
+            average_length = self._total_length / self._alive_count
+            total = self._alive_count
+            postings = [
+                (np.array(self._postings[term], dtype=np.uint32), np.array(self._frequencies[term], dtype=np.float32))
+                for term in terms if term in self._postings
+            ]
+
+        all_ids, all_scores = [], []
+        for ids, frequencies in postings:
+            mask = alive[ids]
+            ids, frequencies = ids[mask], frequencies[mask]
+            if not len(ids):
+                continue
+            idf = math.log(1 + (total - len(ids) + 0.5) / (len(ids) + 0.5))
+            if allowed is not None:
+                mask = np.isin(documents[ids], allowed)
+                ids, frequencies = ids[mask], frequencies[mask]
+            norm = self.k1 * (1 - self.b + self.b * lengths[ids] / average_length)
+            all_ids.append(ids)
+            all_scores.append(idf * frequencies * (self.k1 + 1) / (frequencies + norm))
+        if not all_ids:
+            return []
+
+        ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        top = np.argsort(-scores)[:k] if len(scores) <= k else np.argpartition(-scores, k)[:k]
+        top = top[np.argsort(-scores[top])]
+        with self._lock:
+            hits = self._fetch_hits(ids[top].tolist(), scores[top].tolist())
+        self._stats["searches"] += 1
+        self._stats["search_seconds"] += time.perf_counter() - started
+        return hits
+
+    def _fetch_hits(self, ids: List[int], scores: List[float]) -> List[Dict[str, Any]]:
+        """按分数顺序读取文本块"""
+        if not ids:
+            return []
+        found = {
+            row[0]: row[1:] for row in self._db.execute(
+                "SELECT id, document_id, chunk_hash, content, token_count FROM chunks "
+                f"WHERE id IN ({','.join('?' * len(ids))})",
+                ids
+            )
+        }
+        return [
+            {
+                "content": found[chunk_id][2],
+                "document_id": found[chunk_id][0],
+                "chunk_hash": found[chunk_id][1],
+                "token_count": found[chunk_id][3] or None,
+                "score": score,
+            }
+            for chunk_id, score in zip(ids, scores) if chunk_id in found
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        searches = self._stats["searches"]
+        posting_bytes = sum(p.itemsize * len(p) for p in self._postings.values()) + \
+            sum(f.itemsize * len(f) for f in self._frequencies.values())
+        return {
+            **self._stats,
+            "loaded": self._loaded,
+            "chunks": self._alive_count,
+            "terms": len(self._postings),
+            "postings": self._posting_count,
+            "posting_bytes": posting_bytes,
+            "avg_search_ms": self._stats["search_seconds"] / searches * 1000 if searches else 0.0,
+        }
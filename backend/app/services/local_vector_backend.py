@@ -0,0 +1,510 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
+from .vector_backend import VectorBackend
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+VECTOR_DTYPES = ("float32", "float16", "int8", "binary")
+# 压缩存储时候选数量为k的多少倍，候选再用float32原始向量精确重算距离
+_RESCORE_FACTORS = {"float16": 2, "int8": 4, "binary": 10}
+# 0-255每个字节中1的个数，用于计算汉明距离
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class LocalVectorBackend(VectorBackend):
+    """进程内向量索引后端：NumPy暴力检索，可选FAISS HNSW/IVF索引，向量文件内存映射持久化
+
+    LOCAL_VECTOR_DTYPE不为float32时，内存中另存一份压缩向量（float16、每行一个缩放系数的int8或按符号位的binary），
+    暴力检索先在压缩向量上选出候选，再从float32向量文件中读取候选行精确重算距离。
+
+    多个进程可以共用同一LOCAL_VECTOR_PATH：行号在SQLite写事务中分配，向量在提交前写入文件，
+    其他进程只会看到向量已写好的行；每次写入和删除递增SQLite中的代数，各进程检索前按代数增量加载新行和删除标记。
+    """
+
+    _BLOCK_ROWS = 65536
+    supports_chunk_hashes = True
+
+    def __init__(self, dim: int, path: Optional[str] = None):
+        self.dim = dim
+        self.path = path or os.getenv("LOCAL_VECTOR_PATH", "vector_index")
+        # flat: 暴力检索；hnsw / ivf: 需要安装faiss
+        self.index_type = os.getenv("LOCAL_INDEX_TYPE", "flat").lower()
+        self.hnsw_m = int(os.getenv("LOCAL_HNSW_M", "32"))
+        self.hnsw_ef_search = int(os.getenv("LOCAL_HNSW_EF_SEARCH", "64"))
+        self.ivf_nlist = int(os.getenv("LOCAL_IVF_NLIST", "256"))
+        self.ivf_nprobe = int(os.getenv("LOCAL_IVF_NPROBE", "16"))
+        self.vector_dtype = os.getenv("LOCAL_VECTOR_DTYPE", "float32").lower()
+        if self.vector_dtype not in VECTOR_DTYPES:
+            raise ValueError(f"不支持的向量存储类型: {self.vector_dtype}")
+        self.rescore_factor = int(os.getenv("LOCAL_RESCORE_FACTOR") or _RESCORE_FACTORS.get(self.vector_dtype, 1))
+        os.makedirs(self.path, exist_ok=True)
+        self._vector_path = os.path.join(self.path, "vectors.f32")
+        self._index_path = os.path.join(self.path, f"{self.index_type}.faiss")
+        self._lock = threading.RLock()
+        self._db = self._open_db()
+        self._count = 0
+        # 内存中的状态对应的SQLite代数
+        self._generation = -1
+        self._vectors: Optional[np.memmap] = None
+        self._norms = np.empty(0, dtype=np.float32)
+        self._codes: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._alive = np.empty(0, dtype=bool)
+        # 上面几个数组是预分配缓冲区前self._count行的视图，缓冲区容量按倍数增长，追加时不必整体复制
+        self._buffers: Dict[str, np.ndarray] = {}
+        self._doc_rows: Dict[str, List[int]] = defaultdict(list)
+        self._ann = None
+        self._stats = {"searches": 0, "ann_searches": 0, "search_seconds": 0.0, "syncs": 0}
+        self._load()
+
+    def _open_db(self) -> sqlite3.Connection:
+        """打开文本块元数据库"""
+        db = sqlite3.connect(os.path.join(self.path, "chunks.sqlite3"), check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "row INTEGER PRIMARY KEY, document_id TEXT NOT NULL, "
+            "content TEXT NOT NULL, deleted INTEGER NOT NULL DEFAULT 0, "
+            "token_count INTEGER NOT NULL DEFAULT 0, chunk_hash TEXT NOT NULL DEFAULT '')"
+        )
+        columns = {row[1] for row in db.execute("PRAGMA table_info(chunks)")}
+        if "token_count" not in columns:
+            db.execute("ALTER TABLE chunks ADD COLUMN token_count INTEGER NOT NULL DEFAULT 0")
+        if "chunk_hash" not in columns:
+            db.execute("ALTER TABLE chunks ADD COLUMN chunk_hash TEXT NOT NULL DEFAULT ''")
+        db.execute("CREATE INDEX IF NOT EXISTS chunks_document_id ON chunks (document_id)")
+        # deleted为删除时的代数（0表示有效），按代数增量查找其他进程删除的行
+        db.execute("CREATE INDEX IF NOT EXISTS chunks_deleted ON chunks (deleted)")
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        with db:
+            db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', '1')")
+        # 向量文件按维度切分行，维度不一致时读出的向量都是错的
+        row = db.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        if row is None:
+            with db:
+                db.execute("INSERT INTO meta (key, value) VALUES ('dim', ?)", (str(self.dim),))
+        elif int(row[0]) != self.dim:
+            raise ValueError(
+                f"本地向量索引{self.path}的维度为{row[0]}，与当前模型的维度{self.dim}不一致，请更换LOCAL_VECTOR_PATH"
+            )
+        return db
+
+    def _load(self):
+        """从磁盘恢复索引状态"""
+        row_bytes = self.dim * 4
+        # 持有写锁清理上次中断的写入，避免截断其他进程正在写入的向量
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            rows_on_disk = os.path.getsize(self._vector_path) // row_bytes if os.path.exists(self._vector_path) else 0
+            max_row = self._db.execute("SELECT MAX(row) FROM chunks").fetchone()[0]
+            count = min(rows_on_disk, max_row + 1 if max_row is not None else 0)
+            # 向量文件与元数据可能不一致，以两者都完整的部分为准
+            if os.path.exists(self._vector_path):
+                os.truncate(self._vector_path, count * row_bytes)
+            self._db.execute("DELETE FROM chunks WHERE row >= ?", (count,))
+            self._db.commit()
+        except BaseException:
+            self._db.rollback()
+            raise
+
+        self._buffers = {"norms": self._norms, "alive": self._alive}
+        if self.vector_dtype != "float32":
+            self._codes, self._scales = self._compress(np.empty((0, self.dim), dtype=np.float32))
+            self._buffers["codes"] = self._codes
+            if self.vector_dtype == "int8":
+                self._buffers["scales"] = self._scales
+        self._sync()
+        if self._ann is None:
+            self._ann = self._build_ann()
+
+    def _read_generation(self) -> int:
+        return int(self._db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0])
+
+    def _bump_generation(self) -> int:
+        """在当前写事务中递增代数并返回新值"""
+        self._db.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'generation'")
+        return self._read_generation()
+
+    def _sync(self):
+        """代数变化时增量同步：追加行号不小于self._count的新行，标记删除代数大于上次同步的行"""
+        generation = self._read_generation()
+        if generation == self._generation:
+            return
+        # 先读代数再读数据，期间提交的修改代数更大，下次同步时补上
+        indexed = self._count
+        new_rows = self._db.execute(
+            "SELECT row, document_id, deleted FROM chunks WHERE row >= ? ORDER BY row", (indexed,)
+        ).fetchall()
+        if new_rows:
+            count = indexed + len(new_rows)
+            vectors = np.memmap(self._vector_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+            for start in range(indexed, count, self._BLOCK_ROWS):
+                block = np.asarray(vectors[start:min(start + self._BLOCK_ROWS, count)])
+                block_rows = new_rows[start - indexed:start - indexed + len(block)]
+                self._append_rows("norms", np.einsum("ij,ij->i", block, block))
+                self._append_rows("alive", np.array([deleted == 0 for _, _, deleted in block_rows], dtype=bool))
+                if self._codes is not None:
+                    codes, scales = self._compress(block)
+                    self._append_rows("codes", codes)
+                    if "scales" in self._buffers:
+                        self._append_rows("scales", scales)
+                for row, document_id, deleted in block_rows:
+                    if not deleted:
+                        self._doc_rows[document_id].append(row)
+                self._count += len(block)
+                if self._ann is not None:
+                    self._ann.add(np.ascontiguousarray(block))
+            # 只在各缓冲区已写好之后才扩大视图，并发的检索看到的始终是完整的行
+            self._norms = self._buffers["norms"][:self._count]
+            self._alive = self._buffers["alive"][:self._count]
+            if self._codes is not None:
+                self._codes = self._buffers["codes"][:self._count]
+                if "scales" in self._buffers:
+                    self._scales = self._buffers["scales"][:self._count]
+            self._remap()
+            if self._ann is None and self.index_type == "ivf":
+                self._ann = self._build_ann()
+
+        removed: Dict[str, Set[int]] = defaultdict(set)
+        for row, document_id in self._db.execute(
+            "SELECT row, document_id FROM chunks WHERE deleted > ? AND row < ?", (max(self._generation, 0), indexed)
+        ):
+            if self._alive[row]:
+                self._alive[row] = False
+                removed[document_id].add(row)
+        for document_id, rows in removed.items():
+            remaining = [row for row in self._doc_rows.get(document_id, ()) if row not in rows]
+            if remaining:
+                self._doc_rows[document_id] = remaining
+            else:
+                self._doc_rows.pop(document_id, None)
+        self._generation = generation
+        self._stats["syncs"] += 1
+
+    def _compress(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """把float32向量转成压缩存储，返回压缩向量及int8每行的缩放系数（其他类型为空）"""
+        no_scales = np.empty(0, dtype=np.float32)
+        if self.vector_dtype == "float16":
+            return vectors.astype(np.float16), no_scales
+        if self.vector_dtype == "binary":
+            return np.packbits(vectors > 0, axis=1), no_scales
+        scales = np.abs(vectors).max(axis=1) / 127 if len(vectors) else np.empty(0, dtype=np.float32)
+        scales = np.where(scales > 0, scales, 1).astype(np.float32)
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales
+
+    def _remap(self):
+        """重新映射向量文件"""
+        if self._count:
+            self._vectors = np.memmap(self._vector_path, dtype=np.float32, mode="r", shape=(self._count, self.dim))
+        else:
+            self._vectors = None
+
+    def _build_ann(self):
+        """构建或加载可选的近似最近邻索引"""
+        if self.index_type == "flat":
+            return None
+        if faiss is None:
+            print(f"未安装faiss，LOCAL_INDEX_TYPE={self.index_type} 将退化为暴力检索")
+            self.index_type = "flat"
+            return None
+
+        if os.path.exists(self._index_path):
+            index = faiss.read_index(self._index_path)
+            if index.ntotal == self._count:
+                self._configure_ann(index)
+                return index
+
+        if self.index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(self.dim, self.hnsw_m)
+        elif self.index_type == "ivf":
+            # IVF需要足够的训练样本，数据量不足时先使用暴力检索
+            if self._count < self.ivf_nlist * 39:
+                return None
+            quantizer = faiss.IndexFlatL2(self.dim)
+            index = faiss.IndexIVFFlat(quantizer, self.dim, self.ivf_nlist)
+            sample = np.random.default_rng(0).choice(self._count, min(self._count, self.ivf_nlist * 256), replace=False)
+            index.train(np.ascontiguousarray(self._vectors[np.sort(sample)]))
+        else:
+            raise ValueError(f"不支持的本地索引类型: {self.index_type}")
+
+        for start in range(0, self._count, self._BLOCK_ROWS):
+            index.add(np.ascontiguousarray(self._vectors[start:start + self._BLOCK_ROWS]))
+        self._configure_ann(index)
+        return index
+
+    def _configure_ann(self, index):
+        if self.index_type == "hnsw":
+            index.hnsw.efSearch = self.hnsw_ef_search
+        elif self.index_type == "ivf":
+            index.nprobe = self.ivf_nprobe
+
+    def insert(
+        self,
+        document_id: str,
+        texts: List[str],
+        embeddings: np.ndarray,
+        token_counts: Optional[List[int]] = None,
+        chunk_hashes: Optional[List[str]] = None
+    ):
+        """追加文本块向量到内存映射文件"""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(len(texts), self.dim)
+        offset = None
+        with self._lock:
+            # 行号由SQLite分配；持有写锁时写入向量再提交，其他进程看到的行都已有向量
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                max_row = self._db.execute("SELECT MAX(row) FROM chunks").fetchone()[0]
+                start = max_row + 1 if max_row is not None else 0
+                self._db.executemany(
+                    "INSERT INTO chunks (row, document_id, content, token_count, chunk_hash) VALUES (?, ?, ?, ?, ?)",
+                    zip(
+                        range(start, start + len(texts)), [document_id] * len(texts), texts,
+                        token_counts or [0] * len(texts), chunk_hashes or [""] * len(texts)
+                    )
+                )
+                self._bump_generation()
+                offset = start * self.dim * 4
+                self._write_vectors(offset, embeddings.tobytes())
+                self._db.commit()
+            except BaseException:
+                # 写入失败时把向量文件截回本次写入之前，与回滚后的元数据保持一致
+                if offset is not None and os.path.exists(self._vector_path) \
+                        and os.path.getsize(self._vector_path) > offset:
+                    os.truncate(self._vector_path, offset)
+                self._db.rollback()
+                raise
+            self._sync()
+
+    def _write_vectors(self, offset: int, data: bytes):
+        """在向量文件的指定位置写入数据"""
+        fd = os.open(self._vector_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view = view[written:]
+                offset += written
+        finally:
+            os.close(fd)
+
+    def _append_rows(self, name: str, values: np.ndarray):
+        """把values写入缓冲区第self._count行之后，容量不足时按倍数扩容（旧缓冲区留给仍在使用的检索）"""
+        buffer = self._buffers[name]
+        needed = self._count + len(values)
+        if len(buffer) < needed:
+            grown = np.empty((max(needed, 2 * len(buffer), 1024),) + values.shape[1:], dtype=buffer.dtype)
+            grown[:self._count] = buffer[:self._count]
+            buffer = self._buffers[name] = grown
+        buffer[self._count:needed] = values
+
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        k: int = 5,
+        document_ids: Optional[List[str]] = None,
+        consistency_level: Optional[str] = None,
+        with_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        """检索最相近的文本块，指定文档时只在这些文档的行上计算距离"""
+        started = time.perf_counter()
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        with self._lock:
+            self._sync()
+            vectors, norms, alive, ann = self._vectors, self._norms, self._alive, self._ann
+            codes, scales = self._codes, self._scales
+            doc_rows = None
+            if document_ids is not None:
+                doc_rows = [row for document_id in document_ids for row in self._doc_rows.get(document_id, ())]
+        if vectors is None:
+            return []
+
+        # 压缩存储时先在压缩向量上多取候选，再精确重算
+        data = vectors if codes is None else codes
+        fetch = k if codes is None else k * self.rescore_factor
+        if doc_rows is not None:
+            rows = np.asarray(doc_rows, dtype=np.int64)
+            rows = rows[alive[rows]]
+            top_rows, distances = self._top_k(data, scales, norms, query, fetch, rows)
+        elif ann is not None:
+            top_rows, distances = self._ann_search(ann, alive, query, k)
+            if len(top_rows) < min(k, int(alive.sum())):
+                top_rows, distances = self._brute_force(data, scales, norms, alive, query, fetch)
+            else:
+                fetch = k
+        else:
+            top_rows, distances = self._brute_force(data, scales, norms, alive, query, fetch)
+        if fetch > k:
+            top_rows, distances = self._top_k(vectors, None, norms, query, k, np.asarray(top_rows, dtype=np.int64))
+
+        hits = self._fetch_hits(top_rows, distances)
+        if with_embeddings:
+            for hit, row in zip(hits, top_rows):
+                hit["embedding"] = np.array(vectors[row])
+        self._stats["searches"] += 1
+        self._stats["search_seconds"] += time.perf_counter() - started
+        return hits
+
+    def _ann_search(self, ann, alive: np.ndarray, query: np.ndarray, k: int) -> Tuple[List[int], List[float]]:
+        """使用近似索引检索，已删除的行在结果中过滤"""
+        self._stats["ann_searches"] += 1
+        fetch = k * 4 if not alive.all() else k
+        distances, ids = ann.search(query.reshape(1, -1), fetch)
+        found = [
+            (int(row), float(distance)) for row, distance in zip(ids[0], distances[0])
+            if 0 <= row < len(alive) and alive[row]
+        ][:k]
+        return [row for row, _ in found], [distance for _, distance in found]
+
+    def _brute_force(
+        self,
+        data: np.ndarray,
+        scales: Optional[np.ndarray],
+        norms: np.ndarray,
+        alive: np.ndarray,
+        query: np.ndarray,
+        k: int
+    ) -> Tuple[List[int], List[float]]:
+        """分块计算全部有效行的距离"""
+        candidate_rows, candidate_distances = [], []
+        for start in range(0, len(alive), self._BLOCK_ROWS):
+            end = min(start + self._BLOCK_ROWS, len(alive))
+            rows = np.arange(start, end)[alive[start:end]]
+            if not len(rows):
+                continue
+            distances = self._distances(data[start:end][rows - start], scales, norms, rows, query)
+            top = np.argpartition(distances, min(k, len(rows)) - 1)[:k]
+            candidate_rows.append(rows[top])
+            candidate_distances.append(distances[top])
+        if not candidate_rows:
+            return [], []
+        rows = np.concatenate(candidate_rows)
+        distances = np.concatenate(candidate_distances)
+        order = np.argsort(distances, kind="stable")[:k]
+        return rows[order].tolist(), distances[order].tolist()
+
+    def _top_k(
+        self,
+        data: np.ndarray,
+        scales: Optional[np.ndarray],
+        norms: np.ndarray,
+        query: np.ndarray,
+        k: int,
+        rows: np.ndarray
+    ) -> Tuple[List[int], List[float]]:
+        """只在给定行上计算距离"""
+        if not len(rows):
+            return [], []
+        rows = np.sort(rows)
+        distances = self._distances(data[rows], scales, norms, rows, query)
+        order = np.argsort(distances, kind="stable")[:k]
+        return rows[order].tolist(), distances[order].tolist()
+
+    def _distances(
+        self,
+        block: np.ndarray,
+        scales: Optional[np.ndarray],
+        norms: np.ndarray,
+        rows: np.ndarray,
+        query: np.ndarray
+    ) -> np.ndarray:
+        """平方L2距离：|x|^2 - 2x·q + |q|^2；压缩向量上为近似值，binary为汉明距离"""
+        if block.dtype == np.uint8:
+            packed = np.packbits(query > 0)
+            return _POPCOUNT[np.bitwise_xor(block, packed)].sum(axis=1, dtype=np.int64).astype(np.float32)
+        dots = np.asarray(block, dtype=np.float32) @ query
+        if block.dtype == np.int8:
+            dots *= scales[rows]
+        return norms[rows] - 2 * dots + query @ query
+
+    def _fetch_hits(self, rows: List[int], distances: List[float]) -> List[Dict[str, Any]]:
+        """按行号顺序读取文本内容与所属文档"""
+        if not rows:
+            return []
+        with self._lock:
+            found = {
+                row: (document_id, content, token_count, chunk_hash)
+                for row, document_id, content, token_count, chunk_hash in self._db.execute(
+                    "SELECT row, document_id, content, token_count, chunk_hash FROM chunks "
+                    f"WHERE row IN ({','.join('?' * len(rows))})",
+                    rows
+                )
+            }
+        return [
+            {
+                "content": found[row][1],
+                "document_id": found[row][0],
+                "distance": distance,
+                "token_count": found[row][2] or None,
+                "chunk_hash": found[row][3] or None
+            }
+            for row, distance in zip(rows, distances) if row in found
+        ]
+
+    def delete_by_document_id(self, document_id: str):
+        """标记删除指定文档的所有文本块"""
+        with self._lock:
+            with self._db:
+                generation = self._bump_generation()
+                self._db.execute(
+                    "UPDATE chunks SET deleted = ? WHERE document_id = ? AND deleted = 0", (generation, document_id)
+                )
+            self._sync()
+
+    def chunk_hashes(self, document_id: str) -> Set[str]:
+        """返回文档现有文本块的哈希集合"""
+        with self._lock:
+            return {
+                chunk_hash for (chunk_hash,) in self._db.execute(
+                    "SELECT chunk_hash FROM chunks WHERE document_id = ? AND deleted = 0", (document_id,)
+                )
+            }
+
+    def delete_chunks(self, document_id: str, chunk_hashes: List[str]):
+        """标记删除文档中指定哈希的文本块"""
+        stale = set(chunk_hashes)
+        with self._lock:
+            rows = [
+                row for row, chunk_hash in self._db.execute(
+                    "SELECT row, chunk_hash FROM chunks WHERE document_id = ? AND deleted = 0", (document_id,)
+                )
+                if chunk_hash in stale
+            ]
+            if not rows:
+                return
+            with self._db:
+                generation = self._bump_generation()
+                self._db.executemany(
+                    "UPDATE chunks SET deleted = ? WHERE row = ? AND deleted = 0", [(generation, row) for row in rows]
+                )
+            self._sync()
+
+    def flush(self):
+        """同步向量文件并保存近似索引"""
+        with self._lock:
+            if os.path.exists(self._vector_path):
+                with open(self._vector_path, "rb+") as file:
+                    os.fsync(file.fileno())
+            if self._ann is not None:
+                faiss.write_index(self._ann, self._index_path)
+
+    def stats(self) -> Dict[str, Any]:
+        searches = self._stats["searches"]
+        return {
+            "backend": "local",
+            "index_type": self.index_type,
+            "vector_dtype": self.vector_dtype,
+            "code_bytes": int(self._codes.nbytes) if self._codes is not None else 0,
+            "rows": self._count,
+            "alive_rows": int(self._alive.sum()),
+            "documents": len(self._doc_rows),
+            **self._stats,
+            "avg_search_ms": self._stats["search_seconds"] / searches * 1000 if searches else 0.0,
+        }
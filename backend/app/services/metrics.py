@@ -0,0 +1,208 @@
+import os
+import time
+import uuid
+import bisect
+import threading
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+# 各阶段耗时的分桶上限（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# 模型输出速度的分桶上限（片段/秒）
+RATE_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# 当前请求的跟踪信息：请求ID与各阶段累计耗时
+_trace: ContextVar[Optional[Dict[str, Any]]] = ContextVar("trace", default=None)
+_NULL_TIMER = nullcontext()
+T = TypeVar("T")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Histogram:
+    """Prometheus直方图：按标签值分别统计各分桶的计数、总和与次数，可在多个线程中记录"""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # 标签值 -> [各分桶计数（不累加）, 总和, 次数]
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, [list(data[0]), data[1], data[2]]) for labels, data in self._series.items())
+        for labels, (counts, total, count) in series:
+            label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = label_text + "," if label_text else ""
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound:g}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "started")
+
+    def __init__(self, metrics: "Metrics", stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started)
+
+
+class Metrics:
+    """检索、模型调用与文档入库各阶段的耗时直方图，以Prometheus文本格式导出
+
+    METRICS_ENABLED=false时所有记录调用直接返回；METRICS_TRACE=true时按请求ID输出每个请求的各阶段耗时。
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+        self.trace = os.getenv("METRICS_TRACE", "false").lower() == "true"
+        self.stage_seconds = Histogram(
+            "aidocsearch_stage_seconds", "各处理阶段的耗时（秒）", ("stage",)
+        )
+        self.ingest_seconds = Histogram(
+            "aidocsearch_ingest_stage_seconds", "文档入库各阶段的耗时（秒，每个文档记录一次）", ("stage",)
+        )
+        self.provider_ttft = Histogram(
+            "aidocsearch_provider_ttft_seconds", "从调用模型到收到首个片段的耗时（秒）", ("provider", "model")
+        )
+        self.provider_rate = Histogram(
+            "aidocsearch_provider_chunks_per_second", "首个片段之后模型输出的速度（片段/秒）",
+            ("provider", "model"), RATE_BUCKETS
+        )
+        self.stream_seconds = Histogram(
+            "aidocsearch_stream_duration_seconds", "流式回答从开始到结束的总耗时（秒）", ("provider", "model")
+        )
+        self.request_seconds = Histogram(
+            "aidocsearch_http_request_duration_seconds", "HTTP请求的总耗时（秒，流式响应到最后一帧）",
+            ("method", "route", "status")
+        )
+        self._histograms = [
+            self.stage_seconds, self.ingest_seconds, self.provider_ttft,
+            self.provider_rate, self.stream_seconds, self.request_seconds
+        ]
+
+    def observe(self, stage: str, seconds: float):
+        """记录一个阶段的耗时，并计入当前请求的跟踪信息"""
+        if not self.enabled:
+            return
+        self.stage_seconds.observe(seconds, stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace["stages"][stage] = trace["stages"].get(stage, 0.0) + seconds
+
+    def timer(self, stage: str):
+        """统计with块的耗时；未启用时返回空的上下文管理器"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    async def measure(self, stage: str, awaitable: Awaitable[T]) -> T:
+        """等待awaitable完成并记录耗时，用于与其他阶段并发执行的任务"""
+        if not self.enabled:
+            return await awaitable
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def observe_ingest(self, timings: Dict[str, float]):
+        """记录一个文档入库各阶段的累计耗时"""
+        if not self.enabled:
+            return
+        for stage, seconds in timings.items():
+            self.ingest_seconds.observe(seconds, stage)
+
+    def observe_stream(self, provider: str, model: str, ttft: Optional[float], duration: float, chunks: int):
+        """记录一次模型流式输出的首字延迟、输出速度和总耗时"""
+        if not self.enabled:
+            return
+        self.stream_seconds.observe(duration, provider, model)
+        self.observe("stream_total", duration)
+        if ttft is None:
+            return
+        self.provider_ttft.observe(ttft, provider, model)
+        self.observe("provider_ttft", ttft)
+        if chunks > 1 and duration > ttft:
+            self.provider_rate.observe((chunks - 1) / (duration - ttft), provider, model)
+
+    def render(self) -> str:
+        lines = []
+        for histogram in self._histograms:
+            lines.extend(histogram.render())
+        return "\n".join(lines) + "\n"
+
+
+class RequestMetricsMiddleware:
+    """ASGI中间件：为每个请求分配X-Request-ID（沿用客户端传入的值），记录包括流式响应在内的总耗时"""
+
+    def __init__(self, app, metrics: "Metrics"):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = _trace.set({"id": request_id, "stages": {}})
+        status = [500]
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            elapsed = time.perf_counter() - started
+            # 按路由模板而不是实际路径统计，避免文档ID等路径参数造成标签爆炸
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.metrics.request_seconds.observe(elapsed, scope["method"], route, str(status[0]))
+            if self.metrics.trace:
+                stages = " ".join(
+                    f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in _trace.get()["stages"].items()
+                )
+                print(f"[{request_id}] {scope['method']} {scope['path']} {status[0]} {elapsed * 1000:.1f}ms {stages}")
+            _trace.reset(token)
+
+
+metrics = Metrics()
@@ -0,0 +1,344 @@
+import os
+import json
+import math
+from typing import Any, Dict, List, Optional, Set
+import numpy as np
+from pymilvus import (
+    connections,
+    utility,
+    Collection,
+    CollectionSchema,
+    FieldSchema,
+    DataType
+)
+from .vector_backend import VectorBackend
+from .collection_manager import CollectionManager
+
+
+INDEX_TYPES = ("FLAT", "IVF_FLAT", "IVF_SQ8", "IVF_PQ", "HNSW")
+
+
+def default_index_params(index_type: str, num_rows: int, dim: int) -> Dict[str, int]:
+    """根据数据量和维度估算索引构建参数"""
+    if index_type == "FLAT":
+        return {}
+    if index_type == "HNSW":
+        return {"M": 16 if num_rows < 1_000_000 else 32, "efConstruction": 200}
+
+    # IVF系列：nlist取约4*sqrt(N)，保证每个桶有足够的向量
+    params = {"nlist": int(min(65536, max(16, 4 * math.sqrt(max(num_rows, 1)))))}
+    if index_type == "IVF_PQ":
+        # 子空间数取能整除维度、且每个子空间约4维的最大值
+        m = max(d for d in range(1, dim + 1) if dim % d == 0 and dim // d >= 4)
+        params.update({"m": m, "nbits": 8})
+    return params
+
+
+def default_search_params(index_type: str, index_params: Dict[str, Any], k: int) -> Dict[str, int]:
+    """根据索引参数和返回数量估算检索参数"""
+    if index_type == "FLAT":
+        return {}
+    if index_type == "HNSW":
+        return {"ef": max(64, 2 * k)}
+    nlist = int(index_params.get("nlist", 1024))
+    return {"nprobe": int(min(nlist, max(8, 2 * math.sqrt(nlist))))}
+
+
+def select_index_type(num_rows: int) -> str:
+    """AUTO模式下按数据量选择索引类型"""
+    if num_rows < 100_000:
+        return "FLAT"
+    if num_rows < 10_000_000:
+        return "HNSW"
+    return "IVF_SQ8"
+
+
+class MilvusBackend(VectorBackend):
+    """Milvus向量索引后端"""
+
+    def __init__(self, dim: int):
+        self.host = os.getenv("MILVUS_HOST", "localhost")
+        self.port = os.getenv("MILVUS_PORT", "19530")
+        self.collection_name = "document_chunks"
+        self.dim = dim
+        self.metric_type = os.getenv("MILVUS_METRIC_TYPE", "L2")
+        # FLAT / IVF_FLAT / IVF_SQ8 / IVF_PQ / HNSW / AUTO
+        self.index_type = os.getenv("MILVUS_INDEX_TYPE", "IVF_FLAT").upper()
+        # 建集合时集合为空，按预期数据量估算构建参数
+        self.expected_rows = int(os.getenv("MILVUS_EXPECTED_ROWS", "1000000"))
+        self.index_params_override = json.loads(os.getenv("MILVUS_INDEX_PARAMS") or "{}")
+        self.search_params_override = json.loads(os.getenv("MILVUS_SEARCH_PARAMS") or "{}")
+        # 新建集合时以document_id为分区键，按文档检索和删除只访问相关分区
+        self.use_partition_key = os.getenv("MILVUS_PARTITION_KEY", "document_id").lower() == "document_id"
+        self.num_partitions = int(os.getenv("MILVUS_NUM_PARTITIONS", "64"))
+        self.max_filter_documents = int(os.getenv("MILVUS_MAX_FILTER_DOCUMENTS", "1000"))
+        self.hash_batch_size = 1000
+        self._connect()
+        self._init_collection()
+        self._attach(self.collection)
+
+    def _attach(self, collection: Collection):
+        """切换到指定集合"""
+        self.collection = collection
+        self.manager = CollectionManager(collection)
+        # 旧集合可能没有后来新增的字段（如token_count），读写时按实际字段处理
+        self.fields = {field.name for field in collection.schema.fields}
+        dim = next(field.params.get("dim") for field in collection.schema.fields if field.name == "embedding")
+        if dim is not None and int(dim) != self.dim:
+            raise ValueError(f"集合{collection.name}的向量维度为{dim}，与当前模型的维度{self.dim}不一致")
+        self.supports_chunk_hashes = "chunk_hash" in self.fields
+        self.partition_key = next(
+            (field.name for field in collection.schema.fields if getattr(field, "is_partition_key", False)),
+            None
+        )
+        self._load_index_info()
+
+    def _connect(self):
+        """连接到Milvus服务器"""
+        connections.connect(
+            alias="default",
+            host=self.host,
+            port=self.port
+        )
+
+    def _init_collection(self):
+        """初始化集合，如果不存在则创建"""
+        if utility.exists_collection(self.collection_name):
+            self.collection = Collection(self.collection_name)
+            return
+
+        self.collection = self._create_collection(self.collection_name, self.use_partition_key)
+        self._create_index(self.expected_rows)
+
+    def _create_collection(self, name: str, partition_key: bool) -> Collection:
+        """按当前配置创建集合"""
+        fields = [
+            FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
+            FieldSchema(name="document_id", dtype=DataType.VARCHAR, max_length=100, is_partition_key=partition_key),
+            FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=65535),
+            FieldSchema(name="token_count", dtype=DataType.INT32),
+            FieldSchema(name="chunk_hash", dtype=DataType.VARCHAR, max_length=64),
+            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=self.dim)
+        ]
+        schema = CollectionSchema(fields=fields, description="文档块存储")
+        if partition_key:
+            return Collection(name, schema, num_partitions=self.num_partitions)
+        return Collection(name, schema)
+
+    def _build_index_params(self, num_rows: int) -> Dict[str, Any]:
+        """生成完整的索引参数，环境变量中的参数优先"""
+        index_type = select_index_type(num_rows) if self.index_type == "AUTO" else self.index_type
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"不支持的索引类型: {index_type}")
+        return {
+            "metric_type": self.metric_type,
+            "index_type": index_type,
+            "params": {**default_index_params(index_type, num_rows, self.dim), **self.index_params_override}
+        }
+
+    def _create_index(self, num_rows: int, collection: Optional[Collection] = None):
+        """创建索引"""
+        (collection or self.collection).create_index(
+            field_name="embedding",
+            index_params=self._build_index_params(num_rows)
+        )
+
+    def _load_index_info(self):
+        """读取集合当前的索引配置，用于推导检索参数"""
+        index = self.collection.index()
+        self.active_index_type = index.params["index_type"]
+        self.active_index_params = index.params.get("params", {})
+        if isinstance(self.active_index_params, str):
+            self.active_index_params = json.loads(self.active_index_params)
+        self.metric_type = index.params.get("metric_type", self.metric_type)
+        if self.index_type not in ("AUTO", self.active_index_type):
+            print(f"集合现有索引为{self.active_index_type}，与配置的{self.index_type}不一致，可调用rebuild_index()重建")
+
+    def rebuild_index(self):
+        """按当前实际数据量重新调优并重建索引"""
+        self.manager.flush()
+        self.collection.release()
+        self.manager.mark_unloaded()
+        self.collection.drop_index()
+        self._create_index(self.collection.num_entities)
+        self._load_index_info()
+
+    def search_params(self, k: int) -> Dict[str, Any]:
+        """生成检索参数，环境变量中的参数优先"""
+        return {
+            "metric_type": self.metric_type,
+            "params": {
+                **default_search_params(self.active_index_type, self.active_index_params, k),
+                **self.search_params_override
+            }
+        }
+
+    def insert(
+        self,
+        document_id: str,
+        texts: List[str],
+        embeddings: np.ndarray,
+        token_counts: Optional[List[int]] = None,
+        chunk_hashes: Optional[List[str]] = None
+    ):
+        """插入已生成向量的文本块"""
+        # 插入数据，刷盘由集合管理器按策略合并进行
+        self.manager.insert(self._columns(self.collection, {
+            "document_id": [document_id] * len(texts),
+            "content": texts,
+            "token_count": token_counts or [0] * len(texts),
+            "chunk_hash": chunk_hashes or [""] * len(texts),
+            "embedding": embeddings.tolist()
+        }))
+
+    @staticmethod
+    def _columns(collection: Collection, data: Dict[str, list]) -> List[list]:
+        """按集合字段顺序排列列数据（跳过自增主键）"""
+        return [data[field.name] for field in collection.schema.fields if not field.auto_id]
+
+    @staticmethod
+    def _document_expr(document_id: str) -> str:
+        """生成按文档过滤的表达式，对文档ID做转义"""
+        return f"document_id == {json.dumps(document_id, ensure_ascii=False)}"
+
+    @classmethod
+    def _documents_expr(cls, document_ids: List[str]) -> str:
+        """生成按多个文档过滤的表达式"""
+        if len(document_ids) == 1:
+            return cls._document_expr(document_ids[0])
+        return f"document_id in {json.dumps(list(document_ids), ensure_ascii=False)}"
+
+    def flush(self):
+        """立即刷入所有待刷盘的写入"""
+        self.manager.flush()
+
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        k: int = 5,
+        document_ids: Optional[List[str]] = None,
+        consistency_level: Optional[str] = None,
+        with_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        """使用查询向量执行搜索"""
+        if document_ids is not None and not document_ids:
+            return []
+
+        # 执行搜索（集合只在首次检索时加载；分区键集合上按文档过滤只扫描对应分区）
+        expr = self._documents_expr(document_ids) if document_ids else None
+        output_fields = ["content", "document_id"] + [
+            field for field in ("token_count", "chunk_hash") if field in self.fields
+        ]
+        if with_embeddings:
+            output_fields.append("embedding")
+        results = self.manager.search(
+            consistency_level=consistency_level,
+            data=[np.asarray(query_embedding, dtype=np.float32).ravel().tolist()],
+            anns_field="embedding",
+            param=self.search_params(k),
+            limit=k,
+            expr=expr,
+            output_fields=output_fields
+        )
+
+        # 返回结果
+        hits = []
+        for hit in results[0]:
+            result = {
+                "content": hit.entity.get("content"),
+                "document_id": hit.entity.get("document_id"),
+                # IP/COSINE越大越相近，取负值使所有度量下distance都是越小越相近，便于跨文档合并
+                "distance": -hit.distance if self.metric_type.upper() in ("IP", "COSINE") else hit.distance,
+                "token_count": hit.entity.get("token_count") or None,
+                "chunk_hash": hit.entity.get("chunk_hash") or None
+            }
+            if with_embeddings:
+                result["embedding"] = np.asarray(hit.entity.get("embedding"), dtype=np.float32)
+            hits.append(result)
+        return hits
+
+    def delete_by_document_id(self, document_id: str):
+        """删除指定文档ID的所有记录"""
+        self.manager.delete(self._document_expr(document_id))
+
+    def chunk_hashes(self, document_id: str) -> Set[str]:
+        """分批读取文档现有文本块的哈希"""
+        self.manager.ensure_loaded()
+        iterator = self.collection.query_iterator(
+            batch_size=self.hash_batch_size,
+            expr=self._document_expr(document_id),
+            output_fields=["chunk_hash"],
+            consistency_level="Strong"
+        )
+        hashes = set()
+        while True:
+            rows = iterator.next()
+            if not rows:
+                iterator.close()
+                return hashes
+            hashes.update(row["chunk_hash"] for row in rows)
+
+    def delete_chunks(self, document_id: str, chunk_hashes: List[str]):
+        """按哈希分批删除文档中的文本块"""
+        for start in range(0, len(chunk_hashes), self.hash_batch_size):
+            batch = chunk_hashes[start:start + self.hash_batch_size]
+            self.manager.delete(
+                f"{self._document_expr(document_id)} and chunk_hash in {json.dumps(batch)}"
+            )
+
+    def migrate_to_partition_key(self, batch_size: int = 1000) -> int:
+        """将现有集合迁移为以document_id为分区键的新集合，返回迁移的行数
+
+        迁移期间应暂停写入。旧集合重命名为 <collection>_legacy 保留，确认无误后可手动删除。
+        """
+        if self.partition_key:
+            print(f"集合{self.collection_name}已使用分区键{self.partition_key}，无需迁移")
+            return 0
+
+        target_name = f"{self.collection_name}_partitioned"
+        legacy_name = f"{self.collection_name}_legacy"
+        if utility.has_collection(target_name):
+            # 上次迁移未完成留下的中间集合
+            utility.drop_collection(target_name)
+        target = self._create_collection(target_name, partition_key=True)
+
+        self.manager.flush()
+        self.manager.ensure_loaded()
+        iterator = self.collection.query_iterator(
+            batch_size=batch_size,
+            output_fields=[
+                field for field in ("document_id", "content", "token_count", "chunk_hash", "embedding")
+                if field in self.fields
+            ]
+        )
+        copied = 0
+        while True:
+            rows = iterator.next()
+            if not rows:
+                iterator.close()
+                break
+            target.insert(self._columns(target, {
+                "document_id": [row["document_id"] for row in rows],
+                "content": [row["content"] for row in rows],
+                "token_count": [row.get("token_count", 0) for row in rows],
+                "chunk_hash": [row.get("chunk_hash", "") for row in rows],
+                "embedding": [row["embedding"] for row in rows]
+            }))
+            copied += len(rows)
+        target.flush()
+        self._create_index(copied, target)
+
+        self.collection.release()
+        utility.rename_collection(self.collection_name, legacy_name)
+        utility.rename_collection(target_name, self.collection_name)
+        self._attach(Collection(self.collection_name))
+        return copied
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "milvus",
+            "index_type": self.active_index_type,
+            "index_params": self.active_index_params,
+            "partition_key": self.partition_key,
+            **self.manager.stats()
+        }
@@ -1,9 +1,8 @@
 import os
-import aiohttp
-import ollama
 from typing import List, Dict
 import asyncio
 from datetime import datetime, timedelta
+from .http_client import http_client
 
 class ModelManager:
     def __init__(self):
@@ -40,45 +39,51 @@ class ModelManager:
     async def _update_deepseek_models(self):
         """获取DeepSeek可用模型列表"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    "https://api.deepseek.com/v1/models",
-                    headers={"Authorization": f"Bearer {os.getenv('DEEPSEEK_API_KEY')}"}
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        self._models["deepseek"] = [
-                            model["id"] for model in data.get("data", [])
-                        ]
-                    else:
-                        self._models["deepseek"] = ["deepseek-chat"]
+            url = f"{os.getenv('DEEPSEEK_API_BASE', 'https://api.deepseek.com/v1')}/models"
+            async with http_client.session(url).get(
+                url,
+                headers={"Authorization": f"Bearer {os.getenv('DEEPSEEK_API_KEY')}"}
+            ) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    self._models["deepseek"] = [
+                        model["id"] for model in data.get("data", [])
+                    ]
+                else:
+                    self._models["deepseek"] = ["deepseek-chat"]
         except Exception:
             self._models["deepseek"] = ["deepseek-chat"]
 
     async def _update_ollama_models(self):
         """获取Ollama可用模型列表"""
         try:
-            models = ollama.list()
-            self._models["ollama"] = [model["name"] for model in models.get("models", [])]
+            # 与生成请求共用连接池，不再经ollama客户端发出同步请求阻塞事件循环
+            url = f"{os.getenv('OLLAMA_HOST', 'http://ollama:11434')}/api/tags"
+            async with http_client.session(url).get(url) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    self._models["ollama"] = [
+                        model["name"] for model in data.get("models", [])
+                    ]
+                else:
+                    self._models["ollama"] = ["llama2"]
         except Exception:
             self._models["ollama"] = ["llama2"]
 
     async def _update_groq_models(self):
         """获取GROQ可用模型列表"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    "https://api.groq.com/v1/models",
-                    headers={"Authorization": f"Bearer {os.getenv('GROQ_API_KEY')}"}
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        self._models["groq"] = [
-                            model["id"] for model in data.get("data", [])
-                        ]
-                    else:
-                        self._models["groq"] = ["mixtral-8x7b-32768"]
+            url = f"{os.getenv('GROQ_API_BASE', 'https://api.groq.com/openai/v1')}/models"
+            async with http_client.session(url).get(
+                url,
+                headers={"Authorization": f"Bearer {os.getenv('GROQ_API_KEY')}"}
+            ) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    self._models["groq"] = [
+                        model["id"] for model in data.get("data", [])
+                    ]
+                else:
+                    self._models["groq"] = ["mixtral-8x7b-32768"]
         except Exception:
             self._models["groq"] = ["mixtral-8x7b-32768"]
-
-model_manager = ModelManager()
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from typing import Any, AsyncGenerator, Callable, Deque, Dict, List, Optional, Tuple
+
+ROUTING_MODES = ("direct", "hedged")
+
+# 打开一路模型输出流：(provider, model) -> 异步生成器
+OpenStream = Callable[[str, str], AsyncGenerator[str, None]]
+
+
+class _Health:
+    """一个（提供商，模型）最近的首字延迟与成败记录"""
+
+    def __init__(self, window: int):
+        self.ttft: Deque[float] = deque(maxlen=window)
+        self.errors: Deque[bool] = deque(maxlen=window)
+        self.stats = {"requests": 0, "errors": 0, "hedges": 0, "alternate_wins": 0, "failovers": 0}
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.ttft:
+            return None
+        values = sorted(self.ttft)
+        return values[min(len(values) - 1, int(len(values) * p))]
+
+    def error_rate(self) -> float:
+        return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+
+class ProviderRouter:
+    """按延迟路由模型请求：记录各模型的首字延迟和错误率
+
+    hedged模式下，主模型超过其p95首字延迟仍未输出时，向PROVIDER_HEDGE_MAP中配置的等价模型发出对冲请求，
+    采用先输出首字的一路并取消另一路；首字之前失败时立即切换到等价模型。
+    """
+
+    def __init__(self):
+        self.mode = os.getenv("PROVIDER_ROUTING", "direct").lower()
+        if self.mode not in ROUTING_MODES:
+            raise ValueError(f"不支持的路由方式: {self.mode}")
+        # {"deepseek/deepseek-chat": ["groq/llama3-70b-8192"]}，值也可以是单个字符串
+        hedge_map = json.loads(os.getenv("PROVIDER_HEDGE_MAP", "{}"))
+        self.hedge_map: Dict[str, List[str]] = {
+            key: [value] if isinstance(value, str) else list(value) for key, value in hedge_map.items()
+        }
+        self.percentile = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+        # 样本不足时使用的对冲等待时间，以及对冲等待时间的下限
+        self.default_delay = float(os.getenv("HEDGE_DEFAULT_DELAY_MS", "2000")) / 1000
+        self.min_delay = float(os.getenv("HEDGE_MIN_DELAY_MS", "200")) / 1000
+        self.min_samples = 20
+        # 错误率超过这个比例的模型排到等价模型之后
+        self.max_error_rate = float(os.getenv("PROVIDER_MAX_ERROR_RATE", "0.5"))
+        self.window = int(os.getenv("PROVIDER_STATS_WINDOW", "200"))
+        self._health: Dict[Tuple[str, str], _Health] = {}
+
+    def _get_health(self, provider: str, model: str) -> _Health:
+        health = self._health.get((provider, model))
+        if health is None:
+            health = self._health[(provider, model)] = _Health(self.window)
+        return health
+
+    def candidates(self, provider: str, model: str) -> List[Tuple[str, str]]:
+        """请求的模型及其等价模型，错误率过高的排在后面"""
+        result = [(provider, model)] + [
+            tuple(item.split("/", 1)) for item in self.hedge_map.get(f"{provider}/{model}", []) if "/" in item
+        ]
+        if len(result) == 1:
+            return result
+        errors = [self._get_health(*key).errors for key in result]
+        return [
+            key for key, _ in sorted(
+                zip(result, errors),
+                key=lambda item: len(item[1]) >= self.min_samples and sum(item[1]) / len(item[1]) > self.max_error_rate
+            )
+        ]
+
+    def hedge_delay(self, provider: str, model: str) -> float:
+        """对冲等待时间：该模型首字延迟的p95，样本不足时用默认值"""
+        health = self._get_health(provider, model)
+        if len(health.ttft) < self.min_samples:
+            return self.default_delay
+        return max(self.min_delay, health.percentile(self.percentile))
+
+    async def stream(self, provider: str, model: str, open_stream: OpenStream) -> AsyncGenerator[str, None]:
+        """输出模型回答；hedged模式下按上面的规则对冲和切换"""
+        candidates = self.candidates(provider, model) if self.mode == "hedged" else [(provider, model)]
+        attempts: Dict[asyncio.Task, Tuple[Tuple[str, str], AsyncGenerator[str, None]]] = {}
+        remaining = list(candidates)
+        winner = None
+        error: Optional[BaseException] = None
+
+        def launch():
+            key = remaining.pop(0)
+            generator = open_stream(*key)
+            self._get_health(*key).stats["requests"] += 1
+            attempts[asyncio.ensure_future(self._first_chunk(key, generator))] = (key, generator)
+
+        launch()
+        try:
+            while winner is None:
+                running = [task for task in attempts if not task.done()]
+                if not running:
+                    if not remaining:
+                        raise error
+                    # 首字之前失败：切换到下一个等价模型
+                    self._get_health(*candidates[0]).stats["failovers"] += 1
+                    launch()
+                    continue
+                timeout = None
+                if remaining and len(running) == 1 and len(attempts) == 1:
+                    timeout = self.hedge_delay(*candidates[0])
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 超过首字延迟的p95仍无输出：发出对冲请求
+                    self._get_health(*candidates[0]).stats["hedges"] += 1
+                    launch()
+                    continue
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = task
+        finally:
+            # 取消或关闭其余各路请求，释放连接和调度名额
+            for task, (_, generator) in attempts.items():
+                if task is not winner:
+                    task.cancel()
+            for task, (_, generator) in attempts.items():
+                if task is not winner:
+                    await asyncio.gather(task, return_exceptions=True)
+                    await generator.aclose()
+
+        key, generator = attempts[winner]
+        if key != candidates[0]:
+            # 由等价模型完成的回答（对冲胜出或首字之前切换）
+            self._get_health(*candidates[0]).stats["alternate_wins"] += 1
+        first = winner.result()
+        if first is None:
+            return
+        try:
+            yield first
+            async for chunk in generator:
+                yield chunk
+        except Exception:
+            self._record_error(key)
+            raise
+        finally:
+            await generator.aclose()
+
+    async def _first_chunk(self, key: Tuple[str, str], generator: AsyncGenerator[str, None]) -> Optional[str]:
+        """等待一路输出的首个片段并记录首字延迟；没有任何输出时返回None"""
+        started = time.perf_counter()
+        try:
+            chunk = await generator.__anext__()
+        except StopAsyncIteration:
+            chunk = None
+        except Exception:
+            self._record_error(key)
+            raise
+        health = self._get_health(*key)
+        health.ttft.append(time.perf_counter() - started)
+        health.errors.append(False)
+        return chunk
+
+    def _record_error(self, key: Tuple[str, str]):
+        health = self._get_health(*key)
+        health.errors.append(True)
+        health.stats["errors"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        result = {}
+        for (provider, model), health in self._health.items():
+            p50, p95 = health.percentile(0.5), health.percentile(0.95)
+            result[f"{provider}/{model}"] = {
+                **health.stats,
+                "ttft_p50_ms": p50 * 1000 if p50 is not None else None,
+                "ttft_p95_ms": p95 * 1000 if p95 is not None else None,
+                "error_rate": health.error_rate(),
+                "hedge_delay_ms": self.hedge_delay(provider, model) * 1000,
+            }
+        return {"mode": self.mode, "models": result}
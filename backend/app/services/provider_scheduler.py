@@ -0,0 +1,227 @@
+import os
+import json
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+# 数值越小优先级越高：交互式检索优先于上传文档时生成的摘要
+INTERACTIVE, BACKGROUND = 0, 1
+PRIORITIES = {"interactive": INTERACTIVE, "background": BACKGROUND}
+
+
+class AdmissionRejected(Exception):
+    """预计排队时间超出上限或队列已满时拒绝请求，status_code为429或503，retry_after为建议的重试秒数"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Lane:
+    """一个（提供商，模型）的令牌桶、并发计数与按优先级、按用户分开的等待队列"""
+
+    def __init__(self, rate: float, burst: int, concurrency: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.concurrency = max(1, concurrency)
+        self.tokens = float(self.burst)
+        self.refilled_at = time.monotonic()
+        self.active = 0
+        # 优先级 -> 用户 -> 该用户的等待者，按用户轮转出队
+        self.queues: List["OrderedDict[str, Deque[asyncio.Future]]"] = [OrderedDict() for _ in PRIORITIES]
+        self.queued = [0] * len(PRIORITIES)
+        self.timer: Optional[asyncio.TimerHandle] = None
+        # 每次占用并发槽的平均时长，用于估算排队时间
+        self.hold_seconds: Optional[float] = None
+        self.waits: Deque[float] = deque(maxlen=1024)
+        self.stats = {"admitted": 0, "rejected_429": 0, "rejected_503": 0, "timeouts": 0}
+
+    def refill(self, now: float):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def ahead_of(self, priority: int) -> int:
+        """优先级不低于priority的排队数"""
+        return sum(self.queued[:priority + 1])
+
+
+class ProviderScheduler:
+    """模型提供商请求调度：按（提供商，模型）做令牌桶限速和并发上限，同优先级内各用户轮流出队
+
+    预计排队时间超过上限时直接拒绝（429），队列已满时返回503，都带有Retry-After，避免所有用户一起变慢。
+    """
+
+    def __init__(self):
+        # 按 "provider/model" 或 "provider" 配置，如 {"groq": {"rate": 0.5, "burst": 5, "concurrency": 4}}
+        self.limits: Dict[str, Dict[str, float]] = json.loads(os.getenv("PROVIDER_LIMITS", "{}"))
+        # 每秒请求数，0表示不限速
+        self.default_rate = float(os.getenv("PROVIDER_RATE", "0"))
+        self.default_burst = int(os.getenv("PROVIDER_BURST", "10"))
+        self.default_concurrency = int(os.getenv("PROVIDER_CONCURRENCY", "16"))
+        self.max_queue = int(os.getenv("PROVIDER_MAX_QUEUE", "100"))
+        # 各优先级允许的最长排队时间
+        self.max_wait = [
+            float(os.getenv("PROVIDER_MAX_QUEUE_WAIT_MS", "5000")) / 1000,
+            float(os.getenv("PROVIDER_BACKGROUND_MAX_QUEUE_WAIT_MS", "300000")) / 1000,
+        ]
+        self._lanes: Dict[Tuple[str, str], _Lane] = {}
+
+    def _lane(self, provider: str, model: str) -> _Lane:
+        lane = self._lanes.get((provider, model))
+        if lane is None:
+            limits = self.limits.get(f"{provider}/{model}", self.limits.get(provider, {}))
+            lane = self._lanes[(provider, model)] = _Lane(
+                float(limits.get("rate", self.default_rate)),
+                int(limits.get("burst", self.default_burst)),
+                int(limits.get("concurrency", self.default_concurrency))
+            )
+        return lane
+
+    def estimate_wait(self, provider: str, model: str, priority: int = INTERACTIVE) -> float:
+        """估算新请求的排队秒数"""
+        lane = self._lane(provider, model)
+        now = time.monotonic()
+        lane.refill(now)
+        ahead = lane.ahead_of(priority)
+        if not ahead and lane.active < lane.concurrency and (lane.rate <= 0 or lane.tokens >= 1):
+            return 0.0
+        wait = 0.0
+        if lane.rate > 0:
+            # 令牌桶：排在前面的请求用完现有令牌后，每个请求还需等1/rate秒
+            wait = max(0.0, ahead + 1 - lane.tokens) / lane.rate
+        if lane.hold_seconds is not None and lane.active + ahead >= lane.concurrency:
+            # 并发已满：每释放一个槽放行一个，平均每 hold/concurrency 秒一个
+            wait = max(wait, (lane.active + ahead + 1 - lane.concurrency) * lane.hold_seconds / lane.concurrency)
+        return wait
+
+    def check(self, provider: str, model: str, priority: int = INTERACTIVE):
+        """准入检查：队列已满返回503，预计排队时间超过上限返回429"""
+        lane = self._lane(provider, model)
+        if sum(lane.queued) >= self.max_queue:
+            lane.stats["rejected_503"] += 1
+            retry_after = self.estimate_wait(provider, model, priority)
+            raise AdmissionRejected(
+                f"{provider}/{model} 请求队列已满", 503, max(1, math.ceil(retry_after))
+            )
+        wait = self.estimate_wait(provider, model, priority)
+        if wait > self.max_wait[priority]:
+            lane.stats["rejected_429"] += 1
+            raise AdmissionRejected(
+                f"{provider}/{model} 请求过多，预计需要排队{wait:.1f}秒", 429, max(1, math.ceil(wait))
+            )
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        provider: str,
+        model: str,
+        user_id: Optional[str] = None,
+        priority: int = INTERACTIVE
+    ) -> AsyncIterator[None]:
+        """占用一个请求名额直到退出；排队超过上限时抛出AdmissionRejected"""
+        self.check(provider, model, priority)
+        lane = self._lane(provider, model)
+        enqueued_at = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        lane.queues[priority].setdefault(user_id or "", deque()).append(waiter)
+        lane.queued[priority] += 1
+        self._dispatch(lane)
+        granted = False
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait[priority])
+            granted = True
+        except asyncio.TimeoutError:
+            lane.stats["timeouts"] += 1
+            raise AdmissionRejected(
+                f"{provider}/{model} 排队超时", 503, max(1, math.ceil(self.estimate_wait(provider, model, priority)))
+            )
+        finally:
+            if not granted and waiter.done():
+                # 放行的同时超时或被取消：归还名额
+                lane.active -= 1
+                self._dispatch(lane)
+            elif not granted:
+                # 从队列中移除，名额留给后面的请求
+                waiter.cancel()
+                lane.queued[priority] -= 1
+
+        started = time.monotonic()
+        lane.waits.append(started - enqueued_at)
+        lane.stats["admitted"] += 1
+        try:
+            yield
+        finally:
+            held = time.monotonic() - started
+            lane.hold_seconds = held if lane.hold_seconds is None else 0.9 * lane.hold_seconds + 0.1 * held
+            lane.active -= 1
+            self._dispatch(lane)
+
+    def _dispatch(self, lane: _Lane):
+        """在有并发名额和令牌时，按优先级、按用户轮流放行等待者"""
+        if lane.timer is not None:
+            lane.timer.cancel()
+            lane.timer = None
+        now = time.monotonic()
+        lane.refill(now)
+        while lane.active < lane.concurrency:
+            waiter = self._next_waiter(lane)
+            if waiter is None:
+                return
+            if lane.rate > 0 and lane.tokens < 1:
+                # 令牌不足：等到攒够一个令牌再放行
+                lane.timer = asyncio.get_running_loop().call_later(
+                    (1 - lane.tokens) / lane.rate, self._dispatch, lane
+                )
+                return
+            self._pop_waiter(lane)
+            if lane.rate > 0:
+                lane.tokens -= 1
+            lane.active += 1
+            waiter.set_result(None)
+
+    @staticmethod
+    def _next_waiter(lane: _Lane) -> Optional[asyncio.Future]:
+        """返回下一个要放行的等待者，顺带清理已取消的等待者"""
+        for queues in lane.queues:
+            while queues:
+                user_id, waiters = next(iter(queues.items()))
+                while waiters and waiters[0].done():
+                    waiters.popleft()
+                if waiters:
+                    return waiters[0]
+                del queues[user_id]
+        return None
+
+    @staticmethod
+    def _pop_waiter(lane: _Lane):
+        """取出队首用户的第一个等待者，该用户还有请求时移到队尾"""
+        for priority, queues in enumerate(lane.queues):
+            if queues:
+                user_id, waiters = next(iter(queues.items()))
+                waiters.popleft()
+                lane.queued[priority] -= 1
+                if waiters:
+                    queues.move_to_end(user_id)
+                else:
+                    del queues[user_id]
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        result = {}
+        for (provider, model), lane in self._lanes.items():
+            waits = sorted(lane.waits)
+            result[f"{provider}/{model}"] = {
+                **lane.stats,
+                "active": lane.active,
+                "queued": sum(lane.queued),
+                "tokens": round(lane.tokens, 2),
+                "avg_hold_seconds": lane.hold_seconds or 0.0,
+                "queue_wait_p50_ms": waits[len(waits) // 2] * 1000 if waits else 0.0,
+                "queue_wait_p95_ms": waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000 if waits else 0.0,
+            }
+        return result
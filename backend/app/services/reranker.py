@@ -0,0 +1,100 @@
+import os
+import threading
+from typing import Any, Dict, List, Optional
+import numpy as np
+from .inference_executor import InferenceExecutor
+
+RERANK_METHODS = ("mmr", "cross_encoder")
+
+
+def merge_hits(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """合并多路检索结果：按距离排序，相同内容的文本块只保留最相近的一个"""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for hit in hits:
+        current = merged.get(hit["content"])
+        if current is None or hit["distance"] < current["distance"]:
+            merged[hit["content"]] = hit
+    return sorted(merged.values(), key=lambda hit: hit["distance"])
+
+
+def fuse_hits(result_lists: List[List[Dict[str, Any]]], rrf_k: int = 60) -> List[Dict[str, Any]]:
+    """倒数排名融合（RRF）：按（文档，文本块哈希）合并多路结果，分数为各路 1/(rrf_k+名次) 之和"""
+    fused: Dict[tuple, Dict[str, Any]] = {}
+    for hits in result_lists:
+        for rank, hit in enumerate(hits):
+            key = (hit.get("document_id"), hit.get("chunk_hash") or hit["content"])
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = {**hit, "rrf_score": 0.0}
+            else:
+                # 保留另一路结果中才有的字段，如向量距离和embedding
+                for field, value in hit.items():
+                    if entry.get(field) is None:
+                        entry[field] = value
+            entry["rrf_score"] += 1 / (rrf_k + rank + 1)
+    return sorted(fused.values(), key=lambda hit: -hit["rrf_score"])
+
+
+class Reranker:
+    """检索结果重排：MMR（兼顾相关性与多样性）或交叉编码器打分"""
+
+    def __init__(self, executor: InferenceExecutor):
+        self.executor = executor
+        self.model_name = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+        # 越接近1越偏向相关性，越接近0越偏向多样性
+        self.mmr_lambda = float(os.getenv("RERANK_MMR_LAMBDA", "0.7"))
+        # 重排时先多取若干倍的候选
+        self.oversample = max(1, int(os.getenv("RERANK_OVERSAMPLE", "4")))
+        self._cross_encoder = None
+        self._lock = threading.Lock()
+        self._stats = {"mmr": 0, "cross_encoder": 0}
+
+    async def rerank(
+        self,
+        query: str,
+        query_embedding: np.ndarray,
+        hits: List[Dict[str, Any]],
+        k: int,
+        method: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """对候选结果重排并返回前k个"""
+        if method is None or len(hits) <= 1:
+            return hits[:k]
+        if method == "mmr":
+            self._stats["mmr"] += 1
+            return self._mmr(query_embedding, hits, k)
+        if method == "cross_encoder":
+            self._stats["cross_encoder"] += 1
+            scores = await self.executor.run("encode", self._cross_encode, query, [hit["content"] for hit in hits])
+            order = np.argsort(-np.asarray(scores))[:k]
+            return [dict(hits[i], score=float(scores[i])) for i in order]
+        raise ValueError(f"不支持的重排方式: {method}")
+
+    def _mmr(self, query_embedding: np.ndarray, hits: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+        """最大边际相关性：每次选出与查询相近且与已选结果差异最大的文本块"""
+        vectors = np.asarray([hit["embedding"] for hit in hits], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        relevance = vectors @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        similarity = vectors @ vectors.T
+
+        selected = [int(np.argmax(relevance))]
+        redundancy = similarity[selected[0]].copy()
+        while len(selected) < min(k, len(hits)):
+            scores = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * redundancy
+            scores[selected] = -np.inf
+            best = int(np.argmax(scores))
+            selected.append(best)
+            redundancy = np.maximum(redundancy, similarity[best])
+        return [hits[i] for i in selected]
+
+    def _cross_encode(self, query: str, texts: List[str]) -> np.ndarray:
+        """在编码线程池中运行交叉编码器，模型首次使用时加载"""
+        with self._lock:
+            if self._cross_encoder is None:
+                from sentence_transformers import CrossEncoder
+                self._cross_encoder = CrossEncoder(self.model_name)
+        return self._cross_encoder.predict([(query, text) for text in texts])
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "cross_encoder_loaded": self._cross_encoder is not None}
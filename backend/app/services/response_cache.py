@@ -0,0 +1,223 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+
+# （检索范围内的文档ID，提供商，模型，检索参数，规范化问题）
+CacheKey = Tuple[Tuple[str, ...], str, str, str, str]
+Scope = Tuple[Tuple[str, ...], str, str, str]
+
+
+class ResponseCache:
+    """RAG回答缓存：按（文档，提供商，模型，检索参数，规范化问题）缓存完整回答，可选按问题向量语义匹配
+
+    只缓存检索了文档的回答。回答保存在各进程内存中，文档失效记录在共享的SQLite中：
+    任一进程删除、更新或入库文档后递增代数，其他进程在下次查找或写入前按代数清除相关回答。
+    """
+
+    _TRAILING_PUNCTUATION = "?？。.!！~～ "
+
+    def __init__(self):
+        self.ttl = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+        self.max_entries = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+        # 余弦相似度阈值，0表示只做精确匹配
+        self.similarity_threshold = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))
+        self.path = os.getenv("RESPONSE_CACHE_PATH", "cache/responses.sqlite3")
+        self._entries: "OrderedDict[CacheKey, Dict[str, Any]]" = OrderedDict()
+        self._scopes: Dict[Scope, Set[CacheKey]] = {}
+        # 本进程已同步到的失效代数
+        self._generation = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.enabled and self.similarity_threshold > 0
+
+    def _get_db(self) -> sqlite3.Connection:
+        """打开共享的失效记录库；用 --preload 启动时fork后的工作进程各自重新打开"""
+        if self._db is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS invalidations ("
+                "document_id TEXT PRIMARY KEY, generation INTEGER NOT NULL, invalidated_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS invalidations_generation ON invalidations (generation)")
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            with db:
+                db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+            self._db, self._pid = db, os.getpid()
+            self._generation = db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+        return self._db
+
+    def _sync(self):
+        """其他进程使文档失效后，清除本进程中相关的缓存回答"""
+        db = self._get_db()
+        generation = db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+        if generation == self._generation:
+            return
+        for (document_id,) in db.execute(
+            "SELECT document_id FROM invalidations WHERE generation > ?", (self._generation,)
+        ):
+            self._remove_document(document_id)
+        self._generation = generation
+
+    def current_generation(self) -> int:
+        """开始生成回答前调用，返回值传给put，用于丢弃生成期间文档已失效的回答"""
+        if not self.enabled:
+            return 0
+        with self._lock:
+            self._sync()
+            return self._generation
+
+    @classmethod
+    def normalize(cls, query: str) -> str:
+        """规范化问题：统一全半角、大小写与空白，去掉结尾标点"""
+        query = unicodedata.normalize("NFKC", query).lower()
+        query = re.sub(r"\s+", " ", query)
+        return query.strip(cls._TRAILING_PUNCTUATION)
+
+    def get(
+        self,
+        document_ids: Iterable[str],
+        provider: str,
+        model: str,
+        query: str,
+        embedding: Optional[np.ndarray] = None,
+        variant: str = ""
+    ) -> Optional[List[str]]:
+        """查找缓存的回答，返回流式输出的文本片段列表"""
+        key = self._key(document_ids, provider, model, variant, query)
+        # 不检索文档的回答与文档无关，也不区分用户，不缓存
+        if not self.enabled or not key[0]:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._sync()
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] <= now:
+                self._remove(key)
+                entry = None
+            if entry is None and embedding is not None and self.semantic_enabled:
+                key = self._nearest(key[:4], embedding, now)
+                entry = self._entries.get(key) if key else None
+                if entry is not None:
+                    self._stats["semantic_hits"] += 1
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry["chunks"]
+
+    def _nearest(self, scope: Scope, embedding: np.ndarray, now: float) -> Optional[CacheKey]:
+        """在相同检索范围与模型内查找最相似的已缓存问题"""
+        query_vector = self._unit(embedding)
+        best_key, best_score = None, self.similarity_threshold
+        for key in list(self._scopes.get(scope, ())):
+            entry = self._entries[key]
+            if entry["expires_at"] <= now:
+                self._remove(key)
+                continue
+            if entry["embedding"] is None:
+                continue
+            score = float(entry["embedding"] @ query_vector)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def put(
+        self,
+        document_ids: Iterable[str],
+        provider: str,
+        model: str,
+        query: str,
+        chunks: List[str],
+        embedding: Optional[np.ndarray] = None,
+        variant: str = "",
+        generation: Optional[int] = None
+    ):
+        """缓存完整回答；generation为开始生成回答时current_generation()的返回值，其后检索范围内的文档失效过则不缓存"""
+        key = self._key(document_ids, provider, model, variant, query)
+        if not self.enabled or not chunks or not key[0]:
+            return
+        with self._lock:
+            self._sync()
+            if generation is not None and self._db.execute(
+                f"SELECT 1 FROM invalidations WHERE generation > ? AND document_id IN ({','.join('?' * len(key[0]))})",
+                (generation, *key[0])
+            ).fetchone():
+                return
+            self._entries[key] = {
+                "chunks": list(chunks),
+                "embedding": self._unit(embedding) if embedding is not None else None,
+                "expires_at": time.monotonic() + self.ttl,
+            }
+            self._entries.move_to_end(key)
+            self._scopes.setdefault(key[:4], set()).add(key)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _key(self, document_ids: Iterable[str], provider: str, model: str, variant: str, query: str) -> CacheKey:
+        return (tuple(sorted(set(document_ids))), provider, model, variant, self.normalize(query))
+
+    def invalidate_document(self, document_id: str):
+        """删除检索范围包含指定文档的所有缓存回答，并通知其他进程"""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            db = self._get_db()
+            with db:
+                db.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+                generation = db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+                db.execute(
+                    "INSERT OR REPLACE INTO invalidations (document_id, generation, invalidated_at) VALUES (?, ?, ?)",
+                    (document_id, generation, now)
+                )
+                # 超过TTL的失效记录不再需要：在那之前开始生成的回答即使写入也已过期
+                db.execute("DELETE FROM invalidations WHERE invalidated_at < ?", (now - self.ttl,))
+            self._sync()
+
+    def _remove_document(self, document_id: str):
+        for key in [key for key in self._entries if document_id in key[0]]:
+            self._remove(key)
+            self._stats["invalidations"] += 1
+
+    def _remove(self, key: CacheKey):
+        self._entries.pop(key, None)
+        scope = self._scopes.get(key[:4])
+        if scope is not None:
+            scope.discard(key)
+            if not scope:
+                del self._scopes[key[:4]]
+
+    @staticmethod
+    def _unit(embedding: np.ndarray) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "entries": len(self._entries),
+            "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+        }
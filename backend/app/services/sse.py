@@ -0,0 +1,176 @@
+import os
+import json
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 预先编码的SSE帧模板，只有内容部分需要序列化
+_CONTENT_PREFIX = b'data: {"content":'
+_CONTENT_SUFFIX = b"}\n\n"
+DONE_FRAME = b"data: [DONE]\n\n"
+
+
+def dumps(value: Any) -> bytes:
+    """序列化为JSON字节串，安装了orjson时使用orjson"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes) -> Any:
+    """解析JSON字节串；格式错误时抛出ValueError"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def content_frame(text: str) -> bytes:
+    """生成内容帧：data: {"content": ...}"""
+    return _CONTENT_PREFIX + dumps(text) + _CONTENT_SUFFIX
+
+
+def error_frame(message: str) -> bytes:
+    """生成错误帧：data: {"error": ...}"""
+    return b"data: " + dumps({"error": message}) + b"\n\n"
+
+
+async def iter_lines(content) -> AsyncIterator[bytes]:
+    """按行读取响应体（bytes），一次读取网络上已到达的全部数据再切分，减少逐行await的开销"""
+    buffer = b""
+    async for data in content.iter_any():
+        buffer += data
+        if b"\n" not in data:
+            continue
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+async def iter_sse_data(content) -> AsyncIterator[bytes]:
+    """逐个返回SSE响应中data行的内容，遇到[DONE]结束"""
+    async for line in iter_lines(content):
+        if not line.startswith(b"data:"):
+            continue
+        payload = line[5:].strip()
+        if payload == b"[DONE]":
+            return
+        if payload:
+            yield payload
+
+
+class SSEEncoder:
+    """把模型输出的文本片段编码为SSE帧，按时间或字节数合并相邻片段以减少帧数"""
+
+    def __init__(self):
+        # 合并的最长等待时间，0表示每个片段单独成帧
+        self.coalesce_ms = float(os.getenv("SSE_COALESCE_MS", "20"))
+        # 待发送内容达到这么多字节时立即成帧
+        self.coalesce_bytes = int(os.getenv("SSE_COALESCE_BYTES", "512"))
+        self._stats = {"streams": 0, "deltas": 0, "frames": 0, "bytes": 0}
+
+    async def stream(
+        self,
+        generator: AsyncIterator[str],
+        coalesce_ms: Optional[float] = None,
+        coalesce_bytes: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """生成SSE帧：首个片段立即发送，之后的片段在合并窗口内拼成一帧，最后发送结束标记"""
+        coalesce_ms = self.coalesce_ms if coalesce_ms is None else coalesce_ms
+        coalesce_bytes = self.coalesce_bytes if coalesce_bytes is None else coalesce_bytes
+        self._stats["streams"] += 1
+        try:
+            if coalesce_ms <= 0:
+                async for chunk in generator:
+                    if chunk:
+                        self._stats["deltas"] += 1
+                        yield self._frame(chunk if isinstance(chunk, str) else str(chunk))
+            else:
+                async for frame in self._coalesce(generator, coalesce_ms / 1000, coalesce_bytes):
+                    yield frame
+        except Exception as e:
+            yield self._count(error_frame(str(e)))
+        yield self._count(DONE_FRAME)
+
+    async def _coalesce(self, generator: AsyncIterator[str], window: float, max_bytes: int) -> AsyncIterator[bytes]:
+        """由一个后台任务读取上游片段放入缓冲区，这里按窗口到期或字节数达到阈值把缓冲区拼成一帧"""
+        pending = []
+        state = {"bytes": 0, "done": False, "error": None}
+        wake = asyncio.Event()
+
+        async def pump():
+            try:
+                async for chunk in generator:
+                    if not chunk:
+                        continue
+                    self._stats["deltas"] += 1
+                    # 缓冲区由空变为非空、或积累到阈值时才唤醒，避免逐个片段切换协程
+                    notify = not pending
+                    pending.append(chunk if isinstance(chunk, str) else str(chunk))
+                    # 按字符数估算字节数，避免对每个片段做编码
+                    state["bytes"] += len(pending[-1])
+                    if notify or state["bytes"] >= max_bytes:
+                        wake.set()
+            except Exception as e:
+                state["error"] = e
+            finally:
+                state["done"] = True
+                wake.set()
+
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(pump())
+        first = True
+        try:
+            while True:
+                await wake.wait()
+                wake.clear()
+                # 首帧不等待，保证首字延迟；之后等到窗口到期或内容达到阈值
+                if not first and not state["done"] and state["bytes"] < max_bytes:
+                    timer = loop.call_later(window, wake.set)
+                    await wake.wait()
+                    timer.cancel()
+                    wake.clear()
+                if pending:
+                    first = False
+                    text = "".join(pending)
+                    pending.clear()
+                    state["bytes"] = 0
+                    yield self._frame(text)
+                if state["done"] and not pending:
+                    break
+            if state["error"] is not None:
+                raise state["error"]
+        finally:
+            # 客户端断开或提前关闭时取消读取任务，并等待它结束，上游生成器随之关闭
+            if not task.done():
+                task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def _frame(self, text: str) -> bytes:
+        return self._count(content_frame(text))
+
+    def _count(self, frame: bytes) -> bytes:
+        self._stats["frames"] += 1
+        self._stats["bytes"] += len(frame)
+        return frame
+
+    def stats(self) -> Dict[str, Any]:
+        frames = self._stats["frames"]
+        return {
+            **self._stats,
+            "json": "orjson" if orjson is not None else "json",
+            "coalesce_ms": self.coalesce_ms,
+            "coalesce_bytes": self.coalesce_bytes,
+            "deltas_per_frame": self._stats["deltas"] / frames if frames else 0.0,
+        }
+
+
+sse_encoder = SSEEncoder()
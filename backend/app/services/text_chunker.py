@@ -0,0 +1,173 @@
+import os
+import re
+import zlib
+from typing import Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from .context_builder import ContextBuilder
+
+# 句末标点（含中文）及其后的引号、括号和行内空白
+_BOUNDARY_PATTERN = re.compile(
+    # 先用字符类快速跳过不可能是边界的位置
+    r"(?=[\n\r。！？!?；;….])"
+    r"(?:(?P<paragraph>\n[ \t\r]*\n\s*)"
+    r"|(?P<line>\r?\n)"
+    r"|(?P<sentence>[。！？!?；;…]+[”’\"'）)」』]*[ \t]*|\.+[”’\"'）)]*(?=\s)[ \t]*))"
+)
+# 段落模式下视为章节开始的行
+_HEADING_PATTERN = re.compile(
+    r"#{1,6}\s|第[一二三四五六七八九十百千万0-9]+[章节篇部]|[一二三四五六七八九十]+、"
+)
+
+SENTENCE, PARAGRAPH, HEADING = 0, 1, 2
+STRATEGIES = ("fixed", "sentence", "paragraph")
+
+
+class TextChunker:
+    """按token数分块：一次扫描找出全部句子/段落边界，再按预先统计的token位置装箱
+
+    fixed: 只按token数切分；sentence: 在句子边界（含中文标点与换行）处切分；
+    paragraph: 优先在段落边界切分，章节标题处另起一块。
+
+    块的结束位置优先取超过半个块大小后的第一个"锚点"边界（段落边界，或内容哈希满足条件的句子边界），
+    切分位置只取决于附近的内容，文档局部修改后其后的分块很快与旧版本重新对齐，便于增量更新。
+    """
+
+    def __init__(
+        self,
+        tokenizer: ContextBuilder,
+        strategy: Optional[str] = None,
+        chunk_tokens: Optional[int] = None,
+        overlap_tokens: Optional[int] = None
+    ):
+        self.tokenizer = tokenizer
+        self.strategy = (strategy or os.getenv("CHUNK_STRATEGY", "sentence")).lower()
+        if self.strategy not in STRATEGIES:
+            raise ValueError(f"不支持的分块策略: {self.strategy}")
+        self.chunk_tokens = chunk_tokens or int(os.getenv("CHUNK_TOKENS", "256"))
+        if overlap_tokens is None:
+            overlap_tokens = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+        self.overlap_tokens = min(overlap_tokens, self.chunk_tokens // 2)
+        # 流式处理时缓冲区末尾留出的余量，避免在尚未读完的句子上做决定
+        self.margin_tokens = 16
+        # 平均每多少个句子边界出现一个锚点
+        self.anchor_interval = 4
+
+    def split(self, text: str) -> List[str]:
+        """切分完整文本"""
+        return list(self.split_stream([text]))
+
+    def split_stream(self, blocks: Iterable[str]) -> Iterator[str]:
+        """增量地切分文本流，缓冲区只保留未切分的尾部"""
+        buffer = ""
+        for block in blocks:
+            buffer += block
+            chunks, consumed = self._split_buffer(buffer, final=False)
+            yield from chunks
+            buffer = buffer[consumed:]
+        chunks, _ = self._split_buffer(buffer, final=True)
+        yield from chunks
+
+    def _boundaries(self, text: str) -> Tuple[List[int], List[int]]:
+        """一次扫描返回所有边界位置及其级别"""
+        if self.strategy == "fixed":
+            return [], []
+        matches = list(_BOUNDARY_PATTERN.finditer(text))
+        if not matches:
+            return [], []
+        starts = np.fromiter((match.start() for match in matches), dtype=np.int64, count=len(matches))
+        ends = np.fromiter((match.end() for match in matches), dtype=np.int64, count=len(matches))
+        if self.strategy == "paragraph":
+            levels = np.fromiter((
+                HEADING if match.lastgroup != "sentence" and _HEADING_PATTERN.match(text, match.end())
+                else PARAGRAPH if match.lastgroup == "paragraph" else SENTENCE
+                for match in matches
+            ), dtype=np.int64, count=len(matches))
+        else:
+            levels = np.zeros(len(matches), dtype=np.int64)
+
+        # 句末标点后紧跟换行时合并为一个边界，取其中最高的级别
+        keep = np.append(ends[:-1] != starts[1:], True)
+        groups = np.cumsum(np.append(True, keep[:-1])) - 1
+        merged_levels = np.zeros(int(groups[-1]) + 1, dtype=np.int64)
+        np.maximum.at(merged_levels, groups, levels)
+        return ends[keep].tolist(), merged_levels.tolist()
+
+    def _is_anchor(self, text: str, positions: List[int], i: int) -> bool:
+        """由边界前一句的内容哈希决定该边界是否为锚点"""
+        sentence = text[positions[i - 1] if i else 0:positions[i]].strip()
+        return zlib.crc32(sentence.encode("utf-8")) % self.anchor_interval == 0
+
+    def _split_buffer(self, text: str, final: bool) -> Tuple[List[str], int]:
+        """切分缓冲区，返回切出的块以及已消费的字符数"""
+        offsets = self.tokenizer.token_offsets(text)
+        total = len(offsets)
+        positions, levels = self._boundaries(text)
+        # 边界对应的token位置
+        tokens = np.searchsorted(offsets, positions).tolist()
+
+        def char_at(token: int) -> int:
+            return int(offsets[token]) if token < total else len(text)
+
+        chunks: List[str] = []
+        start, start_token, index = 0, 0, 0
+        while start < len(text):
+            remaining = total - start_token
+            if not final and remaining <= self.chunk_tokens + self.margin_tokens:
+                break
+            limit = start_token + self.chunk_tokens
+            while index < len(positions) and positions[index] <= start:
+                index += 1
+
+            # 在token窗口内找合适的边界
+            best = anchor = heading = None
+            i = index
+            while i < len(positions) and tokens[i] <= limit:
+                size = tokens[i] - start_token
+                if levels[i] == HEADING and size >= self.chunk_tokens // 4:
+                    heading = i
+                    break
+                if size > self.overlap_tokens:
+                    best = i
+                    if size >= self.chunk_tokens // 2 and (
+                        levels[i] >= PARAGRAPH or self._is_anchor(text, positions, i)
+                    ):
+                        anchor = i
+                        break
+                i += 1
+
+            at_boundary = False
+            if heading is not None:
+                end, end_token = positions[heading], tokens[heading]
+            elif final and remaining <= self.chunk_tokens:
+                end, end_token = len(text), total
+            elif anchor is not None or best is not None:
+                chosen = anchor if anchor is not None else best
+                end, end_token = positions[chosen], tokens[chosen]
+                at_boundary = True
+            else:
+                # 窗口内没有可用边界（或fixed策略），按token数硬切
+                end_token = min(limit, total)
+                end = char_at(end_token)
+
+            chunk = text[start:end].strip()
+            if chunk:
+                chunks.append(chunk)
+            if end >= len(text):
+                start = end
+                break
+
+            # 下一块的起点：章节标题处不重叠；在边界处结束时从重叠窗口内最早的边界开始
+            next_start, next_token = end, end_token
+            if heading is None:
+                if at_boundary:
+                    for j in range(index, chosen):
+                        if end_token - tokens[j] <= self.overlap_tokens:
+                            next_start, next_token = positions[j], tokens[j]
+                            break
+                else:
+                    next_token = max(end_token - self.overlap_tokens, start_token + 1)
+                    next_start = char_at(next_token)
+            if next_start <= start:
+                next_start, next_token = end, end_token
+            start, start_token = next_start, next_token
+        return chunks, start
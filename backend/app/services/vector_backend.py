@@ -0,0 +1,70 @@
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Set
+import numpy as np
+
+
+class VectorBackend(ABC):
+    """向量索引后端接口：负责存储文本块向量并按文档过滤检索"""
+
+    # 单次检索可过滤的文档数量上限，超出时由调用方分组并发检索；None表示不限
+    max_filter_documents: Optional[int] = None
+    # 是否保存文本块哈希，支持按块增量更新文档
+    supports_chunk_hashes = False
+
+    @abstractmethod
+    def insert(
+        self,
+        document_id: str,
+        texts: List[str],
+        embeddings: np.ndarray,
+        token_counts: Optional[List[int]] = None,
+        chunk_hashes: Optional[List[str]] = None
+    ):
+        """插入文本块及其向量，token_counts与chunk_hashes为入库时计算的各文本块token数和内容哈希"""
+
+    @abstractmethod
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        k: int = 5,
+        document_ids: Optional[List[str]] = None,
+        consistency_level: Optional[str] = None,
+        with_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        """返回与查询向量最相近的k个文本块
+
+        每个结果包含content、document_id、distance（越小越相近）、token_count和chunk_hash（未知时为None），
+        with_embeddings为True时还包含embedding。document_ids为None时不按文档过滤。
+        """
+
+    @abstractmethod
+    def delete_by_document_id(self, document_id: str):
+        """删除指定文档的所有文本块"""
+
+    def chunk_hashes(self, document_id: str) -> Set[str]:
+        """返回文档现有文本块的哈希集合"""
+        raise NotImplementedError
+
+    def delete_chunks(self, document_id: str, chunk_hashes: List[str]):
+        """删除文档中指定哈希的文本块"""
+        raise NotImplementedError
+
+    def flush(self):
+        """将待写入的数据持久化"""
+
+    def stats(self) -> Dict[str, Any]:
+        """返回后端运行统计"""
+        return {}
+
+
+def create_vector_backend(dim: int) -> VectorBackend:
+    """根据 VECTOR_BACKEND 环境变量创建向量索引后端"""
+    backend = os.getenv("VECTOR_BACKEND", "milvus").lower()
+    if backend == "milvus":
+        from .milvus_backend import MilvusBackend
+        return MilvusBackend(dim)
+    if backend == "local":
+        from .local_vector_backend import LocalVectorBackend
+        return LocalVectorBackend(dim)
+    raise ValueError(f"不支持的向量存储后端: {backend}")
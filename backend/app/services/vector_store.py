@@ -1,114 +1,60 @@
 import os
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 import numpy as np
-from pymilvus import (
-    connections,
-    utility,
-    Collection,
-    CollectionSchema,
-    FieldSchema,
-    DataType
-)
-from sentence_transformers import SentenceTransformer
+from .embedding_backend import DEFAULT_EMBEDDING_MODEL, get_embedding_backend
+from .embedding_cache import EmbeddingCache
+from .vector_backend import create_vector_backend
 
 class VectorStore:
     def __init__(self):
-        self.host = os.getenv("MILVUS_HOST", "localhost")
-        self.port = os.getenv("MILVUS_PORT", "19530")
-        self.collection_name = "document_chunks"
-        self.dim = 768  # sentence-transformers维度
-        self.encoder = SentenceTransformer('all-MiniLM-L6-v2')
-        self._connect()
-        self._init_collection()
+        self.model_name = os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+        self.encoder = get_embedding_backend(self.model_name)
+        # 维度取自加载的模型（all-MiniLM-L6-v2为384维）
+        self.dim = self.encoder.dim
+        self.cache = EmbeddingCache(self.encoder.cache_name)
+        self.backend = create_vector_backend(self.dim)
 
-    def _connect(self):
-        """连接到Milvus服务器"""
-        connections.connect(
-            alias="default",
-            host=self.host,
-            port=self.port
-        )
-
-    def _init_collection(self):
-        """初始化集合，如果不存在则创建"""
-        if utility.exists_collection(self.collection_name):
-            self.collection = Collection(self.collection_name)
-            return
+    def add_embeddings(
+        self,
+        texts: List[str],
+        embeddings: np.ndarray,
+        document_id: str,
+        token_counts: Optional[List[int]] = None,
+        chunk_hashes: Optional[List[str]] = None
+    ):
+        """插入已生成向量的文本块，向量以连续的float32数组交给存储后端"""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(len(texts), self.dim)
+        self.backend.insert(document_id, texts, embeddings, token_counts, chunk_hashes)
 
-        fields = [
-            FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
-            FieldSchema(name="document_id", dtype=DataType.VARCHAR, max_length=100),
-            FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=65535),
-            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=self.dim)
-        ]
-        schema = CollectionSchema(fields=fields, description="文档块存储")
-        self.collection = Collection(self.collection_name, schema)
-        
-        # 创建索引
-        index_params = {
-            "metric_type": "L2",
-            "index_type": "IVF_FLAT",
-            "params": {"nlist": 1024}
-        }
-        self.collection.create_index(
-            field_name="embedding",
-            index_params=index_params
-        )
+    def flush(self):
+        """立即刷入所有待刷盘的写入"""
+        self.backend.flush()
 
-    def add_texts(self, texts: List[str], document_id: str):
-        """添加文本到向量存储"""
-        if not texts:
-            return
-        
-        # 生成嵌入
-        embeddings = self.encoder.encode(texts)
-        
-        # 准备数据
-        entities = [
-            {
-                "document_id": [document_id] * len(texts),
-                "content": texts,
-                "embedding": embeddings.tolist()
-            }
-        ]
-        
-        # 插入数据
-        self.collection.insert(entities)
-        self.collection.flush()
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """批量生成文本向量，优先从向量缓存读取"""
+        vectors = self.cache.get_many(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # 只编码未命中且去重后的文本
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            embeddings = self.encoder.encode(unique_texts)
+            self.cache.put_many(unique_texts, embeddings)
+            by_text = dict(zip(unique_texts, embeddings))
+            for i in missing:
+                vectors[i] = by_text[texts[i]]
+        return np.asarray(vectors, dtype=np.float32)
 
-    def similarity_search(
+    def search_hits(
         self,
-        query: str,
+        query_embedding: np.ndarray,
         k: int = 5,
-        document_id: Optional[str] = None
-    ) -> List[str]:
-        """执行相似性搜索"""
-        # 生成查询向量
-        query_embedding = self.encoder.encode([query])[0]
-        
-        # 准备搜索参数
-        search_params = {
-            "metric_type": "L2",
-            "params": {"nprobe": 10}
-        }
-        
-        # 执行搜索
-        self.collection.load()
-        expr = f"document_id == '{document_id}'" if document_id else None
-        results = self.collection.search(
-            data=[query_embedding.tolist()],
-            anns_field="embedding",
-            param=search_params,
-            limit=k,
-            expr=expr,
-            output_fields=["content"]
-        )
-        
-        # 返回结果
-        return [hit.entity.get('content') for hit in results[0]]
+        document_ids: Optional[List[str]] = None,
+        consistency_level: Optional[str] = None,
+        with_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        """在多个文档（None表示全部文档）中检索，返回带距离与所属文档的结果"""
+        return self.backend.search(query_embedding, k, document_ids, consistency_level, with_embeddings)
 
     def delete_by_document_id(self, document_id: str):
         """删除指定文档ID的所有记录"""
-        expr = f"document_id == '{document_id}'"
-        self.collection.delete(expr)
-        self.collection.flush()
+        self.backend.delete_by_document_id(document_id)
@@ -0,0 +1,76 @@
+"""查询编码基准：对比逐条编码与微批合并编码的吞吐和延迟
+
+用法（在 backend 目录下运行）：
+    python -m benchmarks.bench_batch_encoder --requests 2000 --concurrency 200
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import List
+
+from sentence_transformers import SentenceTransformer
+
+from app.services.inference_executor import InferenceExecutor
+from app.services.batch_encoder import BatchEncoder
+
+
+def make_queries(count: int) -> List[str]:
+    words = ["文档", "总结", "配置", "安装", "接口", "性能", "错误", "模型", "向量", "检索",
+             "manual", "install", "error", "config", "release", "latency", "index", "search"]
+    rng = random.Random(42)
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(4, 16))) for _ in range(count)]
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def drive(encode, queries: List[str], concurrency: int):
+    latencies = []
+    queue = list(queries)
+
+    async def worker():
+        while queue:
+            query = queue.pop()
+            start = time.perf_counter()
+            await encode(query)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return len(queries) / elapsed, latencies
+
+
+async def main(args):
+    model = SentenceTransformer(args.model)
+    model.encode(["warmup"])
+    queries = make_queries(args.requests)
+    executor = InferenceExecutor()
+
+    async def unbatched(query):
+        return (await executor.run("encode", model.encode, [query]))[0]
+
+    batch_encoder = BatchEncoder(model.encode, executor, args.max_batch_size, args.window_ms)
+
+    for name, encode in (("unbatched", unbatched), ("batched", batch_encoder.encode)):
+        qps, latencies = await drive(encode, queries, args.concurrency)
+        print(
+            f"{name:>10}: {qps:8.1f} q/s  "
+            f"p50={percentile(latencies, 0.50) * 1000:7.1f}ms  "
+            f"p99={percentile(latencies, 0.99) * 1000:7.1f}ms"
+        )
+    print(f"batch stats: {batch_encoder.stats()}")
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--window-ms", type=float, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,160 @@
+"""分块基准：对比旧的按字符分块与各分块策略的速度、块大小分布和检索质量
+
+检索质量用两项指标衡量：
+  - 事实完整率：语料中插入的事实句有多少完整地落在某个块里（被切断的事实无法被检索到原文）
+  - recall@k（指定 --model 时）：用事实对应的问题检索，前k个块中包含完整事实句的比例
+
+用法（在 backend 目录下运行）：
+    python -m benchmarks.bench_chunker --size-mb 20
+    python -m benchmarks.bench_chunker --file docs/manual.txt --model all-MiniLM-L6-v2 --k 3
+"""
+import argparse
+import random
+import time
+from typing import List, Optional, Tuple
+
+from app.services.context_builder import ContextBuilder
+from app.services.text_chunker import STRATEGIES, TextChunker
+
+FILLER = [
+    "本系统支持多种文档格式的上传与检索。",
+    "配置文件修改后需要重新启动服务才能生效！",
+    "如果遇到网络超时，请检查代理设置；",
+    "The indexing service runs in the background and retries failed jobs. ",
+    "Version 3.14 introduced a faster parser for large PDF files. ",
+    "用户可以在设置页面中调整默认模型。",
+    "\n",
+]
+NAMES = ["王磊", "李娜", "张伟", "刘洋", "陈静", "Alice", "Bob", "Carol"]
+
+
+def make_corpus(size_mb: float, seed: int = 0) -> Tuple[str, List[Tuple[str, str]]]:
+    """生成中英混合语料，随机插入可检索的事实句，返回语料与（问题，事实句）列表"""
+    rng = random.Random(seed)
+    parts, facts, size, section = [], [], 0, 0
+    target = int(size_mb * 1024 * 1024)
+    while size < target:
+        if rng.random() < 0.01:
+            section += 1
+            part = f"\n\n第{section}章 模块说明\n\n"
+        elif rng.random() < 0.02:
+            fact_id = len(facts)
+            name = rng.choice(NAMES)
+            if rng.random() < 0.5:
+                part = f"项目{fact_id}的负责人是{name}，联系方式为内线{1000 + fact_id}。"
+                facts.append((f"项目{fact_id}的负责人是谁？", part))
+            else:
+                part = f"The on-call engineer for service {fact_id} is {name}, reachable at extension {1000 + fact_id}. "
+                facts.append((f"Who is the on-call engineer for service {fact_id}?", part.strip()))
+        else:
+            part = rng.choice(FILLER)
+        if rng.random() < 0.05:
+            part += "\n\n"
+        parts.append(part)
+        size += len(part.encode("utf-8"))
+    return "".join(parts), facts
+
+
+def legacy_split(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
+    """旧实现：固定1000字符，只在英文句末标点处回退"""
+    chunks, start = [], 0
+    while start < len(text):
+        end = start + chunk_size
+        if end < len(text):
+            last_period = max(text.rfind('.', start, end), text.rfind('?', start, end), text.rfind('!', start, end))
+            if last_period != -1 and last_period + 1 - start > chunk_overlap:
+                end = last_period + 1
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - chunk_overlap, start + 1)
+    return chunks
+
+
+def blocks(text: str, size: int = 64 * 1024):
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+def percentile(values: List[int], p: float) -> int:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def is_sentence_end(text: str, end: int) -> bool:
+    """块在原文中的结束位置是否是句子边界"""
+    if end >= len(text) or text[end] == "\n" or text[end - 1] in "。！？；…”」』）":
+        return True
+    return text[end - 1] in ".?!;\"')" and text[end].isspace()
+
+
+def evaluate(name: str, chunks: List[str], elapsed: float, text: str, facts, tokenizer, model, k: int):
+    sizes = tokenizer.count_many(chunks)
+    # 在原文中依次定位每个块，统计在句子中间被切断的比例
+    cut, cursor = 0, 0
+    for chunk in chunks:
+        position = text.find(chunk, cursor)
+        cursor = position + 1
+        cut += not is_sentence_end(text, position + len(chunk))
+    contained = sum(1 for _, fact in facts if any(fact in chunk for chunk in chunks)) if facts else 0
+    line = (
+        f"{name:<10} {len(text.encode('utf-8')) / 1024 / 1024 / elapsed:8.2f} MB/s  chunks={len(chunks):<7} "
+        f"tokens p50={percentile(sizes, 0.5):<5} p99={percentile(sizes, 0.99):<5} max={max(sizes):<5} "
+        f"mid-sentence={cut / len(chunks):6.1%}  facts intact={contained / max(1, len(facts)):6.1%}"
+    )
+    if model is not None and facts:
+        line += f"  recall@{k}={retrieval_recall(chunks, facts, model, k):6.1%}"
+    print(line)
+
+
+def retrieval_recall(chunks: List[str], facts, model, k: int) -> float:
+    import numpy as np
+    embeddings = model.encode(chunks, batch_size=64, normalize_embeddings=True)
+    queries = model.encode([query for query, _ in facts], batch_size=64, normalize_embeddings=True)
+    top = np.argsort(-(queries @ embeddings.T), axis=1)[:, :k]
+    hits = sum(1 for (_, fact), rows in zip(facts, top) if any(fact in chunks[row] for row in rows))
+    return hits / len(facts)
+
+
+def main(args):
+    if args.file:
+        with open(args.file, encoding="utf-8") as file:
+            text = file.read()
+        facts = []
+    else:
+        text, facts = make_corpus(args.size_mb)
+    if args.max_facts:
+        facts = facts[:args.max_facts]
+    model: Optional[object] = None
+    if args.model:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(args.model)
+
+    tokenizer = ContextBuilder()
+    tokenizer.count("warmup")
+    print(f"语料 {len(text.encode('utf-8')) / 1024 / 1024:.1f} MB，事实句 {len(facts)} 条，分词器 {tokenizer.stats()['encoding']}")
+
+    started = time.perf_counter()
+    chunks = legacy_split(text)
+    evaluate("legacy", chunks, time.perf_counter() - started, text, facts, tokenizer, model, args.k)
+
+    for strategy in args.strategies:
+        chunker = TextChunker(tokenizer, strategy, args.chunk_tokens, args.overlap_tokens)
+        started = time.perf_counter()
+        chunks = list(chunker.split_stream(blocks(text)))
+        evaluate(strategy, chunks, time.perf_counter() - started, text, facts, tokenizer, model, args.k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", help="使用真实的UTF-8文本文件代替生成的语料（不计算事实指标）")
+    parser.add_argument("--size-mb", type=float, default=10)
+    parser.add_argument("--strategies", nargs="+", default=list(STRATEGIES), choices=STRATEGIES)
+    parser.add_argument("--chunk-tokens", type=int, default=256)
+    parser.add_argument("--overlap-tokens", type=int, default=32)
+    parser.add_argument("--model", help="指定嵌入模型时额外计算 recall@k")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--max-facts", type=int, default=2000)
+    main(parser.parse_args())
@@ -0,0 +1,82 @@
+"""文本编码后端基准：对比 torch / int8 / onnx / onnx_int8 的编码吞吐与检索质量
+
+对每个后端报告：
+  - chunks/s 与每个推理线程的 chunks/s
+  - 与 torch fp32 向量的平均余弦相似度，以及 top-k 近邻与 torch 结果的重合率
+  - 事实检索 recall@k：用事实对应的问题检索，前k个块中包含完整事实句的比例
+
+用法（在 backend 目录下运行）：
+    python -m benchmarks.bench_embedding_backends --size-mb 1 --threads 4
+    python -m benchmarks.bench_embedding_backends --backends torch onnx_int8 --threads 1 2 4
+"""
+import argparse
+import os
+import time
+from typing import List
+
+import numpy as np
+
+from app.services.context_builder import ContextBuilder
+from app.services.embedding_backend import EMBEDDING_BACKENDS, create_embedding_backend
+from app.services.text_chunker import TextChunker
+from benchmarks.bench_chunker import make_corpus
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def top_k(queries: np.ndarray, chunks: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-(queries @ chunks.T), axis=1)[:, :k]
+
+
+def fact_recall(chunks: List[str], facts, rows: np.ndarray) -> float:
+    return sum(1 for (_, fact), top in zip(facts, rows) if any(fact in chunks[row] for row in top)) / len(facts)
+
+
+def main(args):
+    text, facts = make_corpus(args.size_mb)
+    facts = facts[:args.max_facts]
+    chunks = TextChunker(ContextBuilder(), "sentence", args.chunk_tokens, 0).split(text)
+    queries = [query for query, _ in facts]
+    print(f"文本块 {len(chunks)} 个，事实问题 {len(queries)} 条，模型 {args.model}")
+
+    reference = None
+    for threads in args.threads:
+        os.environ["EMBEDDING_NUM_THREADS"] = str(threads)
+        for name in args.backends:
+            started = time.perf_counter()
+            backend = create_embedding_backend(args.model, name)
+            load_seconds = time.perf_counter() - started
+            backend.encode(chunks[:args.batch_size])
+
+            started = time.perf_counter()
+            chunk_vectors = normalize(backend.encode(chunks))
+            elapsed = time.perf_counter() - started
+            query_vectors = normalize(backend.encode(queries))
+            rows = top_k(query_vectors, chunk_vectors, args.k)
+            if reference is None:
+                reference = (chunk_vectors, rows)
+
+            cosine = float(np.mean(np.sum(chunk_vectors * reference[0], axis=1)))
+            overlap = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(rows, reference[1])])
+            rate = len(chunks) / elapsed
+            print(
+                f"{name:<10} threads={threads:<3} load={load_seconds:6.1f}s  {rate:8.1f} chunks/s  "
+                f"{rate / max(threads, 1):7.1f} chunks/s/thread  cos={cosine:.4f}  "
+                f"top{args.k} overlap={overlap:6.1%}  recall@{args.k}={fact_recall(chunks, facts, rows):6.1%}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backends", nargs="+", default=list(EMBEDDING_BACKENDS), choices=EMBEDDING_BACKENDS,
+                        help="第一个后端作为质量对比的基准")
+    parser.add_argument("--threads", nargs="+", type=int, default=[4])
+    parser.add_argument("--size-mb", type=float, default=1)
+    parser.add_argument("--chunk-tokens", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--max-facts", type=int, default=500)
+    main(parser.parse_args())
@@ -0,0 +1,113 @@
+"""对冲请求基准：在本地模拟的提供商上对比 PROVIDER_ROUTING=direct 与 hedged 的首字延迟、错误率和额外请求数
+
+主模型（deepseek）带有慢请求长尾和少量错误，等价模型（groq）稍慢但稳定。hedged模式下，
+主模型超过其p95首字延迟仍无输出时向groq发出对冲请求，首字之前失败时切换到groq。
+
+用法（在 backend 目录下运行）：
+    python -m benchmarks.bench_hedging --requests 500 --concurrency 20
+    python -m benchmarks.bench_hedging --primary ttft_ms=300,tail_rate=0.1,tail_ms=5000,error_rate=0.05
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Dict, List
+
+from benchmarks.mock_providers import parse_spec, start_mock_server
+
+PRIMARY = ("deepseek", "deepseek-chat")
+SECONDARY = ("groq", "llama3-70b-8192")
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def run(mode: str, args, base: str) -> Dict:
+    os.environ.update({
+        "PROVIDER_ROUTING": mode,
+        "PROVIDER_HEDGE_MAP": f'{{"{PRIMARY[0]}/{PRIMARY[1]}": "{SECONDARY[0]}/{SECONDARY[1]}"}}',
+        "DEEPSEEK_API_BASE": f"{base}/deepseek",
+        "GROQ_API_BASE": f"{base}/groq",
+        "DEEPSEEK_API_KEY": "mock",
+        "GROQ_API_KEY": "mock",
+    })
+    from app.services.ai_service import AIService
+    from app.services.http_client import http_client
+    from app.services.provider_scheduler import INTERACTIVE
+
+    specs = {
+        "deepseek": parse_spec(f"deepseek:{args.primary}"),
+        "groq": parse_spec(f"groq:{args.secondary}"),
+    }
+    providers, runner = await start_mock_server(specs, args.port, args.seed)
+    service = AIService()
+    ttfts, totals, errors = [], [], 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            first = None
+            try:
+                stream = service.router.stream(*PRIMARY, lambda provider, model: service._scheduled_stream(
+                    provider, f"问题{i}", model, f"user{i % 10}", INTERACTIVE
+                ))
+                async for _ in stream:
+                    if first is None:
+                        first = time.perf_counter() - started
+                ttfts.append(first)
+                totals.append(time.perf_counter() - started)
+            except Exception:
+                errors += 1
+
+    try:
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+    finally:
+        await http_client.close()
+        await runner.cleanup()
+    upstream = sum(stats["requests"] for stats in providers.stats.values())
+    return {
+        "mode": mode,
+        "ttft_p50_ms": percentile(ttfts, 0.5) * 1000,
+        "ttft_p95_ms": percentile(ttfts, 0.95) * 1000,
+        "ttft_p99_ms": percentile(ttfts, 0.99) * 1000,
+        "total_p99_ms": percentile(totals, 0.99) * 1000,
+        "error_rate": errors / args.requests,
+        "extra_requests": upstream / args.requests - 1,
+        "router": service.router.stats()["models"].get(f"{PRIMARY[0]}/{PRIMARY[1]}", {}),
+        "upstream": providers.stats,
+    }
+
+
+async def main(args):
+    base = f"http://127.0.0.1:{args.port}"
+    print(f"主模型: {args.primary}\n等价模型: {args.secondary}\n请求数 {args.requests}，并发 {args.concurrency}")
+    for mode in ("direct", "hedged"):
+        result = await run(mode, args, base)
+        router = result["router"]
+        print(
+            f"{mode:<7} TTFT p50={result['ttft_p50_ms']:7.0f}ms  p95={result['ttft_p95_ms']:7.0f}ms  "
+            f"p99={result['ttft_p99_ms']:7.0f}ms  总耗时p99={result['total_p99_ms']:7.0f}ms  "
+            f"错误率={result['error_rate']:.2%}  额外请求={result['extra_requests']:.1%}  "
+            f"对冲={router.get('hedges', 0)} 等价模型完成={router.get('alternate_wins', 0)} 切换={router.get('failovers', 0)}"
+        )
+        if args.verbose:
+            print(f"        上游: {result['upstream']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--primary", default="ttft_ms=300,jitter_ms=100,tail_rate=0.05,tail_ms=4000,error_rate=0.02",
+        help="主模型的模拟参数，见 mock_providers.DEFAULT_SPEC"
+    )
+    parser.add_argument("--secondary", default="ttft_ms=450,jitter_ms=100", help="等价模型的模拟参数")
+    parser.add_argument("--verbose", action="store_true")
+    asyncio.run(main(parser.parse_args()))
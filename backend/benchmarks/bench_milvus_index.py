@@ -0,0 +1,124 @@
+"""Milvus索引基准：在不同索引类型与检索参数下测量 recall@k（相对精确检索）和 QPS
+
+用法（在 backend 目录下运行，需要可访问的 Milvus 服务）：
+    python -m benchmarks.bench_milvus_index --rows 200000 --dim 384 --k 10
+    python -m benchmarks.bench_milvus_index --vectors chunks.npy --index-types HNSW IVF_SQ8
+"""
+import argparse
+import time
+from typing import Dict, List
+
+import numpy as np
+from pymilvus import (
+    connections,
+    utility,
+    Collection,
+    CollectionSchema,
+    FieldSchema,
+    DataType
+)
+
+from app.services.milvus_backend import INDEX_TYPES, default_index_params, default_search_params
+
+# 每种索引在默认值附近扫描的检索参数
+SEARCH_SWEEPS = {
+    "FLAT": [{}],
+    "HNSW": [{"ef": ef} for ef in (16, 32, 64, 128, 256)],
+}
+
+
+def ivf_sweep(nlist: int) -> List[Dict[str, int]]:
+    return [{"nprobe": nprobe} for nprobe in (1, 4, 8, 16, 32, 64, 128, 256) if nprobe <= nlist]
+
+
+def exact_top_k(data: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """分块计算精确的L2 top-k作为基准答案"""
+    norms = np.einsum("ij,ij->i", data, data)
+    result = []
+    for query in queries:
+        distances = norms - 2 * (data @ query)
+        top = np.argpartition(distances, k)[:k]
+        result.append(top[np.argsort(distances[top])])
+    return np.asarray(result)
+
+
+def build_collection(name: str, data: np.ndarray, index_type: str, index_params: Dict) -> Collection:
+    if utility.has_collection(name):
+        utility.drop_collection(name)
+    fields = [
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=data.shape[1])
+    ]
+    collection = Collection(name, CollectionSchema(fields=fields))
+    for start in range(0, len(data), 10000):
+        batch = data[start:start + 10000]
+        collection.insert([list(range(start, start + len(batch))), batch])
+    collection.flush()
+
+    started = time.perf_counter()
+    collection.create_index(
+        field_name="embedding",
+        index_params={"metric_type": "L2", "index_type": index_type, "params": index_params}
+    )
+    utility.wait_for_index_building_complete(name)
+    print(f"  索引构建耗时 {time.perf_counter() - started:.1f}s")
+    collection.load()
+    return collection
+
+
+def run_sweep(collection: Collection, queries: np.ndarray, truth: np.ndarray, k: int, params: Dict):
+    found = []
+    started = time.perf_counter()
+    for query in queries:
+        results = collection.search(
+            data=[query],
+            anns_field="embedding",
+            param={"metric_type": "L2", "params": params},
+            limit=k,
+            consistency_level="Strong"
+        )
+        found.append([hit.id for hit in results[0]])
+    elapsed = time.perf_counter() - started
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    return recall, len(queries) / elapsed
+
+
+def main(args):
+    connections.connect(alias="default", host=args.host, port=args.port)
+    rng = np.random.default_rng(0)
+    if args.vectors:
+        data = np.load(args.vectors, mmap_mode="r").astype(np.float32)
+    else:
+        data = rng.standard_normal((args.rows, args.dim), dtype=np.float32)
+    queries = data[rng.choice(len(data), args.queries, replace=False)] + \
+        rng.normal(0, 0.05, (args.queries, data.shape[1])).astype(np.float32)
+    truth = exact_top_k(data, queries, args.k)
+
+    print(f"rows={len(data)} dim={data.shape[1]} queries={args.queries} k={args.k}")
+    print(f"{'index':<10} {'build params':<32} {'search params':<18} {'recall@k':>9} {'QPS':>9}")
+    for index_type in args.index_types:
+        index_params = default_index_params(index_type, len(data), data.shape[1])
+        print(f"{index_type}: {index_params}")
+        collection = build_collection(f"bench_{index_type.lower()}", data, index_type, index_params)
+        sweep = SEARCH_SWEEPS.get(index_type) or ivf_sweep(index_params["nlist"])
+        default = default_search_params(index_type, index_params, args.k)
+        for params in sweep + ([default] if default not in sweep else []):
+            recall, qps = run_sweep(collection, queries, truth, args.k, params)
+            marker = " (默认)" if params == default else ""
+            print(f"{index_type:<10} {str(index_params):<32} {str(params):<18} {recall:>9.3f} {qps:>9.1f}{marker}")
+        if not args.keep:
+            utility.drop_collection(collection.name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="19530")
+    parser.add_argument("--vectors", help="使用真实向量（.npy，float32，形状为[N, dim]）")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--index-types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    parser.add_argument("--keep", action="store_true", help="保留基准集合")
+    main(parser.parse_args())
@@ -0,0 +1,131 @@
+"""SSE流式输出基准：对比旧实现（每个片段 json.dumps 一帧）与合并成帧的帧数、吞吐和CPU开销
+
+模拟模型逐个输出片段（可设置片段间隔），统计每个回答的帧数、字节数、端到端耗时与CPU时间；
+另外对比逐行decode+json.loads与字节级解析上游SSE响应的速度。
+
+用法（在 backend 目录下运行）：
+    python -m benchmarks.bench_sse --answers 200 --tokens 500
+    python -m benchmarks.bench_sse --tokens 300 --interval-ms 5 --coalesce-ms 0 10 20 50
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import AsyncIterator, List
+
+from app.services.sse import SSEEncoder, iter_sse_data, loads
+
+TOKENS = ["根据", "文档", "内容", "，", "系统", "支持", " the", " index", " is", " rebuilt", "。", "\n"]
+
+
+async def answer(tokens: int, interval: float) -> AsyncIterator[str]:
+    for i in range(tokens):
+        if interval:
+            await asyncio.sleep(interval)
+        yield TOKENS[i % len(TOKENS)]
+
+
+async def legacy_stream(generator):
+    """旧实现：main.stream_response"""
+    async for chunk in generator:
+        if chunk:
+            yield f"data: {json.dumps({'content': chunk})}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+async def consume(stream) -> List[int]:
+    sizes = []
+    async for frame in stream:
+        # StreamingResponse会把str编码为bytes
+        sizes.append(len(frame.encode("utf-8") if isinstance(frame, str) else frame))
+    return sizes
+
+
+async def run(name: str, make_stream, args):
+    frames = size = 0
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+    # 同时进行多个回答，接近服务端真实的并发情况
+    for start in range(0, args.answers, args.concurrency):
+        batch = range(start, min(start + args.concurrency, args.answers))
+        results = await asyncio.gather(*(
+            consume(make_stream(answer(args.tokens, args.interval_ms / 1000))) for _ in batch
+        ))
+        for sizes in results:
+            frames += len(sizes)
+            size += sum(sizes)
+    wall = time.perf_counter() - wall_started
+    cpu = time.process_time() - cpu_started
+    print(
+        f"{name:<22} frames/answer={frames / args.answers:7.1f}  bytes/answer={size / args.answers:8.0f}  "
+        f"frames/s={frames / wall:9.0f}  CPU/answer={cpu / args.answers * 1000:7.2f}ms"
+    )
+
+
+class FakeContent:
+    """按网络包大小切分的上游响应体"""
+
+    def __init__(self, data: bytes, packet: int):
+        self.data = data
+        self.packet = packet
+
+    async def iter_any(self):
+        for start in range(0, len(self.data), self.packet):
+            yield self.data[start:start + self.packet]
+
+    async def __aiter__(self):
+        for line in self.data.splitlines(keepends=True):
+            yield line
+
+
+async def bench_parse(args):
+    lines = [
+        b"data: " + json.dumps({"choices": [{"delta": {"content": TOKENS[i % len(TOKENS)]}}]}).encode() + b"\n\n"
+        for i in range(args.tokens)
+    ]
+    body = b"".join(lines) + b"data: [DONE]\n\n"
+
+    started = time.process_time()
+    for _ in range(args.answers):
+        async for line in FakeContent(body, 1400):
+            line = line.decode("utf-8").strip()
+            if line.startswith("data: "):
+                if line == "data: [DONE]":
+                    break
+                data = json.loads(line[6:])
+                data.get("choices", [{}])[0].get("delta", {}).get("content")
+    legacy = time.process_time() - started
+
+    started = time.process_time()
+    for _ in range(args.answers):
+        async for payload in iter_sse_data(FakeContent(body, 1400)):
+            if b'"content"' in payload:
+                (loads(payload).get("choices") or [{}])[0].get("delta", {}).get("content")
+    optimized = time.process_time() - started
+    print(
+        f"上游解析 CPU/answer: 逐行decode+json.loads={legacy / args.answers * 1000:.2f}ms  "
+        f"字节级解析={optimized / args.answers * 1000:.2f}ms"
+    )
+
+
+async def main(args):
+    encoder = SSEEncoder()
+    print(f"每个回答 {args.tokens} 个片段，片段间隔 {args.interval_ms}ms，JSON: {encoder.stats()['json']}")
+    await run("legacy", legacy_stream, args)
+    for coalesce_ms in args.coalesce_ms:
+        await run(
+            f"sse coalesce={coalesce_ms:g}ms",
+            lambda generator: encoder.stream(generator, coalesce_ms, args.coalesce_bytes),
+            args
+        )
+    await bench_parse(args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--answers", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--tokens", type=int, default=500)
+    parser.add_argument("--interval-ms", type=float, default=0, help="模型输出片段的间隔")
+    parser.add_argument("--coalesce-ms", type=float, nargs="+", default=[0, 10, 20, 50])
+    parser.add_argument("--coalesce-bytes", type=int, default=512)
+    asyncio.run(main(parser.parse_args()))
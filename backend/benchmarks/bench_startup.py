@@ -0,0 +1,84 @@
+"""启动耗时基准：测量导入 app.main、工作进程预热到就绪的耗时与内存占用
+
+每轮在全新的子进程中导入 app.main（模拟 gunicorn 主进程），再 fork 出若干工作进程，
+各自执行预热（创建文档处理器、加载编码模型、连接向量库、完成一次编码）直到 /api/ready 就绪。
+分别在 EMBEDDING_PRELOAD=false / true 下运行：预加载时模型在主进程中只加载一次，
+工作进程以写时复制方式共享模型权重，就绪更快，Pss（按共享比例分摊的内存）更低。
+
+用法（在 backend 目录下运行，仅支持Linux）：
+    VECTOR_BACKEND=local python -m benchmarks.bench_startup --workers 4 --runs 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+CHILD = r"""
+import asyncio, json, os, sys, time
+
+def memory():
+    values = {}
+    for name in ("/proc/self/smaps_rollup", "/proc/self/status"):
+        if os.path.exists(name):
+            with open(name) as file:
+                for line in file:
+                    key, _, value = line.partition(":")
+                    if key in ("Pss", "VmRSS"):
+                        values[key] = int(value.split()[0]) / 1024
+    return values
+
+started = time.perf_counter()
+import app.main as main
+imported = time.perf_counter() - started
+print(json.dumps({"role": "master", "import_seconds": imported, **memory()}), flush=True)
+
+for _ in range(int(sys.argv[1])):
+    forked = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        asyncio.run(main.ai_service.ensure_ready())
+        print(json.dumps({
+            "role": "worker", "ready_seconds": time.perf_counter() - forked,
+            "warm_up_seconds": main.ai_service.readiness()["seconds"], **memory()
+        }), flush=True)
+        os._exit(0)
+    # 依次启动，避免各工作进程的预热互相争抢CPU
+    os.waitpid(pid, 0)
+"""
+
+
+def run(workers: int, preload: bool) -> List[Dict]:
+    env = {**os.environ, "EMBEDDING_PRELOAD": "true" if preload else "false"}
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, str(workers)], env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return [json.loads(line) for line in output.splitlines() if line.startswith("{")]
+
+
+def mean(values: List[float]) -> float:
+    return sum(values) / len(values) if values else 0.0
+
+
+def main(args):
+    for preload in (False, True):
+        masters, workers = [], []
+        for _ in range(args.runs):
+            for result in run(args.workers, preload):
+                (masters if result["role"] == "master" else workers).append(result)
+        print(
+            f"EMBEDDING_PRELOAD={str(preload).lower():<5}  "
+            f"import={mean([m['import_seconds'] for m in masters]):6.2f}s  "
+            f"master RSS={mean([m.get('VmRSS', 0) for m in masters]):7.1f}MB  "
+            f"worker ready={mean([w['ready_seconds'] for w in workers]):6.2f}s  "
+            f"worker RSS={mean([w.get('VmRSS', 0) for w in workers]):7.1f}MB  "
+            f"worker Pss={mean([w.get('Pss', 0) for w in workers]):7.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=3)
+    main(parser.parse_args())
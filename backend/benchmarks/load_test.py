@@ -0,0 +1,410 @@
+"""端到端压测：在本地模拟的模型提供商、认证桩和本地向量后端上压测文档上传入库与流式检索
+
+服务端在子进程中以 uvicorn 启动（工作目录为临时目录，VECTOR_BACKEND=local），DeepSeek 和 Keycloak 的公钥接口
+都指向 benchmarks.mock_providers 启动的模拟服务：压测脚本生成RSA密钥，模拟服务返回其JWKS，请求携带用该密钥
+签名的RS256令牌，认证走与线上相同的离线验签路径。回答缓存和向量缓存均关闭，每个并发数使用不同的文档和问题，
+避免后面的并发数命中前面留下的缓存。依次进行：
+  1. ingest：按各并发数上传生成的txt文档到 /api/process-document，统计上传延迟和从上传到入库完成的耗时；
+  2. search：按各并发数请求 /api/search/stream（在全部已入库文档中检索），统计总延迟、首字延迟和吞吐。
+每个阶段采样服务端进程的RSS。文档和问题由 --seed 确定生成，结果可用 --output 保存为JSON，
+下次用 --baseline 对比，便于发现性能回退。
+
+--embedding hash 使用按词哈希的确定性编码代替真实模型，用于排除模型推理、只测服务端其余路径。
+
+用法（在 backend 目录下运行，需要安装 uvicorn、aiohttp、python-jose 与服务端依赖）：
+    python -m benchmarks.load_test --concurrency 1 8 32 --requests 200 --documents 20
+    python -m benchmarks.load_test --output results.json
+    python -m benchmarks.load_test --output new.json --baseline results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+from benchmarks.mock_providers import parse_spec, start_mock_server
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REALM = "load-test"
+KID = "load-test"
+
+SERVER = r"""
+import hashlib, os, sys
+import numpy as np
+import uvicorn
+
+if os.environ.get("LOAD_TEST_EMBEDDING") == "hash":
+    from app.services import embedding_backend
+
+    class HashEmbeddingBackend(embedding_backend.EmbeddingBackend):
+        name = "hash"
+
+        def __init__(self, model_name):
+            super().__init__(model_name)
+            self.dim = 384
+
+        def _encode(self, texts):
+            embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+            for row, text in enumerate(texts):
+                for word in text.split():
+                    digest = hashlib.md5(word.encode("utf-8")).digest()
+                    embeddings[row, int.from_bytes(digest[:4], "little") % self.dim] += 1.0
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            return embeddings / np.maximum(norms, 1e-12)
+
+    model_name = os.getenv("EMBEDDING_MODEL", embedding_backend.DEFAULT_EMBEDDING_MODEL)
+    backend = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+    embedding_backend._shared[(model_name, backend)] = HashEmbeddingBackend(model_name)
+
+import app.main as main
+
+uvicorn.run(main.app, host="127.0.0.1", port=int(sys.argv[1]), log_level="warning")
+"""
+
+WORDS = (
+    "检索 向量 文档 模型 索引 分块 缓存 延迟 吞吐 并发 队列 摘要 上下文 提示词 相似度 重排 "
+    "vector index chunk cache latency throughput query document model embedding rerank hybrid"
+).split()
+
+
+def generate_document(rng: random.Random, paragraphs: int) -> str:
+    """生成确定性的测试文档"""
+    lines = []
+    for _ in range(paragraphs):
+        lines.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))) + "。")
+    return "\n\n".join(lines)
+
+
+def generate_queries(rng: random.Random, count: int) -> List[str]:
+    """生成确定性的测试问题"""
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 8))) + f" #{i}" for i in range(count)]
+
+
+def create_credentials(lifetime: int) -> Tuple[Dict[str, Any], str]:
+    """生成RSA密钥，返回模拟Keycloak发布的JWKS和用该密钥签名的访问令牌"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    public_key = jwk.construct(public_pem, "RS256").to_dict()
+    public_key.update({"kid": KID, "use": "sig", "alg": "RS256"})
+    now = int(time.time())
+    token = jwt.encode(
+        {"sub": "load-test", "preferred_username": "load-test", "iat": now, "exp": now + lifetime},
+        private_pem, algorithm="RS256", headers={"kid": KID}
+    )
+    return {"keys": [public_key]}, token
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    if not values:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "mean_ms": 0.0}
+
+    def pick(p: float) -> float:
+        return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+    return {
+        "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+        "mean_ms": sum(values) / len(values) * 1000,
+    }
+
+
+class Server:
+    """在子进程中运行的被测服务"""
+
+    def __init__(self, args, mock_base: str):
+        self.args = args
+        self.workdir = args.workdir or tempfile.mkdtemp(prefix="aidocsearch-load-")
+        self.base = f"http://127.0.0.1:{args.port}"
+        self.env = {
+            **os.environ,
+            "PYTHONPATH": BACKEND_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""),
+            "VECTOR_BACKEND": "local",
+            "DEEPSEEK_API_BASE": f"{mock_base}/deepseek",
+            "DEEPSEEK_API_KEY": "mock",
+            "KEYCLOAK_URL": f"{mock_base}/",
+            "KEYCLOAK_REALM": REALM,
+            "KEYCLOAK_CLIENT_ID": "load-test",
+            "KEYCLOAK_VERIFY_MODE": "offline",
+            "KEYCLOAK_AUDIENCE": "",
+            # 关闭回答缓存和向量缓存，每个请求都走完整的嵌入、检索与生成路径
+            "RESPONSE_CACHE_TTL": "0",
+            "EMBEDDING_CACHE_PATH": "",
+            "EMBEDDING_CACHE_MEMORY_ITEMS": "0",
+            "LOAD_TEST_EMBEDDING": args.embedding,
+        }
+        self.process: Optional[subprocess.Popen] = None
+
+    async def start(self, session: aiohttp.ClientSession):
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", SERVER, str(self.args.port)], cwd=self.workdir, env=self.env
+        )
+        started = time.perf_counter()
+        while time.perf_counter() - started < self.args.startup_timeout:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"服务启动失败，退出码 {self.process.returncode}")
+            try:
+                async with session.get(f"{self.base}/api/ready") as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError("等待服务就绪超时")
+
+    def memory(self) -> Dict[str, float]:
+        """服务进程当前与峰值的RSS（MB）"""
+        values = {}
+        path = f"/proc/{self.process.pid}/status"
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    key, _, value = line.partition(":")
+                    if key in ("VmRSS", "VmHWM"):
+                        values[key] = int(value.split()[0]) / 1024
+        return values
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+
+
+async def sample_memory(server: Server, peak: Dict[str, float]):
+    """阶段进行期间定时采样RSS峰值"""
+    while True:
+        peak["rss_mb"] = max(peak.get("rss_mb", 0.0), server.memory().get("VmRSS", 0.0))
+        await asyncio.sleep(0.2)
+
+
+async def run_phase(server: Server, phase):
+    peak: Dict[str, float] = {}
+    sampler = asyncio.ensure_future(sample_memory(server, peak))
+    try:
+        result = await phase()
+    finally:
+        sampler.cancel()
+    result["peak_rss_mb"] = peak.get("rss_mb", 0.0)
+    return result
+
+
+async def ingest(session, server: Server, texts: List[str], concurrency: int) -> Dict[str, Any]:
+    """上传文档并等待全部入库完成"""
+    semaphore = asyncio.Semaphore(concurrency)
+    uploads, completions, document_ids, errors = [], [], [], 0
+
+    async def one(i: int, text: str):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            form = aiohttp.FormData()
+            form.add_field("file", text.encode("utf-8"), filename=f"load-{i}.txt", content_type="text/plain")
+            async with session.post(
+                f"{server.base}/api/process-document",
+                params={"model": "deepseek", "model_name": "deepseek-chat"}, data=form
+            ) as response:
+                if response.status != 200:
+                    errors += 1
+                    return
+                document_id = (await response.json())["document_id"]
+            uploads.append(time.perf_counter() - started)
+        # 入库在服务端后台进行，轮询直到完成（不占用上传并发名额）
+        while True:
+            async with session.get(f"{server.base}/api/documents/{document_id}/status") as response:
+                status = (await response.json())["status"]
+            if status in ("completed", "failed"):
+                break
+            await asyncio.sleep(0.1)
+        if status == "failed":
+            errors += 1
+            return
+        completions.append(time.perf_counter() - started)
+        document_ids.append(document_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i, text) for i, text in enumerate(texts)))
+    elapsed = time.perf_counter() - started
+    return {
+        "documents": len(texts),
+        "errors": errors,
+        "documents_per_second": len(document_ids) / elapsed if elapsed else 0.0,
+        "upload": percentiles(uploads),
+        "ingest": percentiles(completions),
+        "document_ids": document_ids,
+    }
+
+
+async def search(session, server: Server, queries: List[str], concurrency: int, args) -> Dict[str, Any]:
+    """并发请求流式检索，统计总延迟、首字延迟与吞吐"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, ttfts, errors, frames = [], [], 0, 0
+
+    async def one(query: str):
+        nonlocal errors, frames
+        async with semaphore:
+            started = time.perf_counter()
+            first = None
+            failed = False
+            async with session.post(f"{server.base}/api/search/stream", params={
+                "query": query, "model": "deepseek", "model_name": "deepseek-chat",
+                "all_documents": "true", "k": str(args.k),
+            }) as response:
+                if response.status != 200:
+                    errors += 1
+                    await response.read()
+                    return
+                async for line in response.content:
+                    if line.startswith(b'data: {"content"'):
+                        frames += 1
+                        if first is None:
+                            first = time.perf_counter() - started
+                    elif line.startswith(b'data: {"error"'):
+                        failed = True
+            if failed or first is None:
+                errors += 1
+                return
+            ttfts.append(first)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(query) for query in queries))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(queries),
+        "errors": errors,
+        "requests_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "frames_per_request": frames / len(latencies) if latencies else 0.0,
+        "latency": percentiles(latencies),
+        "ttft": percentiles(ttfts),
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]):
+    """与基线结果逐项对比，打印变化百分比"""
+    print("\n与基线对比（延迟与内存越低越好，吞吐越高越好）：")
+    for name, result in results["phases"].items():
+        previous = baseline.get("phases", {}).get(name)
+        if previous is None:
+            continue
+        for metric in ("documents_per_second", "requests_per_second", "peak_rss_mb"):
+            if metric in result and metric in previous and previous[metric]:
+                change = (result[metric] - previous[metric]) / previous[metric]
+                print(f"  {name:<16} {metric:<22} {previous[metric]:10.1f} -> {result[metric]:10.1f}  {change:+7.1%}")
+        for group in ("upload", "ingest", "latency", "ttft"):
+            if group in result and group in previous:
+                for metric in ("p50_ms", "p95_ms", "p99_ms"):
+                    before, after = previous[group][metric], result[group][metric]
+                    if before:
+                        print(
+                            f"  {name:<16} {group + '.' + metric:<22} {before:10.1f} -> {after:10.1f}  "
+                            f"{(after - before) / before:+7.1%}"
+                        )
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    # 每个并发数各用一批不同的文档和问题；各次运行生成的序列相同，结果可比
+    texts = {
+        concurrency: [generate_document(rng, args.paragraphs) for _ in range(args.documents)]
+        for concurrency in args.concurrency
+    }
+    queries = {concurrency: generate_queries(rng, args.requests) for concurrency in args.concurrency}
+    jwks, token = create_credentials(args.token_lifetime)
+    mock_spec = parse_spec(f"deepseek:{args.provider}")
+    providers, runner = await start_mock_server({"deepseek": mock_spec}, args.mock_port, args.seed, jwks)
+    server = Server(args, f"http://127.0.0.1:{args.mock_port}")
+    connector = aiohttp.TCPConnector(limit=0)
+    results: Dict[str, Any] = {
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ("output", "baseline", "workdir")
+        },
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "phases": {},
+    }
+    try:
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=None),
+            headers={"Authorization": f"Bearer {token}"}
+        ) as session:
+            results["ready_seconds"] = await server.start(session)
+            results["idle_rss_mb"] = server.memory().get("VmRSS", 0.0)
+            print(f"服务就绪 {results['ready_seconds']:.1f}s，空闲RSS {results['idle_rss_mb']:.0f}MB，工作目录 {server.workdir}")
+
+            for concurrency in args.concurrency:
+                # 每个并发数上传一批新文档，检索范围随之扩大
+                result = await run_phase(server, lambda: ingest(session, server, texts[concurrency], concurrency))
+                result.pop("document_ids")
+                results["phases"][f"ingest@{concurrency}"] = result
+                print(
+                    f"ingest c={concurrency:<3} docs/s={result['documents_per_second']:7.2f}  "
+                    f"上传p50/p95/p99={result['upload']['p50_ms']:.0f}/{result['upload']['p95_ms']:.0f}/"
+                    f"{result['upload']['p99_ms']:.0f}ms  入库p50/p95/p99={result['ingest']['p50_ms']:.0f}/"
+                    f"{result['ingest']['p95_ms']:.0f}/{result['ingest']['p99_ms']:.0f}ms  "
+                    f"错误={result['errors']}  峰值RSS={result['peak_rss_mb']:.0f}MB"
+                )
+
+            for concurrency in args.concurrency:
+                result = await run_phase(server, lambda: search(session, server, queries[concurrency], concurrency, args))
+                results["phases"][f"search@{concurrency}"] = result
+                print(
+                    f"search c={concurrency:<3} req/s={result['requests_per_second']:7.2f}  "
+                    f"延迟p50/p95/p99={result['latency']['p50_ms']:.0f}/{result['latency']['p95_ms']:.0f}/"
+                    f"{result['latency']['p99_ms']:.0f}ms  首字p50/p95/p99={result['ttft']['p50_ms']:.0f}/"
+                    f"{result['ttft']['p95_ms']:.0f}/{result['ttft']['p99_ms']:.0f}ms  "
+                    f"帧/请求={result['frames_per_request']:.1f}  错误={result['errors']}  "
+                    f"峰值RSS={result['peak_rss_mb']:.0f}MB"
+                )
+            memory = server.memory()
+            results["final_rss_mb"] = memory.get("VmRSS", 0.0)
+            results["max_rss_mb"] = memory.get("VmHWM", 0.0)
+            results["upstream"] = providers.stats
+    finally:
+        server.stop()
+        await runner.cleanup()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="每个并发数下的检索请求数")
+    parser.add_argument("--documents", type=int, default=10, help="每个并发数下上传的文档数")
+    parser.add_argument("--paragraphs", type=int, default=50, help="每个文档的段落数")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--embedding", choices=("model", "hash"), default="model")
+    parser.add_argument(
+        "--provider", default="ttft_ms=200,jitter_ms=50,interval_ms=10,tokens=100",
+        help="模拟模型的参数，见 mock_providers.DEFAULT_SPEC"
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mock-port", type=int, default=9100)
+    parser.add_argument("--workdir", default=None, help="服务端工作目录，默认新建临时目录")
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--token-lifetime", type=int, default=86400, help="测试令牌的有效期（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="保存结果的JSON文件")
+    parser.add_argument("--baseline", default=None, help="用于对比的上一次结果JSON文件")
+    asyncio.run(main(parser.parse_args()))
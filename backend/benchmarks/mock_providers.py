@@ -0,0 +1,161 @@
+"""本地模拟的模型提供商：OpenAI兼容的 chat/completions 流式接口和 Ollama 的 /api/generate
+
+每个模拟提供商挂在 /<name> 路径下，可设置首字延迟、片段间隔、片段数、错误率和慢请求（长尾）：
+    DEEPSEEK_API_BASE=http://127.0.0.1:9100/deepseek
+    GROQ_API_BASE=http://127.0.0.1:9100/groq
+    OLLAMA_HOST=http://127.0.0.1:9100/ollama
+
+传入 jwks 时还会在 /realms/<realm>/protocol/openid-connect/certs 返回该JWKS，用作Keycloak的公钥接口：
+    KEYCLOAK_URL=http://127.0.0.1:9100/
+
+用法（在 backend 目录下运行）：
+    python -m benchmarks.mock_providers --port 9100 \\
+        --provider deepseek:ttft_ms=300,tail_rate=0.05,tail_ms=4000 --provider groq:ttft_ms=150
+"""
+import argparse
+import asyncio
+import json
+import random
+from typing import Dict, Optional
+
+from aiohttp import web
+
+# 每个提供商的默认行为
+DEFAULT_SPEC = {
+    "ttft_ms": 200.0,      # 首字延迟
+    "jitter_ms": 50.0,     # 首字延迟的随机波动
+    "interval_ms": 10.0,   # 片段间隔
+    "tokens": 50,          # 每个回答的片段数
+    "error_rate": 0.0,     # 首字之前返回500的比例
+    "tail_rate": 0.0,      # 慢请求比例
+    "tail_ms": 3000.0,     # 慢请求额外的首字延迟
+}
+
+TOKENS = ["根据", "文档", "内容", "，", "系统", "支持", " the", " index", " is", " rebuilt", "。"]
+
+
+def parse_spec(text: str) -> Dict:
+    """解析 name:key=value,key=value 形式的提供商配置"""
+    name, _, options = text.partition(":")
+    spec = {"name": name, **DEFAULT_SPEC}
+    for option in filter(None, options.split(",")):
+        key, _, value = option.partition("=")
+        if key not in DEFAULT_SPEC:
+            raise ValueError(f"未知的模拟参数: {key}")
+        spec[key] = type(DEFAULT_SPEC[key])(value)
+    return spec
+
+
+class MockProviders:
+    """按配置模拟多个提供商的流式输出，并统计各提供商收到和中途断开的请求数"""
+
+    def __init__(self, specs: Dict[str, Dict], seed: Optional[int] = None, jwks: Optional[Dict] = None):
+        self.specs = specs
+        self.jwks = jwks
+        self.random = random.Random(seed)
+        self.stats = {name: {"requests": 0, "errors": 0, "slow": 0, "cancelled": 0} for name in specs}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/{name}/chat/completions", self.chat_completions)
+        app.router.add_post("/{name}/api/generate", self.generate)
+        if self.jwks is not None:
+            app.router.add_get("/realms/{realm}/protocol/openid-connect/certs", self.certs)
+        return app
+
+    async def certs(self, request: web.Request) -> web.Response:
+        return web.json_response(self.jwks)
+
+    async def _start(self, request: web.Request, content_type: str):
+        """按配置等待首字延迟；返回已开始的响应，模拟失败时返回None"""
+        name = request.match_info["name"]
+        spec = self.specs.get(name)
+        if spec is None:
+            raise web.HTTPNotFound(text=f"未配置的模拟提供商: {name}")
+        stats = self.stats[name]
+        stats["requests"] += 1
+        delay = max(0.0, spec["ttft_ms"] + self.random.uniform(-1, 1) * spec["jitter_ms"])
+        if self.random.random() < spec["tail_rate"]:
+            stats["slow"] += 1
+            delay += spec["tail_ms"]
+        await asyncio.sleep(delay / 1000)
+        if self.random.random() < spec["error_rate"]:
+            stats["errors"] += 1
+            return spec, None
+        response = web.StreamResponse(headers={"Content-Type": content_type})
+        await response.prepare(request)
+        return spec, response
+
+    async def _prepare(self, request: web.Request, content_type: str):
+        """_start 的包装：客户端在首字之前断开（如对冲请求中落后的一路）时计入cancelled"""
+        try:
+            return await self._start(request, content_type)
+        except (asyncio.CancelledError, ConnectionResetError):
+            self.stats[request.match_info["name"]]["cancelled"] += 1
+            raise
+
+    async def _write_tokens(self, request: web.Request, spec: Dict, response: web.StreamResponse, frame):
+        try:
+            for i in range(int(spec["tokens"])):
+                if i and spec["interval_ms"]:
+                    await asyncio.sleep(spec["interval_ms"] / 1000)
+                await response.write(frame(TOKENS[i % len(TOKENS)]))
+        except (asyncio.CancelledError, ConnectionResetError):
+            # 客户端取消了请求（如对冲请求中落后的一路）
+            self.stats[request.match_info["name"]]["cancelled"] += 1
+            raise
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        spec, response = await self._prepare(request, "text/event-stream")
+        if response is None:
+            return web.json_response({"error": {"message": "mock upstream error"}}, status=500)
+
+        def frame(token: str) -> bytes:
+            data = {"choices": [{"delta": {"content": token}}]}
+            return b"data: " + json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+        await self._write_tokens(request, spec, response, frame)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def generate(self, request: web.Request) -> web.StreamResponse:
+        spec, response = await self._prepare(request, "application/x-ndjson")
+        if response is None:
+            return web.json_response({"error": "mock upstream error"}, status=500)
+
+        def frame(token: str) -> bytes:
+            return json.dumps({"response": token, "done": False}, ensure_ascii=False).encode("utf-8") + b"\n"
+
+        await self._write_tokens(request, spec, response, frame)
+        await response.write(b'{"response": "", "done": true}\n')
+        return response
+
+
+async def start_mock_server(
+    specs: Dict[str, Dict], port: int = 9100, seed: Optional[int] = None, jwks: Optional[Dict] = None
+):
+    """在当前事件循环中启动模拟服务，返回 (MockProviders, runner)，结束时调用 runner.cleanup()"""
+    providers = MockProviders(specs, seed, jwks)
+    runner = web.AppRunner(providers.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return providers, runner
+
+
+async def main(args):
+    specs = {spec["name"]: spec for spec in map(parse_spec, args.provider)}
+    await start_mock_server(specs, args.port, args.seed)
+    for name, spec in specs.items():
+        print(f"http://127.0.0.1:{args.port}/{name}  {spec}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--provider", action="append", default=[], help="name:key=value,...，可重复")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    if not args.provider:
+        args.provider = ["deepseek", "groq", "ollama"]
+    asyncio.run(main(args))
@@ -0,0 +1,50 @@
+"""将现有的 document_chunks 集合迁移为以 document_id 为分区键的集合
+
+用法（在 backend 目录下运行，迁移期间请暂停文档上传）：
+    python -m scripts.migrate_partition_key --batch-size 1000
+
+向量维度取自现有集合的 embedding 字段，与当前使用的嵌入模型无关。
+"""
+import argparse
+import os
+import time
+from typing import Optional
+
+from pymilvus import Collection, connections, utility
+
+from app.services.milvus_backend import MilvusBackend
+
+COLLECTION_NAME = "document_chunks"
+
+
+def collection_dim(name: str) -> Optional[int]:
+    """读取现有集合的向量维度，集合不存在时返回None"""
+    connections.connect(
+        alias="default",
+        host=os.getenv("MILVUS_HOST", "localhost"),
+        port=os.getenv("MILVUS_PORT", "19530")
+    )
+    if not utility.has_collection(name):
+        return None
+    field = next(field for field in Collection(name).schema.fields if field.name == "embedding")
+    return int(field.params["dim"])
+
+
+def main(args):
+    dim = args.dim or collection_dim(COLLECTION_NAME)
+    if dim is None:
+        print(f"集合{COLLECTION_NAME}不存在，无需迁移")
+        return
+    backend = MilvusBackend(dim)
+    started = time.perf_counter()
+    copied = backend.migrate_to_partition_key(batch_size=args.batch_size)
+    if copied:
+        print(f"迁移完成：{copied}行，耗时{time.perf_counter() - started:.1f}s")
+        print(f"旧集合已重命名为 {backend.collection_name}_legacy，确认无误后可手动删除")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dim", type=int, default=None, help="向量维度，默认读取现有集合的维度")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    main(parser.parse_args())
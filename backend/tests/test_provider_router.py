@@ -0,0 +1,193 @@
+"""ProviderRouter 对冲与切换的测试：经 AIService._scheduled_stream 调用 benchmarks.mock_providers 模拟的提供商
+
+模拟服务运行在单独线程的事件循环中，测试所在的事件循环里只有被测代码创建的任务，便于检查是否有遗留任务。
+
+用法（在 backend 目录下运行）：
+    python -m pytest tests
+"""
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from benchmarks.mock_providers import parse_spec, start_mock_server
+
+PRIMARY = ("deepseek", "deepseek-chat")
+SECONDARY = ("groq", "llama3-70b-8192")
+HEDGE_DELAY = 0.3
+
+
+@pytest.fixture(scope="module")
+def mock_server():
+    """在后台线程中启动模拟提供商，返回 (base, MockProviders)"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    specs = {name: parse_spec(name) for name in (PRIMARY[0], SECONDARY[0])}
+    providers, runner = asyncio.run_coroutine_threadsafe(start_mock_server(specs, port, 0), loop).result(10)
+    yield f"http://127.0.0.1:{port}", providers
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result(10)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(10)
+    loop.close()
+
+
+@pytest.fixture
+def service(mock_server, monkeypatch):
+    """按模拟服务的地址创建hedged模式的AIService；每个测试各自设置模拟参数"""
+    base, providers = mock_server
+    monkeypatch.setenv("PROVIDER_ROUTING", "hedged")
+    monkeypatch.setenv("PROVIDER_HEDGE_MAP", f'{{"{PRIMARY[0]}/{PRIMARY[1]}": "{SECONDARY[0]}/{SECONDARY[1]}"}}')
+    monkeypatch.setenv("HEDGE_DEFAULT_DELAY_MS", str(int(HEDGE_DELAY * 1000)))
+    monkeypatch.setenv("DEEPSEEK_API_BASE", f"{base}/deepseek")
+    monkeypatch.setenv("GROQ_API_BASE", f"{base}/groq")
+    monkeypatch.setenv("DEEPSEEK_API_KEY", "mock")
+    monkeypatch.setenv("GROQ_API_KEY", "mock")
+    from app.services.ai_service import AIService
+    return AIService(), providers
+
+
+def configure(providers, primary: str, secondary: str):
+    providers.specs[PRIMARY[0]] = parse_spec(f"{PRIMARY[0]}:jitter_ms=0,tokens=5,{primary}")
+    providers.specs[SECONDARY[0]] = parse_spec(f"{SECONDARY[0]}:jitter_ms=0,tokens=5,{secondary}")
+
+
+def run(service, consume):
+    """在新的事件循环中经路由器发起一次请求，记录每一路的打开与关闭；返回 (consume的结果, 事件列表)
+
+    结束前检查调度名额已全部释放、事件循环中没有遗留任务。
+    """
+    from app.services.http_client import http_client
+    from app.services.provider_scheduler import INTERACTIVE
+
+    events = []
+
+    def open_stream(provider: str, model: str):
+        async def generator():
+            events.append(("open", provider, time.perf_counter()))
+            stream = service._scheduled_stream(provider, "问题", model, "tester", INTERACTIVE)
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+                events.append(("closed", provider, time.perf_counter()))
+        return generator()
+
+    async def main():
+        started = time.perf_counter()
+        try:
+            return await consume(service.router.stream(*PRIMARY, open_stream), started)
+        finally:
+            try:
+                # 无论成功还是失败，各路请求都已结束并释放调度名额和上游连接，事件循环中也没有仍在运行的收尾任务
+                assert all(lane["active"] == 0 for lane in service.scheduler.stats().values())
+                assert all(pool["acquired"] == 0 for pool in http_client.stats().values())
+                await asyncio.sleep(0.05)
+                leaked = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+                assert leaked == []
+            finally:
+                await http_client.close()
+
+    return asyncio.run(main()), events
+
+
+async def collect(stream, started):
+    """读完整个回答，返回 (首字耗时, 片段列表)"""
+    first, chunks = None, []
+    async for chunk in stream:
+        if first is None:
+            first = time.perf_counter() - started
+        chunks.append(chunk)
+    return first, chunks
+
+
+def opened(events, provider):
+    return [at for kind, name, at in events if kind == "open" and name == provider]
+
+
+def closed(events, provider):
+    return [at for kind, name, at in events if kind == "closed" and name == provider]
+
+
+def test_hedge_fires_after_delay_and_closes_slower_attempt(service):
+    service, providers = service
+    configure(providers, "ttft_ms=2000", "ttft_ms=100")
+    (first, chunks), events = run(service, collect)
+
+    assert len(chunks) == 5
+    # 主模型在对冲等待时间内没有输出，才向等价模型发出请求
+    assert opened(events, SECONDARY[0])[0] - opened(events, PRIMARY[0])[0] >= HEDGE_DELAY * 0.9
+    assert HEDGE_DELAY <= first < 1.5
+    # 落后的主模型请求在等价模型输出首字后被关闭，不等它自己结束
+    assert len(closed(events, PRIMARY[0])) == 1
+    assert closed(events, PRIMARY[0])[0] - opened(events, PRIMARY[0])[0] < 1.5
+    stats = service.router.stats()["models"][f"{PRIMARY[0]}/{PRIMARY[1]}"]
+    assert stats["hedges"] == 1
+    assert stats["alternate_wins"] == 1
+    assert stats["failovers"] == 0
+
+
+def test_no_hedge_when_primary_answers_in_time(service):
+    service, providers = service
+    configure(providers, "ttft_ms=50", "ttft_ms=50")
+    (first, chunks), events = run(service, collect)
+
+    assert len(chunks) == 5
+    assert first < HEDGE_DELAY
+    assert opened(events, SECONDARY[0]) == []
+    assert len(closed(events, PRIMARY[0])) == 1
+    stats = service.router.stats()["models"][f"{PRIMARY[0]}/{PRIMARY[1]}"]
+    assert stats["hedges"] == 0
+    assert stats["alternate_wins"] == 0
+
+
+def test_failover_after_provider_error(service):
+    service, providers = service
+    configure(providers, "ttft_ms=50,error_rate=1", "ttft_ms=50")
+    (first, chunks), events = run(service, collect)
+
+    assert len(chunks) == 5
+    # 首字之前失败时立即切换，不等对冲等待时间
+    assert first < HEDGE_DELAY
+    assert opened(events, SECONDARY[0])[0] < opened(events, PRIMARY[0])[0] + HEDGE_DELAY
+    assert len(closed(events, PRIMARY[0])) == 1
+    assert len(closed(events, SECONDARY[0])) == 1
+    stats = service.router.stats()["models"]
+    assert stats[f"{PRIMARY[0]}/{PRIMARY[1]}"]["failovers"] == 1
+    assert stats[f"{PRIMARY[0]}/{PRIMARY[1]}"]["errors"] == 1
+    assert stats[f"{PRIMARY[0]}/{PRIMARY[1]}"]["alternate_wins"] == 1
+    assert stats[f"{PRIMARY[0]}/{PRIMARY[1]}"]["hedges"] == 0
+
+
+def test_error_raised_when_all_attempts_fail(service):
+    service, providers = service
+    configure(providers, "ttft_ms=50,error_rate=1", "ttft_ms=50,error_rate=1")
+
+    with pytest.raises(Exception, match="API调用失败"):
+        run(service, collect)
+    stats = service.router.stats()["models"]
+    assert stats[f"{PRIMARY[0]}/{PRIMARY[1]}"]["errors"] == 1
+    assert stats[f"{SECONDARY[0]}/{SECONDARY[1]}"]["errors"] == 1
+
+
+def test_closing_stream_closes_winning_attempt(service):
+    service, providers = service
+    configure(providers, "ttft_ms=2000", "ttft_ms=100,tokens=50,interval_ms=50")
+
+    async def first_chunk(stream, started):
+        async for chunk in stream:
+            await stream.aclose()
+            return chunk
+
+    chunk, events = run(service, first_chunk)
+
+    assert chunk
+    # 调用方提前结束时，胜出的一路和落后的一路都已关闭
+    assert len(closed(events, PRIMARY[0])) == 1
+    assert len(closed(events, SECONDARY[0])) == 1
@@ -133,6 +133,28 @@ const Dashboard = () => {
     }
   };
 
+  // 轮询文档处理进度，直到后台任务结束
+  const waitForDocument = async (documentId) => {
+    while (true) {
+      const response = await axios.get(
+        `http://localhost:8000/api/documents/${documentId}/status`,
+        { headers: { Authorization: `Bearer ${token}` } }
+      );
+      const { status, summary_pending: summaryPending } = response.data;
+      if (status === 'failed') {
+        return response.data;
+      }
+      if (status === 'completed') {
+        // 文档入库后即可检索，摘要在后台生成，生成完成或失败前继续轮询
+        if (!summaryPending) {
+          return response.data;
+        }
+        setResult(response.data.message);
+      }
+      await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+  };
+
   const handleFileUpload = async (info) => {
     const { file } = info;
     if (!selectedProvider || !selectedModel) {
@@ -156,10 +178,17 @@ const Dashboard = () => {
           }
         }
       );
-      setResult(response.data.analysis);
+      const status = await waitForDocument(response.data.document_id);
+      if (status.status === 'failed') {
+        throw new Error(status.error);
+      }
+      if (status.summary_error) {
+        message.warning('文档已入库，摘要生成失败: ' + status.summary_error);
+      }
+      setResult(status.analysis || status.message);
       fetchHistory();
     } catch (error) {
-      message.error('文档处理失败: ' + (error.response?.data?.detail || '未知错误'));
+      message.error('文档处理失败: ' + (error.response?.data?.detail || error.message || '未知错误'));
     } finally {
       setLoading(false);
     }